@@ -0,0 +1,85 @@
+from utils import CompileError
+
+# Assembler: the stage between Compiler and VM.
+#
+# Compiler emits symbolic code: ('LABEL', name) marks a position, and JMP,
+# JMPZ, CALL, CALL_PURE and TAILCALL (and the superinstructions CMP_JMPZ and
+# CMP_CONST_JMPZ) name the label they go to. assemble()
+# removes the LABELs and replaces those names by the index of the
+# instruction the label was in front of:
+#
+#      ('JMPZ', 'LABEL_2')          ('JMPZ', 7)
+#      ('CALL', 'fib', 1)     ->    ('CALL', 2, 1)
+#
+# The result is a CodeObject. Addresses in it count from its first
+# instruction; the instructions holding one are listed in relocations, so
+# the code can be moved with relocate(). The symbol table (labels and the
+# functions called) is only there to name addresses for people: print_code
+# and the memo cache report use it, the VM does not.
+
+JUMPS = ('JMP', 'JMPZ', 'CMP_JMPZ', 'CMP_CONST_JMPZ')
+CALLS = ('CALL', 'CALL_PURE', 'TAILCALL')
+
+
+class CodeObject:
+    def __init__(self, code, labels, functions, relocations):
+        # Instruction tuples, with addresses in place of label names.
+        self.code = code
+        # Label name -> address.
+        self.labels = labels
+        # Address -> name of the function starting there.
+        self.functions = functions
+        # Indices of the instructions whose first operand is an address.
+        self.relocations = relocations
+
+    def __len__(self):
+        return len(self.code)
+
+    def __getitem__(self, index):
+        return self.code[index]
+
+    def relocate(self, base):
+        """A copy of the code to be placed at address base."""
+        code = list(self.code)
+        for i in self.relocations:
+            op = code[i]
+            code[i] = (op[0], op[1] + base, *op[2:])
+        return CodeObject(code,
+                          {name: address + base for name, address in self.labels.items()},
+                          {address + base: name for address, name in self.functions.items()},
+                          list(self.relocations))
+
+    def names(self):
+        """Address -> the labels there, function names first."""
+        names = {}
+        for address, name in self.functions.items():
+            names.setdefault(address, []).append(name)
+        for name, address in self.labels.items():
+            if name not in names.get(address, ()):
+                names.setdefault(address, []).append(name)
+        return names
+
+
+def assemble(instructions):
+    """The CodeObject of a Compiler instruction list."""
+    code = []
+    labels = {}
+    for op in instructions:
+        if op[0] == 'LABEL':
+            # Each label is emitted once: a function declared again in a
+            # block is not compiled (Compiler.function_symbol).
+            labels[op[1]] = len(code)
+        else:
+            code.append(op)
+    functions = {}
+    relocations = []
+    for i, op in enumerate(code):
+        if op[0] in JUMPS or op[0] in CALLS:
+            address = labels.get(op[1])
+            if address is None:
+                raise CompileError(f'Undefined label {op[1]}', pc=i)
+            if op[0] in CALLS:
+                functions[address] = op[1]
+            code[i] = (op[0], address, *op[2:])
+            relocations.append(i)
+    return CodeObject(code, labels, functions, relocations)
@@ -0,0 +1,870 @@
+import argparse
+import collections
+import contextlib
+import dis
+import gc
+import io
+import glob
+import inspect
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import sys
+import time
+import tracemalloc
+
+from cache import ASTCache, load_ast
+from flatast import NODE_KINDS, FlatAST
+from incremental import IncrementalFrontend
+from lexer import Lexer
+from model import *
+from optimizer import ASTOptimizer, FlatOptimizer
+from parser import Parser
+from utils import NvError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(HERE, 'scripts')
+
+
+def make_source(size):
+    """Repeat the sample scripts until the text is at least `size` bytes."""
+    parts = []
+    for filename in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.nv'))):
+        with open(filename, encoding='utf-8') as f:
+            parts.append(f.read())
+    chunk = '\n'.join(parts) + '\n'
+    return chunk * max(1, size // len(chunk) + 1)
+
+
+def make_functions(count):
+    """A program made of `count` small function declarations and calls."""
+    parts = []
+    for i in range(count):
+        parts.append(f'''func f{i}(a, b)
+  local t := a * {i} + b
+  if t > {i} then
+    t := t - 1
+  end
+  while t > 0 do
+    t := t - 2
+  end
+  ret t
+end
+println(f{i}({i}, 2))
+''')
+    return ''.join(parts)
+
+
+BINOPS = ('+', '-', '*', '/', '%', '^', '<', '<=', '>', '>=', '==', '~=', 'and', 'or')
+
+
+def make_expressions(count, seed=0, binops=BINOPS):
+    """`count` assignments of random, deeply nested expressions."""
+    rng = random.Random(seed)
+
+    def expr(depth):
+        if depth == 0 or rng.random() < 0.3:
+            return rng.choice(['x', 'y', 'total', str(rng.randrange(100)), '2.5', 'true', '"s"'])
+        r = rng.random()
+        if r < 0.1:
+            return rng.choice(['-', '~', '+']) + ' ' + expr(depth - 1)
+        if r < 0.2:
+            return f'({expr(depth - 1)})'
+        if r < 0.25:
+            return f'f({expr(depth - 1)}, {expr(depth - 1)})'
+        op = rng.choice(binops)
+        right = expr(depth - 1)
+        if op == '^' and right[0] in '-~+':
+            right = f'({right})'
+        return f'{expr(depth - 1)} {op} {right}'
+
+    return ''.join(f'x := {expr(6)}\n' for _ in range(count))
+
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_lexer(args):
+    source = make_source(args.size)
+    print(f'source: {len(source)} bytes')
+    results = {}
+    for name, legacy in (('legacy', True), ('regex', False)):
+        elapsed, tokens = timed(lambda: Lexer(source, legacy=legacy).tokenize(), args.repeat)
+        results[name] = tokens
+        print(f'{name:>8}: {elapsed:8.3f}s  {len(tokens) / elapsed:12,.0f} tokens/s')
+    same = [(t.token_type, t.lexeme, t.line) for t in results['legacy']] == \
+           [(t.token_type, t.lexeme, t.line) for t in results['regex']]
+    print(f'identical token streams: {same}')
+
+
+def measure(fn):
+    """Return (result, bytes still allocated by fn's result, peak bytes)."""
+    tracemalloc.start()
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def bench_token_memory(args):
+    source = make_source(args.size)
+    print(f'source: {len(source)} bytes')
+    tokens, size, _ = measure(lambda: Lexer(source).tokenize())
+    count = len(tokens)
+    print(f'Token list : {size / 2**20:8.1f} MiB  {size / count:6.1f} bytes/token')
+    del tokens
+    store, size, _ = measure(lambda: Lexer(source).tokenize_store())
+    print(f'TokenStore : {size / 2**20:8.1f} MiB  {size / count:6.1f} bytes/token')
+    for name, make in (('Token list', lambda: Lexer(source).tokenize()),
+                       ('TokenStore', lambda: Lexer(source).tokenize_store())):
+        elapsed, _ = timed(lambda: Parser(make()).parse(), 1)
+        _, _, peak = measure(lambda: Parser(make()).parse())
+        print(f'lex+parse with {name}: {elapsed:.3f}s, peak {peak / 2**20:.1f} MiB')
+
+
+def count_nodes(node):
+    """Number of AST nodes below node (operator tokens not included)."""
+    if isinstance(node, list):
+        return sum(count_nodes(item) for item in node)
+    if not isinstance(node, Node):
+        return 0
+    names = getattr(node, '__slots__', None) or vars(node)
+    return 1 + sum(count_nodes(getattr(node, name)) for name in names)
+
+
+def bench_ast_memory(args):
+    source = make_functions(args.functions) + make_expressions(args.functions)
+    print(f'source: {len(source)} bytes')
+    tokens = Lexer(source).tokenize()
+    ast, size, _ = measure(lambda: Parser(tokens).parse())
+    count = count_nodes(ast)
+    print(f'tree : {count:,} nodes, {size / 2**20:8.1f} MiB, {size / count:6.1f} bytes/node (incl. operator tokens)')
+    del ast
+    elapsed, _ = timed(lambda: Parser(tokens).parse(), args.repeat)
+    print(f'parse: {elapsed:8.3f}s  {count / elapsed:12,.0f} nodes/s')
+
+
+def walk_tree(node, counts):
+    """Count the nodes of an object tree by class name."""
+    if isinstance(node, list):
+        for item in node:
+            walk_tree(item, counts)
+    elif isinstance(node, Node):
+        name = type(node).__name__
+        counts[name] = counts.get(name, 0) + 1
+        for field in node.__slots__:
+            walk_tree(getattr(node, field), counts)
+
+
+def bench_flat_ast(args):
+    source = make_functions(args.functions) + make_expressions(args.functions)
+    print(f'source: {len(source)} bytes')
+    tokens = Lexer(source).tokenize()
+    elapsed, tree = timed(lambda: Parser(tokens).parse(), 1)
+    print(f'build  tree: {elapsed:8.3f}s (parse)')
+    elapsed, flat = timed(lambda: FlatAST.from_tree(tree), 1)
+    print(f'build  flat: {elapsed:8.3f}s (from_tree)   to_tree: {timed(flat.to_tree, 1)[0]:.3f}s')
+    del tokens, flat
+
+    _, tree_size, _ = measure(lambda: Parser(Lexer(source).iter_tokens()).parse())
+    flat, flat_size, _ = measure(lambda: FlatAST.from_tree(tree))
+    count = len(flat)
+    print(f'memory tree: {tree_size / 2**20:8.1f} MiB  {tree_size / count:6.1f} bytes/node')
+    print(f'memory flat: {flat_size / 2**20:8.1f} MiB  {flat_size / count:6.1f} bytes/node')
+
+    def flat_walk():
+        counts = [0] * len(NODE_KINDS)
+        kinds = flat.kinds
+        for i in flat.walk():
+            counts[kinds[i]] += 1
+        return counts
+
+    def flat_scan():
+        counts = [0] * len(NODE_KINDS)
+        for kind in flat.kinds:
+            counts[kind] += 1
+        return counts
+
+    elapsed, _ = timed(lambda: walk_tree(tree, {}), args.repeat)
+    print(f'walk   tree: {elapsed:8.3f}s')
+    elapsed, _ = timed(flat_walk, args.repeat)
+    print(f'walk   flat: {elapsed:8.3f}s (first/next links)')
+    elapsed, _ = timed(flat_scan, args.repeat)
+    print(f'scan   flat: {elapsed:8.3f}s (preorder = array order)')
+
+    elapsed, _ = timed(gc.collect, args.repeat)
+    print(f'gc.collect with tree alive: {elapsed:8.3f}s')
+    del tree
+    gc.collect()
+    elapsed, _ = timed(gc.collect, args.repeat)
+    print(f'gc.collect with flat only : {elapsed:8.3f}s')
+
+    # Constant folding. Without ^, which folds random operands to numbers
+    # too large to compute. Both optimizers rewrite the tree they are given.
+    source = make_functions(args.functions) + make_expressions(args.functions, binops=BINOPS[:5] + BINOPS[6:])
+    flat = FlatAST.from_tree(Parser(Lexer(source).iter_tokens()).parse())
+    tree_time = flat_time = None
+    for _ in range(args.repeat):
+        tree = flat.to_tree()
+        elapsed, tree = timed(lambda: ASTOptimizer().optimize(tree), 1)
+        tree_time = elapsed if tree_time is None else min(tree_time, elapsed)
+        copy = FlatAST.from_tree(flat.to_tree())
+        elapsed, optimized = timed(lambda: FlatOptimizer(copy).optimize(), 1)
+        flat_time = elapsed if flat_time is None else min(flat_time, elapsed)
+    expected = FlatAST.from_tree(tree)
+    got = FlatAST.from_tree(optimized.to_tree())
+    same = all(getattr(got, column) == getattr(expected, column)
+               for column in ('kinds', 'first', 'next', 'ops', 'lines', 'values', 'literals'))
+    print(f'optimize tree: {tree_time:8.3f}s (ASTOptimizer)')
+    print(f'optimize flat: {flat_time:8.3f}s (FlatOptimizer)   {len(got):,} of {len(flat):,} nodes left, identical: {same}')
+
+def chain_dispatch(node):
+    # The isinstance chain of the old Interpreter.interpret, in its order.
+    if isinstance(node, Integer):
+        return 0
+    elif isinstance(node, Float):
+        return 1
+    elif isinstance(node, String):
+        return 2
+    elif isinstance(node, Bool):
+        return 3
+    elif isinstance(node, Grouping):
+        return 4
+    elif isinstance(node, Identifier):
+        return 5
+    elif isinstance(node, Assignment):
+        return 6
+    elif isinstance(node, BinOp):
+        return 7
+    elif isinstance(node, UnOp):
+        return 8
+    elif isinstance(node, LogicalOp):
+        return 9
+    elif isinstance(node, Stmts):
+        return 10
+    elif isinstance(node, PrintStmt):
+        return 11
+    elif isinstance(node, IfStmt):
+        return 12
+    elif isinstance(node, WhileStmt):
+        return 13
+    elif isinstance(node, ForStmt):
+        return 14
+    elif isinstance(node, FuncCall):
+        return 15
+    elif isinstance(node, FuncDecl):
+        return 16
+    elif isinstance(node, FuncCallStmt):
+        return 17
+    elif isinstance(node, RetStmt):
+        return 18
+    elif isinstance(node, LocalStmt):
+        return 19
+
+
+class TableDispatch(NodeVisitor):
+    def visit_Node(self, node):
+        return 0
+
+
+def bench_dispatch(args):
+    tree = Parser(Lexer(make_functions(args.functions) + make_expressions(args.functions)).tokenize()).parse()
+    nodes = []
+
+    def collect(node):
+        if isinstance(node, list):
+            for item in node:
+                collect(item)
+        elif isinstance(node, Node):
+            nodes.append(node)
+            for field in node.__slots__:
+                collect(getattr(node, field))
+
+    collect(tree)
+    print(f'{len(nodes):,} nodes')
+    by_class = {}
+    for node in nodes:
+        by_class.setdefault(type(node), []).append(node)
+    walker = TableDispatch()
+    dispatch = walker.dispatch
+
+    def run_chain(nodes):
+        for node in nodes:
+            chain_dispatch(node)
+
+    def run_table(nodes):
+        for node in nodes:
+            dispatch[type(node)](walker, node)
+
+    def run_empty(nodes):
+        for node in nodes:
+            pass
+
+    base, _ = timed(lambda: run_empty(nodes), args.repeat)
+    for name, fn in (('isinstance chain', run_chain), ('type table', run_table)):
+        elapsed, _ = timed(lambda: fn(nodes), args.repeat)
+        print(f'{name:>16}: {(elapsed - base) / len(nodes) * 1e9:6.1f} ns/node')
+    print('per class (chain / table, ns/node):')
+    for cls, group in sorted(by_class.items(), key=lambda item: -len(item[1])):
+        base, _ = timed(lambda: run_empty(group), args.repeat)
+        chain, _ = timed(lambda: run_chain(group), args.repeat)
+        table, _ = timed(lambda: run_table(group), args.repeat)
+        print(f'{cls.__name__:>14} {len(group):9,}  {(chain - base) / len(group) * 1e9:6.1f} / {(table - base) / len(group) * 1e9:6.1f}')
+
+
+def bench_parser(args):
+    source = make_expressions(args.count)
+    tokens = Lexer(source).tokenize()
+    print(f'source: {len(source)} bytes, {len(tokens)} tokens')
+    elapsed, _ = timed(lambda: Parser(tokens).parse(), args.repeat)
+    print(f'parse: {elapsed:8.3f}s  {len(tokens) / elapsed:12,.0f} tokens/s')
+
+
+def bench_incremental(args):
+    source = make_functions(args.functions)
+    print(f'source: {len(source)} bytes, {args.functions} functions')
+    elapsed, _ = timed(lambda: Parser(Lexer(source).tokenize()).parse(), 1)
+    print(f'full parse      : {elapsed * 1000:9.2f} ms')
+    frontend = IncrementalFrontend(source)
+    rng = random.Random(0)
+    total = 0.0
+    for _ in range(args.edits):
+        # Retype a digit inside a random function body.
+        offset = frontend.source.index(' * ', rng.randrange(len(frontend.source) - 100)) + 3
+        t0 = time.perf_counter()
+        frontend.edit(offset, 1, str(rng.randrange(10)))
+        total += time.perf_counter() - t0
+    print(f'incremental edit: {total / args.edits * 1000:9.2f} ms (mean of {args.edits})')
+    total = 0.0
+    for _ in range(args.edits):
+        # Add a line inside a random function: the later statements move down.
+        offset = frontend.source.index('ret t', rng.randrange(len(frontend.source) - 100))
+        t0 = time.perf_counter()
+        frontend.edit(offset, 0, '\n')
+        total += time.perf_counter() - t0
+    print(f'newline edit    : {total / args.edits * 1000:9.2f} ms (mean of {args.edits})')
+    t0 = time.perf_counter()
+    frontend.ast
+    print(f'next .ast       : {(time.perf_counter() - t0) * 1000:9.2f} ms (moves the lines of the statements the edits moved)')
+
+
+def bench_cache(args):
+    directory = tempfile.mkdtemp(prefix='nv-cache-')
+    try:
+        filename = os.path.join(directory, 'program.nv')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(make_functions(args.functions))
+        print(f'source: {os.path.getsize(filename)} bytes, {args.functions} functions')
+        for optimize in (False, True):
+            cache = ASTCache(os.path.join(directory, 'cache'))
+            cold, _ = timed(lambda: load_ast(filename, optimize, cache), 1)
+            warm, _ = timed(lambda: load_ast(filename, optimize, cache), args.repeat)
+            size = os.path.getsize(cache.path(cache.key_file(filename, optimize)))
+            print(f'-O={int(optimize)}  miss: {cold * 1000:8.1f} ms   hit: {warm * 1000:8.1f} ms'
+                  f'   {cold / warm:5.1f}x   entry {size / 1024:.0f} KiB')
+    finally:
+        shutil.rmtree(directory)
+
+
+# Engine workloads: loops with arithmetic and branches, recursive calls, and
+# returns from inside nested statements.
+LOOP_PROGRAM = '''
+total := 0
+for i := 0, {n} do
+  if i % 3 == 0 then
+    total := total + i * 2
+  else
+    total := total - 1
+  end
+end
+println(total)
+'''
+NESTED_PROGRAM = '''
+count := 0
+for i := 0, {n} do
+  for j := 0, {n} do
+    if j > i then
+      count := count + 1
+    end
+  end
+end
+println(count)
+'''
+RETURN_PROGRAM = '''
+func find(limit)
+  local i := 0
+  while i < limit do
+    if i == limit - 1 then
+      ret i
+    end
+    i := i + 1
+  end
+  ret -1
+end
+total := 0
+for k := 0, {n} do
+  total := total + find(3)
+end
+println(total)
+'''
+CALL_PROGRAM = '''
+func fib(n)
+  if n < 2 then
+    ret n
+  end
+  ret fib(n - 1) + fib(n - 2)
+end
+println(fib({n}))
+'''
+# Tail recursion: deeper than Python's recursion limit, so it only runs in
+# engines that reuse the frame for `ret f(...)`.
+TAIL_PROGRAM = '''
+func count(n, acc)
+  if n == 0 then
+    ret acc
+  end
+  ret count(n - 1, acc + 1)
+end
+println(count({n}, 0))
+'''
+PRINT_PROGRAM = '''
+for i := 0, {n} do
+  print("line ")
+  print(i)
+  println("\\t" + i / 4)
+end
+'''
+
+
+def run_interp(ast):
+    from interpreter import Interpreter
+    Interpreter().interpret_ast(ast)
+
+
+def run_closure(ast):
+    from closures import ClosureCompiler
+    ClosureCompiler().interpret_ast(ast)
+
+
+def run_vm(ast):
+    from compiler import Compiler
+    from vm import VM
+    VM().run(Compiler().compile_code(ast))
+
+
+def run_regvm(ast):
+    from regcompiler import RegCompiler
+    from regvm import RegVM
+    RegVM().run(RegCompiler().compile_code(ast))
+
+
+def run_interp_memo(ast):
+    from interpreter import Interpreter
+    from memo import Memoizer
+    Interpreter(Memoizer()).interpret_ast(ast)
+
+
+def run_vm_memo(ast):
+    from compiler import Compiler
+    from memo import Memoizer
+    from vm import VM
+    VM(Memoizer()).run(Compiler(memoize=True).compile_code(ast))
+
+
+ENGINES = {
+    'interp': run_interp,
+    'closure': run_closure,
+    'vm': run_vm,
+    'regvm': run_regvm,
+    'interp-memo': run_interp_memo,
+    'vm-memo': run_vm_memo,
+}
+
+
+def run_captured(run, ast):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        run(ast)
+    return out.getvalue()
+
+
+def count_tuples(fn):
+    """
+    Run fn under a tracer and count the tuples Python code builds on the way
+    (BUILD_TUPLE instructions), which is where the engines allocate values.
+    Tracing makes the run some 50x slower.
+    """
+    build_tuple = dis.opmap['BUILD_TUPLE']
+    count = 0
+
+    def trace(frame, event, arg):
+        nonlocal count
+        frame.f_trace_opcodes = True
+        if event == 'opcode' and frame.f_code.co_code[frame.f_lasti] == build_tuple:
+            count += 1
+        return trace
+
+    sys.settrace(trace)
+    try:
+        fn()
+    finally:
+        sys.settrace(None)
+    return count
+
+
+def bench_engines(args):
+    workloads = (('loop', LOOP_PROGRAM.format(n=args.loop)),
+                 ('nested', NESTED_PROGRAM.format(n=args.nested)),
+                 ('calls', CALL_PROGRAM.format(n=args.fib)),
+                 ('returns', RETURN_PROGRAM.format(n=args.returns)),
+                 ('tail', TAIL_PROGRAM.format(n=args.tail)),
+                 ('prints', PRINT_PROGRAM.format(n=args.prints)))
+    names = args.engine or list(ENGINES)
+    for workload, source in workloads:
+        ast = Parser(Lexer(source).tokenize()).parse()
+        print(f'{workload}:')
+        base = None
+        expected = None
+        for name in names:
+            try:
+                elapsed, output = timed(lambda: run_captured(ENGINES[name], ast), args.repeat)
+            except NvError as error:
+                print(f'  {name:>11}: fails: {error}')
+                continue
+            base = base or elapsed
+            if expected is None:
+                expected = output
+            same = 'same output' if output == expected else 'OUTPUT DIFFERS'
+            tuples = ''
+            if args.allocs:
+                tuples = f'  {count_tuples(lambda: run_captured(ENGINES[name], ast)):12,} tuples'
+            print(f'  {name:>11}: {elapsed:8.3f}s  {base / elapsed:5.2f}x{tuples}  {same}')
+
+
+def count_instructions(run, pairs=None, machine=None):
+    """
+    Call run (a run of machine, VM by default, or RegVM) under a tracer and
+    count the instructions it executes: the line of machine.run that fetches
+    the next one. Tracing makes it slow. If pairs (a Counter) is given, also
+    count each (opcode name, next opcode name) executed.
+    """
+    if machine is None:
+        from vm import VM as machine
+    opcodes = sys.modules[machine.__module__].OPCODES
+    lines, first = inspect.getsourcelines(machine.run)
+    fetch = first + next(i for i, line in enumerate(lines) if 'code[pc]' in line)
+    run_code = machine.run.__code__
+    count = 0
+    previous = None
+
+    def trace(frame, event, arg):
+        nonlocal count, previous
+        if frame.f_code is not run_code:
+            return None
+        if event == 'line' and frame.f_lineno == fetch:
+            count += 1
+            if pairs is not None:
+                f_locals = frame.f_locals
+                name = opcodes[f_locals['code'][f_locals['pc']][0]]
+                if previous is not None:
+                    pairs[previous, name] += 1
+                previous = name
+        return trace
+
+    sys.settrace(trace)
+    try:
+        run()
+    finally:
+        sys.settrace(None)
+    return count
+
+
+def bench_vm(args):
+    """The stack VM and the register VM (regvm.py) on the same programs."""
+    from compiler import Compiler
+    from regcompiler import RegCompiler
+    from regvm import RegVM
+    from vm import VM
+    machines = (('stack', Compiler, VM), ('register', RegCompiler, RegVM))
+    workloads = (('loop', LOOP_PROGRAM.format(n=args.loop)),
+                 ('returns', RETURN_PROGRAM.format(n=args.returns)),
+                 ('calls', CALL_PROGRAM.format(n=args.fib)),
+                 ('tail', TAIL_PROGRAM.format(n=args.tail)))
+    for workload, source in workloads:
+        ast = Parser(Lexer(source).tokenize()).parse()
+        base = None
+        for name, compiler, machine in machines:
+            code = compiler().compile_code(ast)
+
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    machine().run(code)
+
+            elapsed, _ = timed(run, args.repeat)
+            base = base or elapsed
+            count = count_instructions(run, machine=machine)
+            label = workload if name == 'stack' else ''
+            print(f'{label:>8} {name:>8}: {count:12,} instructions  {elapsed:8.3f}s  '
+                  f'{count / elapsed / 1e6:6.2f}M instructions/s  {base / elapsed:5.2f}x')
+
+
+def bench_peephole(args):
+    from compiler import Compiler
+    from peephole import RULES, Peephole, size
+    from vm import VM
+    programs = [(os.path.basename(name), open(name, encoding='utf-8').read())
+                for name in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.nv'))) + args.files]
+    programs += [('loop', LOOP_PROGRAM.format(n=args.loop)),
+                 ('returns', RETURN_PROGRAM.format(n=args.returns)),
+                 ('calls', CALL_PROGRAM.format(n=args.fib)),
+                 ('tail', TAIL_PROGRAM.format(n=args.tail)),
+                 ('prints', PRINT_PROGRAM.format(n=args.prints))]
+    peephole = Peephole()
+    totals = [0, 0, 0, 0]
+    print(f'{"program":>16} {"static":>14} {"executed":>22}')
+    for name, source in programs:
+        try:
+            before = Compiler().compile_code(Parser(Lexer(source).tokenize()).parse())
+        except NvError as error:
+            print(f'{name:>16}: fails: {error}')
+            continue
+        after = peephole.optimize(before)
+        sizes = [size(before), size(after)]
+        counts = []
+        for code in (before, after):
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    VM().run(code)
+            try:
+                counts.append(count_instructions(run))
+            except NvError:
+                counts.append(None)
+        executed = 'fails'
+        if None not in counts:
+            executed = f'{counts[0]:9,} -> {counts[1]:9,}'
+            for i in range(4):
+                totals[i] += (sizes + counts)[i]
+        grown = '  LARGER' if sizes[1] > sizes[0] else ''
+        print(f'{name:>16} {sizes[0]:5} -> {sizes[1]:5} {executed:>22}{grown}')
+    print(f'{"total":>16} {totals[0]:5} -> {totals[1]:5} {totals[2]:9,} -> {totals[3]:9,}'
+          f'  ({100 * (1 - totals[1] / max(totals[0], 1)):.1f}% / {100 * (1 - totals[3] / max(totals[2], 1)):.1f}% fewer)')
+    print()
+    for rule in RULES:
+        print(f'{rule:>16}: {peephole.hits[rule]:6} hits {-peephole.removed[rule]:+6} instructions')
+
+
+def bench_superinstructions(args):
+    from compiler import Compiler
+    from peephole import Peephole
+    from superinstructions import Fuser
+    from vm import VM
+    workloads = (('loop', LOOP_PROGRAM.format(n=args.loop)),
+                 ('returns', RETURN_PROGRAM.format(n=args.returns)),
+                 ('calls', CALL_PROGRAM.format(n=args.fib)),
+                 ('tail', TAIL_PROGRAM.format(n=args.tail)),
+                 ('prints', PRINT_PROGRAM.format(n=args.prints)))
+    fuser = Fuser()
+    pairs = collections.Counter()
+    fused_pairs = collections.Counter()
+    print(f'{"":>8} {"plain":>23} {"-O without fusion":>23} {"-O":>23}')
+    for workload, source in workloads:
+        plain = Compiler().compile_code(Parser(Lexer(source).tokenize()).parse())
+        optimized = Peephole().optimize(plain)
+        fused = fuser.fuse(optimized)
+        row = []
+        for code, counter in ((plain, None), (optimized, pairs), (fused, fused_pairs)):
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    VM().run(code)
+            elapsed, _ = timed(run, args.repeat)
+            row.append((count_instructions(run, counter), elapsed))
+        print(f'{workload:>8} ' + ' '.join(f'{count:10,} {elapsed:7.3f}s {row[0][1] / elapsed:4.2f}x'
+                                           for count, elapsed in row))
+    for title, counter in (('pairs executed without fusion', pairs), ('pairs executed with fusion', fused_pairs)):
+        total = sum(counter.values()) or 1
+        print(f'\n{title}:')
+        for (first, second), count in counter.most_common(args.pairs):
+            print(f'  {first + " " + second:<32} {count:10,} {100 * count / total:5.1f}%')
+    print('\nsuperinstructions placed:')
+    for name, hits in fuser.hits.items():
+        print(f'  {name:<16} {hits:4}')
+
+
+# What a run of each mode imports before it executes anything, and the most
+# it may add (in ms, with bytecode on disk) to the start-up of a bare python.
+# Only the llvm mode pays for llvmlite.
+STARTUP_MODES = {
+    'entry': ('import nv', 10),
+    'interp': ('import nv, cache, interpreter', 15),
+    'closure': ('import nv, cache, closures', 15),
+    'vm': ('import nv, cache, compiler, vm', 15),
+    'regvm': ('import nv, cache, regcompiler, regvm', 15),
+    'llvm': ('import nv, cache, llvm', 40),
+}
+
+
+def run_python(code, *options, env=None):
+    """Wall time of a fresh `python [options] -c code`, and its stderr."""
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, *options, '-c', code], cwd=HERE, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - t0
+    return elapsed, proc.returncode, proc.stderr
+
+
+def import_times(code, *options, env=None):
+    """(self us, cumulative us, module) for every module `code` imports."""
+    _, _, stderr = run_python(code, *options, '-X', 'importtime', env=env)
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|')
+        rows.append((int(own), int(total), name.strip()))
+    return rows
+
+
+def bench_startup(args):
+    env = dict(os.environ)
+    options = ()
+    if args.no_bytecode:
+        # Compile every module from source, as on a first run.
+        cold_dir = tempfile.mkdtemp(prefix='nv-pycache-')
+        options = ('-B', '-X', f'pycache_prefix={cold_dir}')
+    else:
+        # Measure what repeated batch runs see: bytecode already on disk.
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+    bare = min(run_python('pass', *options, env=env)[0] for _ in range(args.repeat))
+    baseline = {name for _, _, name in import_times('pass', *options, env=env)}
+    print(f'bare python: {bare * 1000:7.1f} ms')
+    over = False
+    for mode, (code, budget) in STARTUP_MODES.items():
+        budget *= args.budget_scale
+        elapsed, status, stderr = run_python(code, *options, env=env)
+        if status != 0:
+            print(f'{mode:>7}: skipped ({stderr.strip().splitlines()[-1]})')
+            continue
+        elapsed = min(run_python(code, *options, env=env)[0] for _ in range(args.repeat))
+        extra = (elapsed - bare) * 1000
+        verdict = 'ok' if extra <= budget else 'OVER'
+        over = over or verdict == 'OVER'
+        print(f'{mode:>7}: {elapsed * 1000:7.1f} ms   +{extra:6.1f} ms   budget +{budget:.0f} ms   {verdict}')
+        rows = sorted((row for row in import_times(code, *options, env=env) if row[2] not in baseline),
+                      reverse=True)
+        for own, total, name in rows[:args.top]:
+            print(f'         {own / 1000:6.1f} ms self  {total / 1000:6.1f} ms cumulative  {name}')
+    if args.no_bytecode:
+        shutil.rmtree(cold_dir)
+    if over:
+        sys.exit(1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='nv micro-benchmarks')
+    sub = ap.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('lexer', help='tokens/second of the lexer engines')
+    p.add_argument('--size', type=int, default=2_000_000, help='source size in bytes')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_lexer)
+
+    p = sub.add_parser('tokens-memory', help='Token objects versus the TokenStore arrays')
+    p.add_argument('--size', type=int, default=5_000_000, help='source size in bytes')
+    p.set_defaults(func=bench_token_memory)
+
+    p = sub.add_parser('ast-memory', help='size of the AST and the cost of building it')
+    p.add_argument('--functions', type=int, default=20000)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_ast_memory)
+
+    p = sub.add_parser('flat-ast', help='object tree versus FlatAST')
+    p.add_argument('--functions', type=int, default=20000)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_flat_ast)
+
+    p = sub.add_parser('dispatch', help='isinstance chains versus NodeVisitor tables')
+    p.add_argument('--functions', type=int, default=5000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_dispatch)
+
+    p = sub.add_parser('parser', help='parse speed on expression-heavy code')
+    p.add_argument('--count', type=int, default=20000, help='number of assignments')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_parser)
+
+    p = sub.add_parser('incremental', help='edit latency of IncrementalFrontend')
+    p.add_argument('--functions', type=int, default=5000)
+    p.add_argument('--edits', type=int, default=200)
+    p.set_defaults(func=bench_incremental)
+
+    p = sub.add_parser('cache', help='front end versus AST cache hits')
+    p.add_argument('--functions', type=int, default=5000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser('engines', help='execution engines on loop- and call-heavy programs')
+    p.add_argument('--loop', type=int, default=200000, help='iterations of the loop program')
+    p.add_argument('--nested', type=int, default=300, help='bound of both nested loops')
+    p.add_argument('--fib', type=int, default=22, help='argument of the recursive fib program')
+    p.add_argument('--returns', type=int, default=30000, help='calls that return from inside a loop')
+    p.add_argument('--tail', type=int, default=100000, help='depth of the tail-recursive program')
+    p.add_argument('--prints', type=int, default=30000, help='iterations of the print statement loop')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--allocs', action='store_true',
+                   help='also count the tuples each run builds (traced, so use small workloads)')
+    p.add_argument('--engine', action='append', choices=list(ENGINES),
+                   help='engine to run (repeatable, default all; the first is the baseline)')
+    p.set_defaults(func=bench_engines)
+
+    p = sub.add_parser('vm', help='instructions and run time of the stack and register VMs')
+    p.add_argument('--loop', type=int, default=200000, help='iterations of the loop program')
+    p.add_argument('--returns', type=int, default=30000, help='calls that return from inside a loop')
+    p.add_argument('--fib', type=int, default=22, help='argument of the recursive fib program')
+    p.add_argument('--tail', type=int, default=100000, help='depth of the tail-recursive program')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_vm)
+
+    p = sub.add_parser('peephole', help='instructions removed by the peephole optimizer, per rule')
+    p.add_argument('files', nargs='*', help='more nv programs to compile (besides scripts/)')
+    p.add_argument('--loop', type=int, default=2000, help='iterations of the loop program')
+    p.add_argument('--returns', type=int, default=300, help='calls that return from inside a loop')
+    p.add_argument('--fib', type=int, default=12, help='argument of the recursive fib program')
+    p.add_argument('--tail', type=int, default=1000, help='depth of the tail-recursive program')
+    p.add_argument('--prints', type=int, default=300, help='iterations of the print statement loop')
+    p.set_defaults(func=bench_peephole)
+
+    p = sub.add_parser('superinstructions', help='dispatches and run time with and without fused opcodes')
+    p.add_argument('--loop', type=int, default=20000, help='iterations of the loop program')
+    p.add_argument('--returns', type=int, default=3000, help='calls that return from inside a loop')
+    p.add_argument('--fib', type=int, default=16, help='argument of the recursive fib program')
+    p.add_argument('--tail', type=int, default=10000, help='depth of the tail-recursive program')
+    p.add_argument('--prints', type=int, default=3000, help='iterations of the print statement loop')
+    p.add_argument('--pairs', type=int, default=10, help='most executed instruction pairs to list')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_superinstructions)
+
+    p = sub.add_parser('startup', help='import cost of each mode against a budget')
+    p.add_argument('--repeat', type=int, default=10)
+    p.add_argument('--budget-scale', type=float, default=1.0,
+                   help='multiply the per-mode budgets (slow machines, --no-bytecode)')
+    p.add_argument('--top', type=int, default=5, help='slowest imports to list per mode')
+    p.add_argument('--no-bytecode', action='store_true', help='compile every module from source')
+    p.set_defaults(func=bench_startup)
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
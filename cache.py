@@ -0,0 +1,238 @@
+import gc
+import hashlib
+import marshal
+import os
+import sys
+import zlib
+
+import model
+from model import *
+from tokens import *
+
+# Content-addressed cache of front-end results.
+#
+# An entry is keyed by the sha256 of the source bytes, the cache format
+# version, the optimization flags and a fingerprint of the front-end modules
+# (so editing the lexer, parser or optimizer invalidates old entries). It holds
+# the tree produced by Parser (and ASTOptimizer with -O) as a zlib-compressed
+# marshal dump of plain tuples: every node becomes (schema, field values...),
+# where schema indexes a (class name, field names) table stored once per
+# entry. Loading an entry rebuilds the nodes without running Lexer, Parser or ASTOptimizer.
+#
+# Entries are written to a temporary file and renamed into place, so
+# concurrent runs only ever see complete entries. A hit refreshes the entry's
+# mtime; when the directory grows past its size limit the least recently used
+# entries are removed.
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'nv')
+DEFAULT_MAX_BYTES = 64 * 2**20
+FRONTEND_MODULES = ('tokens.py', 'lexer.py', 'parser.py', 'model.py', 'optimizer.py', 'cache.py')
+HASH_CHUNK = 1 << 16
+
+_fingerprint = None
+
+
+def frontend_fingerprint():
+    """Hash of the modules whose output is cached."""
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in FRONTEND_MODULES:
+            with open(os.path.join(here, name), 'rb') as f:
+                digest.update(f.read())
+        _fingerprint = digest.digest()
+    return _fingerprint
+
+
+def encode(tree):
+    """Turn a tree into marshal-able tuples: (schemas, encoded root)."""
+    schemas = []
+    schema_ids = {}
+
+    def enc(value):
+        if isinstance(value, list):
+            return [enc(item) for item in value]
+        if isinstance(value, (Node, Token)):
+            cls = type(value)
+            fields = tuple(getattr(value, '__slots__', None) or vars(value))
+            key = (cls.__name__, fields)
+            schema = schema_ids.get(key)
+            if schema is None:
+                schema = schema_ids[key] = len(schemas)
+                schemas.append(key)
+            # Resolver annotations belong to one run, not to the source.
+            resolved = getattr(cls, 'resolved', ())
+            return (schema,) + tuple(None if name in resolved else enc(getattr(value, name)) for name in fields)
+        return value
+
+    root = enc(tree)
+    return tuple(schemas), root
+
+
+def decode(data):
+    """Inverse of encode()."""
+    schemas, root = data
+    table = []
+    for class_name, fields in schemas:
+        cls = Token if class_name == 'Token' else getattr(model, class_name)
+        table.append((cls, fields))
+    new = object.__new__
+
+    def dec(value):
+        cls, fields = table[value[0]]
+        node = new(cls)
+        for name, item in zip(fields, value[1:]):
+            kind = type(item)
+            if kind is tuple:
+                item = dec(item)
+            elif kind is list:
+                item = [dec(x) if type(x) is tuple else x for x in item]
+            setattr(node, name, item)
+        return node
+
+    return dec(root)
+
+
+class ASTCache:
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.environ.get('NV_CACHE_DIR') or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('NV_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+
+    def key(self, source, optimize=False):
+        """Cache key of a source text (str or bytes) and front-end flags."""
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        digest = self.new_digest(optimize)
+        digest.update(source)
+        return digest.hexdigest()
+
+    def key_file(self, filename, optimize=False):
+        """Like key(), hashing the file in chunks instead of reading it whole."""
+        digest = self.new_digest(optimize)
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def new_digest(self, optimize):
+        digest = hashlib.sha256()
+        header = f'nv-ast {CACHE_VERSION} {marshal.version} {sys.version_info[:2]} O={int(bool(optimize))}\n'
+        digest.update(header.encode('ascii'))
+        digest.update(frontend_fingerprint())
+        return digest
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.ast')
+
+    def get(self, key):
+        """The cached tree for key, or None."""
+        path = self.path(key)
+        # Building a tree only allocates, so the cyclic GC would scan the
+        # growing tree over and over for nothing.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, 'rb') as f:
+                tree = decode(marshal.loads(zlib.decompress(f.read())))
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError, IndexError, AttributeError, zlib.error):
+            # Truncated or foreign file: drop it and parse again.
+            self.remove(path)
+            return None
+        finally:
+            if enabled:
+                gc.enable()
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return tree
+
+    def put(self, key, tree):
+        """Store tree under key. Failures to write only cost the cache."""
+        import tempfile
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(zlib.compress(marshal.dumps(encode(tree)), 1))
+                os.replace(tmp, self.path(key))
+            except BaseException:
+                self.remove(tmp)
+                raise
+        except (OSError, ValueError):
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the directory fits max_bytes."""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.ast'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        except OSError:
+            return
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cache_enabled():
+    return os.environ.get('NV_NO_CACHE', '') in ('', '0')
+
+
+def load_ast(filename, optimize=False, cache=None):
+    """
+    Parse (and with optimize, optimize) the program in filename, going through
+    the AST cache. Set NV_NO_CACHE=1 to bypass it.
+    """
+    if cache is None and cache_enabled():
+        cache = ASTCache()
+    key = None
+    if cache is not None:
+        key = cache.key_file(filename, optimize)
+        ast = cache.get(key)
+        if ast is not None:
+            if DEBUG:
+                verify(ast)
+            return ast
+    # A hit never touches the front end, so it is only imported on a miss.
+    from lexer import Lexer
+    from parser import Parser
+    with open(filename, encoding='utf-8') as f:
+        ast = Parser(Lexer(f).iter_tokens()).parse()
+    if optimize:
+        from optimizer import ASTOptimizer
+        ast = ASTOptimizer().optimize(ast)
+        if DEBUG:
+            verify(ast)
+    if cache is not None and cache.key_file(filename, optimize) == key:
+        # Skip the store if the file changed while it was being parsed.
+        cache.put(key, ast)
+    return ast
@@ -0,0 +1,380 @@
+import glob
+import io
+import os
+import random
+import sys
+
+from lexer import Lexer
+from model import *
+from output import Output
+from parser import Parser
+from utils import *
+
+# Checks of behavior the bench workloads do not exercise: edge cases of the
+# front end and agreement between the engines. Run with `python checks.py`
+# (or `make check`); prints the failed checks and exits with 1 if any failed.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(HERE, 'scripts')
+
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def parse(source):
+    return Parser(Lexer(source).iter_tokens()).parse()
+
+
+def run_interp(ast, output):
+    from interpreter import Interpreter
+    Interpreter(output=output).interpret_ast(ast)
+
+
+def run_closure(ast, output):
+    from closures import ClosureCompiler
+    ClosureCompiler(output).interpret_ast(ast)
+
+
+def run_vm(ast, output):
+    from compiler import Compiler
+    from vm import VM
+    VM(output=output).run(Compiler().compile_code(ast))
+
+
+def run_vm_optimized(ast, output):
+    # What nv.py -O runs, minus the constant folding.
+    from compiler import Compiler
+    from peephole import Peephole
+    from superinstructions import Fuser
+    from vm import VM
+    VM(output=output).run(Fuser().fuse(Peephole().optimize(Compiler().compile_code(ast))))
+
+
+def run_regvm(ast, output):
+    from regcompiler import RegCompiler
+    from regvm import RegVM
+    RegVM(output).run(RegCompiler().compile_code(ast))
+
+
+ENGINES = {
+    'interp': run_interp,
+    'closure': run_closure,
+    'vm': run_vm,
+    'vm-O': run_vm_optimized,
+    'regvm': run_regvm,
+}
+
+
+def run(engine, source, message=False):
+    """
+    (output, class name of the NvError raised or None) of a run of source;
+    with message, the error's message (without line or pc) is added.
+    """
+    stream = io.StringIO()
+    error = None
+    try:
+        ENGINES[engine](parse(source), Output(stream=stream))
+    except NvError as raised:
+        error = raised
+    result = (stream.getvalue(), type(error).__name__ if error else None)
+    if message:
+        result += (error.message if error else None,)
+    return result
+
+
+def expect_error(error_type, fn, *args):
+    try:
+        fn(*args)
+    except error_type:
+        return
+    except Exception as error:
+        raise AssertionError(f'expected {error_type.__name__}, got {type(error).__name__}: {error}')
+    raise AssertionError(f'expected {error_type.__name__}, nothing raised')
+
+
+# Programs that parse, and the number of top-level statements they have.
+PARSES = (
+    ('', 0),
+    ('-- only a comment\n', 0),
+    ('\n\n   \n', 0),
+    ('println 1\n', 1),
+    ('x := 1\nif x == 1 then println x else println 0 end\n', 2),
+)
+
+# Programs Parser rejects.
+PARSE_ERRORS = (
+    'end\n',
+    'else\n',
+    'end\nprintln 1\n',
+    'println 1\nend\n',
+    'if true then println 1\n',
+    'println (1 + 2\n',
+)
+
+
+@check
+def check_parser():
+    for source, count in PARSES:
+        ast = parse(source)
+        assert len(ast.stmts) == count, f'{source!r}: {len(ast.stmts)} statements, expected {count}'
+    for source in PARSE_ERRORS:
+        expect_error(ParseError, parse, source)
+    # A lexing error past the point where the parser gives up still stops it.
+    expect_error(NvError, parse, 'end\n$\n')
+    expect_error(LexingError, parse, 'println 1\n$\n')
+
+
+# String literals and the values the parser gives them. Without a backslash
+# the value is the text between the quotes, which is what every backend,
+# LLVM's included, printed before escapes were decoded at parse time.
+STRINGS = (
+    ('"plain text"', 'plain text'),
+    ("'single quoted'", 'single quoted'),
+    ('"a\\tb\\n"', 'a\tb\n'),
+    ('"\\\\"', '\\'),
+    ('"\\"', '\\'),
+    ('"ends with \\"', 'ends with \\'),
+    ('"\\x41\\u00e9"', 'A\\u00e9'),
+)
+
+
+@check
+def check_string_literals():
+    for literal, value in STRINGS:
+        got = parse(f'println {literal}\n').stmts[0].value.value
+        assert got == value, f'{literal}: {got!r}, expected {value!r}'
+    expect_error(ParseError, parse, 'println "\\x4"\n')
+
+
+# Programs that fail, in some phase, on every engine.
+MALFORMED = PARSE_ERRORS + (
+    '"unterminated\n',
+    'x := 1 $ 2\n',
+    'println "\\x4"\n',
+    'println y\n',
+    'f(1)\n',
+    'func f(a) ret a end\nprintln f(1, 2)\n',
+    'println 1 + true\n',
+    'println -"a"\n',
+    'println ~1\n',
+    'println 1 / 0\n',
+    'x := 3\nprintln x % 0\n',
+    'println 0 ^ (-1)\n',
+    'println 2.0 ^ 10000\n',
+)
+
+
+def mutations(source, count, seed=0):
+    """count copies of source, each cut short or with a piece of program inserted or deleted."""
+    pieces = ('end', 'else', 'then', 'do', '(', ')', ',', ':=', '$', '"', 'func f(', 'ret', 'local', '\n', '~')
+    rng = random.Random(seed)
+    for _ in range(count):
+        i = rng.randrange(len(source) + 1)
+        kind = rng.randrange(3)
+        if kind == 0:
+            yield source[:i]
+        elif kind == 1:
+            yield source[:i] + rng.choice(pieces) + source[i:]
+        else:
+            yield source[:i] + source[i + rng.randrange(1, 20):]
+
+
+def compile_all(source):
+    from compiler import Compiler
+    from optimizer import ASTOptimizer
+    from regcompiler import RegCompiler
+    ast = ASTOptimizer().optimize(parse(source))
+    Compiler().compile_code(ast)
+    RegCompiler().compile_code(ast)
+
+
+@check
+def check_errors_are_nv_errors():
+    # Bad input of any kind must end in an NvError, which nv.py (or a host
+    # embedding the toolchain) reports; nothing else may escape.
+    for source in MALFORMED:
+        for engine in ENGINES:
+            try:
+                _, error = run(engine, source)
+            except Exception as error:
+                raise AssertionError(f'{engine} on {source!r}: {type(error).__name__}: {error}')
+            assert error is not None, f'{engine} on {source!r}: no error'
+    # Compiling runs ASTOptimizer too, which must leave what it cannot fold.
+    sources = list(MALFORMED)
+    for name in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.nv'))):
+        with open(name, encoding='utf-8') as f:
+            sources += mutations(f.read(), 500)
+    for source in sources:
+        try:
+            compile_all(source)
+        except NvError:
+            pass
+        except Exception as error:
+            raise AssertionError(f'{source!r}: {type(error).__name__}: {error}')
+    bad_utf8 = io.TextIOWrapper(io.BytesIO(b'println 1\n\xff\n'), encoding='utf-8')
+    expect_error(LexingError, lambda: Parser(Lexer(bad_utf8).iter_tokens()).parse())
+
+
+# Programs the stack VM and the register VM must run alike, along with the
+# scripts/ programs.
+VM_PROGRAMS = (
+    'func fib(n)\n  if n < 2 then\n    ret n\n  end\n  ret fib(n - 1) + fib(n - 2)\nend\nprintln fib(15)\n',
+    'func count(n, acc)\n  if n == 0 then\n    ret acc\n  end\n  ret count(n - 1, acc + n)\nend\nprintln count(100000, 0)\n',
+    'func f(a, b)\n  local t := a * b\n  if t > 10 then\n    local u := t - 10\n    ret u\n  end\n  ret t\nend\n'
+    'println f(3, 5)\nprintln f(2, 2)\n',
+    'i := 0\nwhile i < 5 do\n  print i\n  print " "\n  i := i + 1\nend\nprintln ""\n',
+    'for i := 10, 0, -3 do\n  println i % 4\nend\n',
+    's := "a"\nfor i := 0, 4 do\n  s := s + "b"\nend\nprintln s\nprintln s == "abbbb"\nprintln ~(1 < 2) or 2 ^ 3 == 8\n',
+    'func f()\nend\nprintln f()\nprintln -(1 + 2) * +4 / 3\n',
+    # A function declared in a block with the name of a top-level one.
+    'func g(x)\n  ret x\nend\nfunc f(n)\n  func g(x)\n    ret x + 1\n  end\n  ret g(n)\nend\nprintln f(1)\n',
+    'func g(x)\n  ret x\nend\nif true then\n  func g(y)\n    ret y\n  end\nend\nprintln g(1)\n',
+    'println 1\nprintln -true\n',
+    'x := 1\nprintln x + "a"\n',
+)
+
+
+@check
+def check_vm_and_regvm_agree():
+    programs = list(VM_PROGRAMS)
+    for name in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.nv'))):
+        with open(name, encoding='utf-8') as f:
+            programs.append(f.read())
+    for source in programs:
+        expected = run('vm', source)
+        got = run('regvm', source)
+        assert got == expected, f'{source!r}: vm gives {expected}, regvm {got}'
+
+
+# A top-level function declared again in a block. The VMs only compile
+# top-level functions: they must run like the interpreter when the block
+# does not call the name, and fail to compile when it does.
+REDECLARED = (
+    'func g(x)\n  ret x\nend\nfunc f(n)\n  if n > 0 then\n    func g(x)\n      ret x + 1\n    end\n  end\n'
+    '  ret n * 2\nend\nprintln f(3)\nprintln g(5)\n',
+    'func g(x)\n  ret x\nend\nif true then\n  func g(y)\n    ret y + 100\n  end\nend\nprintln g(1)\n',
+)
+REDECLARED_CALLED = (
+    'func g(x)\n  ret x\nend\nfunc f(n)\n  func g(x)\n    ret x + 1\n  end\n  ret g(n)\nend\nprintln f(1)\n',
+    'func g(x)\n  ret x\nend\nwhile true do\n  println g(1)\n  func g(y)\n    ret y\n  end\nend\n',
+)
+
+
+@check
+def check_redeclared_functions():
+    for source in REDECLARED:
+        expected = run('interp', source)
+        for engine in ('vm', 'vm-O', 'regvm'):
+            got = run(engine, source)
+            assert got == expected, f'{source!r}: interp gives {expected}, {engine} {got}'
+    for source in REDECLARED_CALLED:
+        for engine in ('vm', 'vm-O', 'regvm'):
+            assert run(engine, source) == ('', 'CompileError'), f'{engine} on {source!r}: compiles'
+
+
+# Programs with constants to fold, for check_flat_optimizer (which also
+# runs the scripts/ programs and VM_PROGRAMS).
+FOLDED = (
+    'println 1 + 2 * 3 - 4 / 2\nprintln (7 % 3) ^ 2 + (2.5 * 2)\nprintln 1 / 0 + 3 % 0\n',
+    'println -(1 + 2) * +4.5\nprintln +true\nprintln ~(1 < 2) or (2 >= 2 and 3 ~= 4)\n',
+    'x := 1\nwhile x < (10 - 1) do\n  x := x + (2 * 1)\nend\nfor i := 0 + 1, 2 * 3, -(-1) do\n  println -i\nend\n',
+    'func f(a, b)\n  local t := (a) * (2 + 3)\n  if 1 > 2 then\n    ret ~true\n  else\n    ret f(1 - 1, ((b)))\n  end\nend\n'
+    'f((1 + 1) * x, "s")\nprintln 10 / 4 + 0.5\n',
+)
+
+
+@check
+def check_flat_optimizer():
+    from flatast import FlatAST
+    from optimizer import ASTOptimizer, FlatOptimizer
+    programs = list(FOLDED) + list(VM_PROGRAMS)
+    for name in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.nv'))):
+        with open(name, encoding='utf-8') as f:
+            programs.append(f.read())
+    for source in programs:
+        # Compared as rebuilt and flattened again, which leaves out the
+        # nodes folded away.
+        got = FlatAST.from_tree(FlatOptimizer(FlatAST.from_tree(parse(source))).optimize().to_tree())
+        expected = FlatAST.from_tree(ASTOptimizer().optimize(parse(source)))
+        for column in ('kinds', 'first', 'next', 'ops', 'lines', 'values', 'literals'):
+            assert getattr(got, column) == getattr(expected, column), f'{source!r}: {column} differ'
+
+
+@check
+def check_vm_optimizations():
+    # The peephole pass and the superinstructions must not change what a
+    # program prints or the error it stops with.
+    programs = list(VM_PROGRAMS) + [source for source in MALFORMED if run('vm', source)[1] == 'VMError']
+    for name in sorted(glob.glob(os.path.join(SCRIPTS_DIR, '*.nv'))):
+        with open(name, encoding='utf-8') as f:
+            programs.append(f.read())
+    for source in programs:
+        expected = run('vm', source, message=True)
+        got = run('vm-O', source, message=True)
+        assert got == expected, f'{source!r}: vm gives {expected}, with -O {got}'
+
+
+# Uses every kind of statement, calls as statements included.
+PROFILED_PROGRAM = '''
+func f(n)
+  local k := n
+  if k > 2 then
+    ret k
+  end
+end
+total := 0
+for i := 0, 20000 do
+  f(i)
+  total := total + i
+end
+while total > 0 do
+  total := total - 100000
+end
+println f(3)
+'''
+
+
+@check
+def check_profiler():
+    from profiler import Profile, node_line, profile_ast
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                yield from walk(item)
+        elif isinstance(node, Node):
+            yield node
+            for name in node.__slots__:
+                yield from walk(getattr(node, name))
+
+    ast = parse(PROFILED_PROGRAM)
+    for node in walk(ast):
+        if isinstance(node, Stmt):
+            assert isinstance(node_line(node), int), f'no line for {type(node).__name__}'
+    for mode in ('exact', 'sample'):
+        profile = Profile(mode)
+        stream = io.StringIO()
+        profile_ast(ast, profile, 0.0001, output=Output(stream=stream))
+        assert stream.getvalue() == '3\n', f'{mode}: output {stream.getvalue()!r}'
+        assert sum(count for count, _ in profile.lines.values()) > 0, f'{mode}: nothing recorded'
+
+
+def main():
+    failed = 0
+    for fn in CHECKS:
+        try:
+            fn()
+        except Exception as error:
+            failed += 1
+            message = error if type(error) is AssertionError else f'{type(error).__name__}: {error}'
+            print(f'{fn.__name__}: FAILED: {message}')
+    print(f'{len(CHECKS) - failed} of {len(CHECKS)} checks passed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
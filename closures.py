@@ -0,0 +1,407 @@
+import operator
+
+from model import *
+from output import Output
+from state import *
+from tokens import *
+from utils import *
+
+# Closure-compiling engine.
+#
+# ClosureCompiler walks the AST once and turns every node into a Python
+# closure taking the current Environment. Everything that Interpreter looks up
+# on each visit (the node type, the operator, literal values, names, line
+# numbers for errors and the child nodes) is bound when the closure is built,
+# so running a program is only calls between closures. Semantics and error
+# messages are those of Interpreter, including its return protocol: a
+# statement closure returns None, or the value of the `ret` it executed, and
+# `ret f(...)` in a function returns a TailCall for its caller to make.
+
+ARITHMETIC = {
+    TOK_MINUS: operator.sub,
+    TOK_STAR: operator.mul,
+    TOK_SLASH: operator.truediv,
+    TOK_MOD: operator.mod,
+    TOK_CARET: operator.pow,
+}
+COMPARISON = {
+    TOK_GT: operator.gt,
+    TOK_GE: operator.ge,
+    TOK_LT: operator.lt,
+    TOK_LE: operator.le,
+}
+
+
+def number_literal(node):
+    """The value of an Integer / Float node as Interpreter computes it, else None."""
+    if type(node) in (Integer, Float):
+        return float(node.value)
+    return None
+
+
+def nothing(env):
+    return None
+
+
+class ClosureCompiler(NodeVisitor):
+    # Whether the node being built is in a function body.
+    in_function = False
+
+    def __init__(self, output=None):
+        self.output = Output() if output is None else output
+
+    def build(self, node):
+        return self.dispatch[type(node)](self, node)
+
+    def interpret_ast(self, node):
+        run = self.build(node)
+        try:
+            run(Environment())
+        finally:
+            self.output.flush()
+
+    def visit_NoneType(self, node):
+        return nothing
+
+    def visit_Integer(self, node):
+        value = float(node.value)
+        return lambda env: value
+
+    def visit_Float(self, node):
+        value = float(node.value)
+        return lambda env: value
+
+    def visit_String(self, node):
+        value = str(node.value)
+        return lambda env: value
+
+    def visit_Bool(self, node):
+        value = node.value
+        return lambda env: value
+
+    def visit_Grouping(self, node):
+        return self.build(node.value)
+
+    def visit_Identifier(self, node):
+        name, line = node.name, node.line
+
+        def identifier(env):
+            while env is not None:
+                value = env.var.get(name)
+                if value is not None:
+                    return value
+                env = env.parent
+            runtime_error(f'Undefined variable {name!r}.', line)
+        return identifier
+
+    def visit_Assignment(self, node):
+        name = node.left.name
+        right = self.build(node.right)
+
+        def assignment(env):
+            value = right(env)
+            scope = env
+            while scope is not None:
+                if scope.var.get(name) is not None:
+                    scope.var[name] = value
+                    return
+                scope = scope.parent
+            env.var[name] = value
+        return assignment
+
+    def visit_BinOp(self, node):
+        token_type = node.op.token_type
+        left = self.build(node.left)
+        right = self.build(node.right)
+        lexeme, line = node.op.lexeme, node.op.line
+
+        def unsupported(leftval, rightval):
+            runtime_error(f'Unsupported operator {lexeme!r} between {type_name(leftval)} and {type_name(rightval)}.', line)
+
+        if token_type == TOK_PLUS:
+            def plus(env):
+                leftval = left(env)
+                rightval = right(env)
+                if type(leftval) in NUMBERS and type(rightval) in NUMBERS:
+                    return leftval + rightval
+                if type(leftval) is str or type(rightval) is str:
+                    return stringify(leftval) + stringify(rightval)
+                unsupported(leftval, rightval)
+            return plus
+
+        if token_type in ARITHMETIC:
+            op = ARITHMETIC[token_type]
+
+            def arithmetic_error(error):
+                runtime_error(f'{ARITHMETIC_ERRORS[type(error)]}.', line)
+
+            constant = number_literal(node.right)
+            if constant is not None:
+                def arithmetic_constant(env):
+                    leftval = left(env)
+                    if type(leftval) in NUMBERS:
+                        try:
+                            return op(leftval, constant)
+                        except (ZeroDivisionError, OverflowError) as error:
+                            arithmetic_error(error)
+                    unsupported(leftval, constant)
+                return arithmetic_constant
+
+            def arithmetic(env):
+                leftval = left(env)
+                rightval = right(env)
+                if type(leftval) in NUMBERS and type(rightval) in NUMBERS:
+                    try:
+                        return op(leftval, rightval)
+                    except (ZeroDivisionError, OverflowError) as error:
+                        arithmetic_error(error)
+                unsupported(leftval, rightval)
+            return arithmetic
+
+        if token_type in COMPARISON:
+            op = COMPARISON[token_type]
+            constant = number_literal(node.right)
+            if constant is not None:
+                def comparison_constant(env):
+                    leftval = left(env)
+                    if type(leftval) in NUMBERS:
+                        return op(leftval, constant)
+                    unsupported(leftval, constant)
+                return comparison_constant
+
+            def comparison(env):
+                leftval = left(env)
+                rightval = right(env)
+                if type(leftval) in NUMBERS and type(rightval) in NUMBERS or type(leftval) is str and type(rightval) is str:
+                    return op(leftval, rightval)
+                unsupported(leftval, rightval)
+            return comparison
+
+        if token_type == TOK_EQEQ:
+            def equal(env):
+                leftval = left(env)
+                rightval = right(env)
+                if type(leftval) is type(rightval) or type(leftval) in NUMBERS and type(rightval) in NUMBERS:
+                    return leftval == rightval
+                return False
+            return equal
+
+        if token_type == TOK_NE:
+            def not_equal(env):
+                leftval = left(env)
+                rightval = right(env)
+                if type(leftval) is type(rightval) or type(leftval) in NUMBERS and type(rightval) in NUMBERS:
+                    return leftval != rightval
+                return True
+            return not_equal
+
+        def unknown(env):
+            left(env)
+            right(env)
+        return unknown
+
+    def visit_UnOp(self, node):
+        token_type = node.op.token_type
+        operand = self.build(node.operand)
+        lexeme, line = node.op.lexeme, node.op.line
+
+        def unsupported(value):
+            runtime_error(f'Unsupported operator {lexeme!r} with {type_name(value)}.', line)
+
+        if token_type == TOK_MINUS:
+            def negate(env):
+                value = operand(env)
+                if type(value) in NUMBERS:
+                    return -value
+                unsupported(value)
+            return negate
+
+        if token_type == TOK_PLUS:
+            def positive(env):
+                value = operand(env)
+                if type(value) in NUMBERS:
+                    return value
+                unsupported(value)
+            return positive
+
+        if token_type == TOK_NOT:
+            def negation(env):
+                value = operand(env)
+                if type(value) is bool:
+                    return not value
+                unsupported(value)
+            return negation
+
+        def unknown(env):
+            operand(env)
+        return unknown
+
+    def visit_LogicalOp(self, node):
+        left = self.build(node.left)
+        right = self.build(node.right)
+
+        if node.op.token_type == TOK_AND:
+            def logical_and(env):
+                if not left(env):
+                    return False
+                return bool(right(env))
+            return logical_and
+
+        if node.op.token_type == TOK_OR:
+            def logical_or(env):
+                if left(env):
+                    return True
+                return bool(right(env))
+            return logical_or
+
+        return nothing
+
+    def visit_Stmts(self, node):
+        stmts = tuple(self.build(stmt) for stmt in node.stmts)
+        if len(stmts) == 1:
+            return stmts[0]
+
+        def block(env):
+            for stmt in stmts:
+                result = stmt(env)
+                if result is not None:
+                    return result
+        return block
+
+    def visit_PrintStmt(self, node):
+        value = self.build(node.value)
+        end = node.end
+        write = self.output.write
+
+        def print_stmt(env):
+            write(stringify(value(env)) + end)
+        return print_stmt
+
+    def visit_IfStmt(self, node):
+        test = self.build(node.test)
+        then_stmts = self.build(node.then_stmts)
+        else_stmts = self.build(node.else_stmts)
+        line = node.line
+
+        def if_stmt(env):
+            testval = test(env)
+            if type(testval) is not bool:
+                runtime_error("if condition is not a bool type", line)
+            if testval:
+                return then_stmts(Environment(env))
+            return else_stmts(Environment(env))
+        return if_stmt
+
+    def visit_WhileStmt(self, node):
+        test = self.build(node.test)
+        body = self.build(node.body_stmts)
+        line = node.line
+
+        def while_stmt(env):
+            new_env = Environment(env)
+            while True:
+                test_val = test(env)
+                if type(test_val) is not bool:
+                    runtime_error("while condition is not a bool type", line)
+                if not test_val:
+                    break
+                result = body(new_env)
+                if result is not None:
+                    return result
+        return while_stmt
+
+    def visit_ForStmt(self, node):
+        varname = node.ident.name
+        start = self.build(node.start)
+        end = self.build(node.end)
+        step = None if node.step is None else self.build(node.step)
+        body = self.build(node.body_stmts)
+
+        def for_stmt(env):
+            new_env = Environment(env)
+            ival = start(new_env)
+            endval = end(new_env)
+            if ival < endval:
+                if step is None:
+                    stepval = 1
+                else:
+                    stepval = step(new_env)
+                while ival < endval:
+                    env.set_var(varname, ival)
+                    result = body(new_env)
+                    if result is not None:
+                        return result
+                    ival += stepval
+        return for_stmt
+
+    def visit_FuncCall(self, node):
+        lookup = self.call_args(node)
+
+        def call(env):
+            call_args = lookup
+            while True:
+                func, values = call_args(env)
+                params, body, func_env = func
+                new_env = Environment(func_env)
+                new_env.var.update(zip(params, values))
+                result = body(new_env)
+                if type(result) is not TailCall:
+                    return False if result is None else result
+                call_args, env = result.call, result.env
+        return call
+
+    def call_args(self, node):
+        """A closure giving the function a FuncCall calls and its evaluated arguments."""
+        name, line = node.name, node.line
+        args = tuple(self.build(arg) for arg in node.args)
+        nargs = len(args)
+
+        def call_args(env):
+            scope = env
+            while scope is not None:
+                func = scope.funcs.get(name)
+                if func is not None:
+                    break
+                scope = scope.parent
+            else:
+                runtime_error(f"function {name} not found", line)
+            if len(func[0]) != nargs:
+                runtime_error(f"function {name} expected {len(func[0])} arguments, got {nargs}", line)
+            return func, [arg(env) for arg in args]
+        return call_args
+
+    def visit_FuncDecl(self, node):
+        name = node.name
+        params = tuple(param.name for param in node.params)
+        in_function, self.in_function = self.in_function, True
+        body = self.build(node.body_stmts)
+        self.in_function = in_function
+
+        def func_decl(env):
+            env.funcs[name] = (params, body, env)
+        return func_decl
+
+    def visit_FuncCallStmt(self, node):
+        expr = self.build(node.expr)
+
+        def call_stmt(env):
+            expr(env)
+        return call_stmt
+
+    def visit_RetStmt(self, node):
+        if self.in_function and type(node.expr) is FuncCall:
+            call_args = self.call_args(node.expr)
+
+            def tail_call(env):
+                return TailCall(call_args, env)
+            return tail_call
+        # Its value is the status that ends the function.
+        return self.build(node.expr)
+
+    def visit_LocalStmt(self, node):
+        ident = node.ident
+        expr = self.build(node.expr)
+
+        def local_stmt(env):
+            env.var[ident] = expr(env)
+        return local_stmt
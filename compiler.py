@@ -1,26 +1,27 @@
 from model import FuncCallStmt
 from model import FuncDecl
 from model import LogicalOp
+from effects import EffectAnalyzer
 from model import *
 from tokens import *
 from utils import *
 
-TYPE_NUMBER = 'TYPE_NUMBER'  # Default to 64-bit float
-TYPE_STRING = 'TYPE_STRING'  # String managed by the host language
-TYPE_BOOL = 'TYPE_BOOL'  # true | false
-
 SYM_VAR = 'SYM_VAR'
 SYM_FUNC = 'SYM_FUNC'
 
 class Symbol:
-    def __init__(self,name,symtype = SYM_VAR,depth = 0,arity = 0):
+    def __init__(self,name,symtype = SYM_VAR,depth = 0,arity = 0,pure = False):
         self.name = name
         self.symtype = symtype
         self.depth = depth
         self.arity = arity
+        self.pure = pure
 
-class Compiler:
-    def __init__(self):
+class Compiler(NodeVisitor):
+    def __init__(self, memoize=False):
+        # With memoize, calls to pure functions (effects.py) are CALL_PURE,
+        # which a VM with a memo.Memoizer answers from its cache.
+        self.memoize = memoize
         self.code = []
         self.label_counter = 0
         self.globals =  []
@@ -28,6 +29,9 @@ class Compiler:
         self.locals = []
         self.functions = []
         self.scope_depth = 0
+        self.function = None
+        # Top-level functions declared again in the blocks being compiled.
+        self.shadowed = []
 
 
     def emit(self,op):
@@ -62,225 +66,267 @@ class Compiler:
                 return (symbol, i)
         return None
 
-    def compile(self,node):
-        if isinstance(node,Integer):
-            value = (TYPE_NUMBER,float(node.value))
-            self.emit(('PUSH',value))
-
-        if isinstance(node,Float):
-            value = (TYPE_NUMBER,float(node.value))
-            self.emit(('PUSH',value))
-
-        if isinstance(node,Bool):
-            value = (TYPE_BOOL,True if node.value == 'true' or node.value == True else False)
-            self.emit(('PUSH',value))
-
-        if isinstance(node,String):
-            value = (TYPE_STRING,stringify(node.value))
-            self.emit(('PUSH',value))
-
-        if isinstance(node,BinOp):
-            self.compile(node.left)
-            self.compile(node.right)
-            if node.op.token_type == TOK_PLUS:
-                self.emit(('ADD',))
-            elif node.op.token_type == TOK_MINUS:
-                self.emit(('SUB',))
-            elif node.op.token_type == TOK_STAR:
-                self.emit(('MUL',))
-            elif node.op.token_type == TOK_SLASH:
-                self.emit(('DIV',))
-            elif node.op.token_type == TOK_CARET:
-                self.emit(('EXP',))
-            elif node.op.token_type == TOK_MOD:
-                self.emit(('MOD',))
-            elif node.op.token_type == TOK_EQEQ:
-                self.emit(('EQ',))
-            elif node.op.token_type == TOK_NE:
-                self.emit(('NE',))
-            elif node.op.token_type == TOK_GT:
-                self.emit(('GT',))
-            elif node.op.token_type == TOK_GE:
-                self.emit(('GE',))
-            elif node.op.token_type == TOK_LT:
-                self.emit(('LT',))
-            elif node.op.token_type == TOK_LE:
-                self.emit(('LE',))
-
-
-        if isinstance(node,UnOp):
-            self.compile(node.operand)
-            if node.op.token_type == TOK_PLUS:
-                self.emit(('POS',))
-            elif node.op.token_type == TOK_MINUS:
-                self.emit(('NEG',))
-            elif node.op.token_type == TOK_NOT:
-                self.emit(('PUSH',(TYPE_BOOL,True)))
-                self.emit(('XOR',))
-
-        if isinstance(node,LogicalOp):
-            self.compile(node.left)
-            self.compile(node.right)
-            if node.op.token_type == TOK_AND:
-                self.emit(('AND',))
-            elif node.op.token_type == TOK_OR:
-                self.emit(('OR',))
+    def compile(self, node):
+        return self.dispatch[type(node)](self, node)
 
+    def visit_Integer(self, node):
+        value = float(node.value)
+        self.emit(('PUSH',value))
 
-        if isinstance(node,Stmts):
+    def visit_Float(self, node):
+        value = float(node.value)
+        self.emit(('PUSH',value))
+
+    def visit_Bool(self, node):
+        value = True if node.value == 'true' or node.value == True else False
+        self.emit(('PUSH',value))
+
+    def visit_String(self, node):
+        value = stringify(node.value)
+        self.emit(('PUSH',value))
+
+    def visit_BinOp(self, node):
+        self.compile(node.left)
+        self.compile(node.right)
+        if node.op.token_type == TOK_PLUS:
+            self.emit(('ADD',))
+        elif node.op.token_type == TOK_MINUS:
+            self.emit(('SUB',))
+        elif node.op.token_type == TOK_STAR:
+            self.emit(('MUL',))
+        elif node.op.token_type == TOK_SLASH:
+            self.emit(('DIV',))
+        elif node.op.token_type == TOK_CARET:
+            self.emit(('EXP',))
+        elif node.op.token_type == TOK_MOD:
+            self.emit(('MOD',))
+        elif node.op.token_type == TOK_EQEQ:
+            self.emit(('EQ',))
+        elif node.op.token_type == TOK_NE:
+            self.emit(('NE',))
+        elif node.op.token_type == TOK_GT:
+            self.emit(('GT',))
+        elif node.op.token_type == TOK_GE:
+            self.emit(('GE',))
+        elif node.op.token_type == TOK_LT:
+            self.emit(('LT',))
+        elif node.op.token_type == TOK_LE:
+            self.emit(('LE',))
+
+    def visit_UnOp(self, node):
+        self.compile(node.operand)
+        if node.op.token_type == TOK_PLUS:
+            self.emit(('POS',))
+        elif node.op.token_type == TOK_MINUS:
+            self.emit(('NEG',))
+        elif node.op.token_type == TOK_NOT:
+            self.emit(('PUSH',True))
+            self.emit(('XOR',))
+
+    def visit_LogicalOp(self, node):
+        self.compile(node.left)
+        self.compile(node.right)
+        if node.op.token_type == TOK_AND:
+            self.emit(('AND',))
+        elif node.op.token_type == TOK_OR:
+            self.emit(('OR',))
+
+    def shadow_functions(self, node):
+        """
+        Note the top-level functions that block node declares again, which
+        the interpreters call in the block instead (see function_symbol).
+        Returns the length of self.shadowed to cut it back to after the block.
+        """
+        saved = len(self.shadowed)
+        if self.scope_depth > 0:
             for stmt in node.stmts:
-                self.compile(stmt)
-        
-        if isinstance(node,PrintStmt):
-            self.compile(node.value)
-            if node.end == '':
-                self.emit(('PRINT',))
-            else:
-                self.emit(('PRINTLN',))
-
-        if isinstance(node,Grouping):
-            self.compile(node.value)
-
-        if isinstance(node,IfStmt):
-            self.compile(node.test)
-            then_label = self.make_label()
-            else_label = self.make_label()
-            exit_label = self.make_label()
-            self.emit(('JMPZ',else_label))
-            self.emit(('LABEL',then_label))
+                if type(stmt) is FuncDecl and self.get_func_symbol(stmt.name):
+                    self.shadowed.append(stmt.name)
+        return saved
+
+    def check_shadowed(self, node):
+        if node.name in self.shadowed:
+            compile_error(f"Function {node.name} is declared again in this block; only top-level functions are compiled",node.line)
+
+    def visit_Stmts(self, node):
+        saved = self.shadow_functions(node)
+        for stmt in node.stmts:
+            self.compile(stmt)
+        del self.shadowed[saved:]
+
+    def visit_PrintStmt(self, node):
+        self.compile(node.value)
+        if node.end == '':
+            self.emit(('PRINT',))
+        else:
+            self.emit(('PRINTLN',))
+
+    def visit_Grouping(self, node):
+        self.compile(node.value)
+
+    def visit_IfStmt(self, node):
+        self.compile(node.test)
+        then_label = self.make_label()
+        else_label = self.make_label()
+        exit_label = self.make_label()
+        self.emit(('JMPZ',else_label))
+        self.emit(('LABEL',then_label))
+        self.begin_block()
+        self.compile(node.then_stmts)
+        self.end_block()
+        self.emit(('JMP',exit_label))
+        self.emit(('LABEL',else_label))
+        if node.else_stmts:
             self.begin_block()
-            self.compile(node.then_stmts)
+            self.compile(node.else_stmts)
             self.end_block()
-            self.emit(('JMP',exit_label))
-            self.emit(('LABEL',else_label))
-            if node.else_stmts:
-                self.begin_block()
-                self.compile(node.else_stmts)
-                self.end_block()
-            self.emit(('LABEL',exit_label))
-
-        if isinstance(node,WhileStmt):
-            test_label = self.make_label()
-            body_label = self.make_label()
-            exit_label = self.make_label()
-            self.emit(('LABEL',test_label))
-            self.compile(node.test)
-            self.emit(('JMPZ',exit_label))
-            self.emit(('LABEL',body_label))
-            self.begin_block()
-            self.compile(node.body_stmts)
-            self.end_block()
-            self.emit(('JMP',test_label))
-            self.emit(('LABEL',exit_label))
-
-        if isinstance(node,ForStmt):
-            test_label = self.make_label()
-            body_label = self.make_label()
-            exit_label = self.make_label()
-            step_label = self.make_label()
-            
-            varname = node.ident.name
-            new_symbol = Symbol(varname, SYM_VAR, self.scope_depth)
+        self.emit(('LABEL',exit_label))
+
+    def visit_WhileStmt(self, node):
+        test_label = self.make_label()
+        body_label = self.make_label()
+        exit_label = self.make_label()
+        self.emit(('LABEL',test_label))
+        self.compile(node.test)
+        self.emit(('JMPZ',exit_label))
+        self.emit(('LABEL',body_label))
+        self.begin_block()
+        self.compile(node.body_stmts)
+        self.end_block()
+        self.emit(('JMP',test_label))
+        self.emit(('LABEL',exit_label))
+
+    def visit_ForStmt(self, node):
+        test_label = self.make_label()
+        body_label = self.make_label()
+        exit_label = self.make_label()
+        step_label = self.make_label()
+        
+        varname = node.ident.name
+        new_symbol = Symbol(varname, SYM_VAR, self.scope_depth)
+        if self.scope_depth == 0:
+            self.globals.append(new_symbol)
+        
+        self.compile(node.start)
+        self.emit(('STORE_GLOBAL', varname))
+        
+        self.emit(('LABEL', test_label))
+        self.emit(('LOAD_GLOBAL', varname))
+        self.compile(node.end)
+        self.emit(('LT',))
+        self.emit(('JMPZ', exit_label))
+        
+        self.emit(('LABEL', body_label))
+        self.begin_block()
+        self.compile(node.body_stmts)
+        self.end_block()
+        
+        self.emit(('LABEL', step_label))
+        self.emit(('LOAD_GLOBAL', varname))
+        if node.step:
+            self.compile(node.step)
+        else:
+            self.emit(('PUSH', 1.0))
+        self.emit(('ADD',))
+        self.emit(('STORE_GLOBAL', varname))
+        self.emit(('JMP', test_label))
+        
+        self.emit(('LABEL', exit_label))
+
+    def visit_Assignment(self, node):
+        self.compile(node.right)
+        symbol = self.get_var_symbol(node.left.name)
+        if not symbol:
+            new_symbol = Symbol(node.left.name,SYM_VAR,self.scope_depth)
             if self.scope_depth == 0:
                 self.globals.append(new_symbol)
-            
-            self.compile(node.start)
-            self.emit(('STORE_GLOBAL', varname))
-            
-            self.emit(('LABEL', test_label))
-            self.emit(('LOAD_GLOBAL', varname))
-            self.compile(node.end)
-            self.emit(('LT',))
-            self.emit(('JMPZ', exit_label))
-            
-            self.emit(('LABEL', body_label))
-            self.begin_block()
-            self.compile(node.body_stmts)
-            self.end_block()
-            
-            self.emit(('LABEL', step_label))
-            self.emit(('LOAD_GLOBAL', varname))
-            if node.step:
-                self.compile(node.step)
+                self.emit(('STORE_GLOBAL',new_symbol.name))
+                self.numglobals += 1
             else:
-                self.emit(('PUSH', (TYPE_NUMBER, 1.0)))
-            self.emit(('ADD',))
-            self.emit(('STORE_GLOBAL', varname))
-            self.emit(('JMP', test_label))
-            
-            self.emit(('LABEL', exit_label))
-        if isinstance(node,Assignment):
-            self.compile(node.right)
-            symbol = self.get_var_symbol(node.left.name)
-            if not symbol:
-                new_symbol = Symbol(node.left.name,SYM_VAR,self.scope_depth)
-                if self.scope_depth == 0:
-                    self.globals.append(new_symbol)
-                    self.emit(('STORE_GLOBAL',new_symbol.name))
-                    self.numglobals += 1
-                else:
-                    self.emit(('STORE_LOCAL',len(self.locals)))
-                    self.locals.append(new_symbol)
-            else:
-                sym,slot = symbol
-                if sym.depth == 0:
-                    self.emit(('STORE_GLOBAL',sym.name))
-                else:
-                    self.emit(('STORE_LOCAL',slot))
-
-        if isinstance(node,Identifier):
-            symbol = self.get_var_symbol(node.name)
-            if not symbol:
-                compile_error(f"Undefined variable {node.name}",node.line)
+                self.emit(('STORE_LOCAL',len(self.locals)))
+                self.locals.append(new_symbol)
+        else:
             sym,slot = symbol
             if sym.depth == 0:
-                self.emit(('LOAD_GLOBAL',sym.name))
-            else:
-                self.emit(('LOAD_LOCAL',slot))
-
-        if isinstance(node,LocalStmt):
-            self.compile(node.expr)
-            new_symbol = Symbol(node.ident,SYM_VAR,self.scope_depth)
-            self.emit(('STORE_LOCAL',len(self.locals)))
-            self.locals.append(new_symbol)
-        
-        if isinstance(node,FuncDecl):
-            func = self.get_func_symbol(node.name)
-            if func:
-                end_label = self.make_label()
-                self.emit(('JMP',end_label))
-                self.emit(('LABEL',func.name))
-                self.begin_block()
-                for param in node.params:
-                    new_symbol = Symbol(param.name,SYM_VAR,self.scope_depth)
-                    self.locals.append(new_symbol)
-                self.compile(node.body_stmts)
-                self.end_block()
-                self.emit(('PUSH',(TYPE_BOOL,False)))
-                self.emit(('RET',))
-                self.emit(('LABEL',end_label))
-
-
-        if isinstance(node,FuncCall):
-            func = self.get_func_symbol(node.name)
-            if not func:
-                compile_error(f"Undefined function {node.name}",node.line)
-            if func.arity != len(node.args):
-                compile_error(f"Function {node.name} expected {func.arity} arguments, got {len(node.args)}",node.line)
-            for arg in node.args:
-                self.compile(arg)
-            self.emit(('CALL',func.name,len(node.args)))
-
-        if isinstance(node,FuncCallStmt):
-            self.compile(node.expr)
-            self.emit(('POP',))
-
-        if isinstance(node,RetStmt):
-            if node.expr:
-                self.compile(node.expr)
+                self.emit(('STORE_GLOBAL',sym.name))
             else:
-                self.emit(('PUSH',(TYPE_BOOL,False)))
+                self.emit(('STORE_LOCAL',slot))
+
+    def visit_Identifier(self, node):
+        symbol = self.get_var_symbol(node.name)
+        if not symbol:
+            compile_error(f"Undefined variable {node.name}",node.line)
+        sym,slot = symbol
+        if sym.depth == 0:
+            self.emit(('LOAD_GLOBAL',sym.name))
+        else:
+            self.emit(('LOAD_LOCAL',slot))
+
+    def visit_LocalStmt(self, node):
+        self.compile(node.expr)
+        new_symbol = Symbol(node.ident,SYM_VAR,self.scope_depth)
+        self.emit(('STORE_LOCAL',len(self.locals)))
+        self.locals.append(new_symbol)
+
+    def function_symbol(self, node):
+        """
+        The symbol of FuncDecl node if it is compiled, None if not: only the
+        top-level functions (collect_functions) are. One declared again in a
+        block is not either (it would share the label of the top-level one);
+        calls from outside the block go to the top-level function, as in the
+        interpreters, and calls in the block are errors (check_shadowed).
+        """
+        if self.scope_depth > 0:
+            return None
+        return self.get_func_symbol(node.name)
+
+    def visit_FuncDecl(self, node):
+        func = self.function_symbol(node)
+        if func:
+            end_label = self.make_label()
+            self.emit(('JMP',end_label))
+            self.emit(('LABEL',func.name))
+            self.begin_block()
+            for param in node.params:
+                new_symbol = Symbol(param.name,SYM_VAR,self.scope_depth)
+                self.locals.append(new_symbol)
+            function, self.function = self.function, func
+            self.compile(node.body_stmts)
+            self.function = function
+            self.end_block()
+            self.emit(('PUSH',False))
             self.emit(('RET',))
+            self.emit(('LABEL',end_label))
+
+    def visit_FuncCall(self, node):
+        func = self.get_func_symbol(node.name)
+        self.compile_call(node, 'CALL_PURE' if func and func.pure else 'CALL')
+
+    def compile_call(self, node, opcode):
+        func = self.get_func_symbol(node.name)
+        if not func:
+            compile_error(f"Undefined function {node.name}",node.line)
+        if func.arity != len(node.args):
+            compile_error(f"Function {node.name} expected {func.arity} arguments, got {len(node.args)}",node.line)
+        self.check_shadowed(node)
+        for arg in node.args:
+            self.compile(arg)
+        self.emit((opcode,func.name,len(node.args)))
+
+    def visit_FuncCallStmt(self, node):
+        self.compile(node.expr)
+        self.emit(('POP',))
+
+    def visit_RetStmt(self, node):
+        if self.function is not None and isinstance(node.expr,FuncCall):
+            # A tail call: the callee takes over this function's frame and
+            # returns straight to our caller.
+            self.compile_call(node.expr, 'TAILCALL')
+        elif node.expr:
+            self.compile(node.expr)
+        else:
+            self.emit(('PUSH',False))
+        self.emit(('RET',))
 
     def collect_functions(self,node):
         if isinstance(node,Stmts):
@@ -289,7 +335,7 @@ class Compiler:
         elif isinstance(node,FuncDecl):
             if self.get_func_symbol(node.name) or self.get_var_symbol(node.name):
                 compile_error(f"Function/Variable {node.name} already defined",node.line)
-            new_func = Symbol(node.name,SYM_FUNC,0,len(node.params))
+            new_func = Symbol(node.name,SYM_FUNC,0,len(node.params),self.memoize and bool(node.pure))
             self.functions.append(new_func)
 
     def collect_globals(self,node):
@@ -309,6 +355,8 @@ class Compiler:
         self.collect_globals(node)
 
     def compile_code(self,node):
+        if self.memoize:
+            EffectAnalyzer().analyze(node)
         self.collect_symbols(node)
         self.emit(('START',))
         self.compile(node)
@@ -0,0 +1,182 @@
+from model import *
+
+# Effect analysis: which functions are pure, so that their results can be
+# memoized (see memo.py).
+#
+# A function is pure when a call's result depends only on its arguments and
+# the call does nothing else. EffectAnalyzer takes that to mean its body
+#
+#     prints nothing,
+#     declares no function of its own,
+#     reads and writes no variable that may live outside it: a name used in
+#         the body that is also a variable of an enclosing scope (a global,
+#         or a parameter or variable of an enclosing function) makes it
+#         impure, unless it is one of the function's own parameters, which
+#         always shadow it,
+#     only calls functions that are pure: each called name has to resolve to
+#         exactly one declaration in the enclosing scopes.
+#
+# Purity is the greatest fixed point of the last rule, so recursive and
+# mutually recursive functions can be pure. analyze() records the verdict on
+# every FuncDecl (FuncDecl.pure) and returns the reason a function is not pure.
+
+
+class Scope:
+    def __init__(self, parent, func=None):
+        self.parent = parent
+        self.vars = set()
+        self.funcs = {}
+        # The FuncDecl whose body this scope belongs to, if any.
+        self.func = func if func is not None else parent and parent.func
+
+
+class FuncInfo:
+    def __init__(self):
+        # Why the function is not pure (None while it may be).
+        self.reason = None
+        # (name, FuncDecl it resolves to or None) of every call in the body.
+        self.calls = []
+
+
+class EffectAnalyzer(NodeVisitor):
+    def analyze(self, node):
+        """Mark every FuncDecl below node; returns {FuncDecl: None if pure, else why not}."""
+        self.infos = {}
+        scope = Scope(None)
+        self.declare(scope, node)
+        self.visit(node, scope)
+        infos = self.infos
+        changed = True
+        while changed:
+            changed = False
+            for info in infos.values():
+                if info.reason is not None:
+                    continue
+                for name, callee in info.calls:
+                    if callee is None:
+                        info.reason = f'calls {name}, which is not one known function'
+                    elif infos[callee].reason is not None:
+                        info.reason = f'calls {name}, which is not pure'
+                    else:
+                        continue
+                    changed = True
+                    break
+        for func, info in infos.items():
+            func.pure = info.reason is None
+        return {func: info.reason for func, info in infos.items()}
+
+    def declare(self, scope, stmts):
+        for stmt in stmts.stmts:
+            kind = type(stmt)
+            if kind is Assignment:
+                scope.vars.add(stmt.left.name)
+            elif kind is LocalStmt:
+                scope.vars.add(stmt.ident)
+            elif kind is ForStmt:
+                scope.vars.add(stmt.ident.name)
+            elif kind is FuncDecl:
+                scope.funcs.setdefault(stmt.name, []).append(stmt)
+            elif kind is Stmts:
+                self.declare(scope, stmt)
+
+    def block(self, stmts, scope):
+        if stmts is not None:
+            inner = Scope(scope)
+            self.declare(inner, stmts)
+            self.visit(stmts, inner)
+
+    def impure(self, func, reason):
+        if func is not None:
+            info = self.infos[func]
+            if info.reason is None:
+                info.reason = reason
+
+    def use_var(self, scope, name):
+        func = scope.func
+        if func is None or any(param.name == name for param in func.params):
+            return
+        # Skip the scopes of the function body, then look outside.
+        while scope.func is func:
+            scope = scope.parent
+        while scope is not None:
+            if name in scope.vars:
+                self.impure(func, f'uses variable {name} from outside')
+                return
+            scope = scope.parent
+
+    def visit_Identifier(self, node, scope):
+        self.use_var(scope, node.name)
+
+    def visit_Grouping(self, node, scope):
+        self.visit(node.value, scope)
+
+    def visit_UnOp(self, node, scope):
+        self.visit(node.operand, scope)
+
+    def visit_BinOp(self, node, scope):
+        self.visit(node.left, scope)
+        self.visit(node.right, scope)
+
+    def visit_LogicalOp(self, node, scope):
+        self.visit(node.left, scope)
+        self.visit(node.right, scope)
+
+    def visit_Assignment(self, node, scope):
+        self.visit(node.right, scope)
+        self.use_var(scope, node.left.name)
+
+    def visit_LocalStmt(self, node, scope):
+        self.visit(node.expr, scope)
+
+    def visit_Stmts(self, node, scope):
+        for stmt in node.stmts:
+            self.visit(stmt, scope)
+
+    def visit_PrintStmt(self, node, scope):
+        self.visit(node.value, scope)
+        self.impure(scope.func, 'prints')
+
+    def visit_IfStmt(self, node, scope):
+        self.visit(node.test, scope)
+        self.block(node.then_stmts, scope)
+        self.block(node.else_stmts, scope)
+
+    def visit_WhileStmt(self, node, scope):
+        self.visit(node.test, scope)
+        self.block(node.body_stmts, scope)
+
+    def visit_ForStmt(self, node, scope):
+        self.use_var(scope, node.ident.name)
+        inner = Scope(scope)
+        self.declare(inner, node.body_stmts)
+        self.visit(node.start, inner)
+        self.visit(node.end, inner)
+        self.visit(node.step, inner)
+        self.visit(node.body_stmts, inner)
+
+    def visit_FuncDecl(self, node, scope):
+        self.impure(scope.func, f'declares function {node.name}')
+        self.infos[node] = FuncInfo()
+        body = Scope(scope, func=node)
+        body.vars.update(param.name for param in node.params)
+        self.declare(body, node.body_stmts)
+        self.visit(node.body_stmts, body)
+
+    def visit_FuncCall(self, node, scope):
+        for arg in node.args:
+            self.visit(arg, scope)
+        if scope.func is None:
+            return
+        decls = []
+        s = scope
+        while s is not None:
+            decls.extend(s.funcs.get(node.name, ()))
+            s = s.parent
+        callee = decls[0] if len(decls) == 1 else None
+        self.infos[scope.func].calls.append((node.name, callee))
+
+    def visit_FuncCallStmt(self, node, scope):
+        self.visit(node.expr, scope)
+
+    def visit_RetStmt(self, node, scope):
+        self.visit(node.expr, scope)
@@ -0,0 +1,275 @@
+import gc
+from array import array
+
+import model
+from model import *
+from tokens import *
+
+# Flat, array-backed AST.
+#
+# Node i is described by the i-th entry of six parallel arrays:
+#
+#      kinds[i]     index into NODE_KINDS (the model class name)
+#      first[i]     index of its first child, -1 for a leaf
+#      next[i]      index of its next sibling, -1 for the last child
+#      ops[i]       KIND of the operator token (BinOp, LogicalOp, UnOp), NO_OP otherwise
+#      values[i]    index into literals of its name / value / print end, -1 if none
+#      lines[i]     source line
+#
+# Names and literal values are interned in the literals side table. Children
+# follow the field order in SCHEMA; a missing optional child (the else branch
+# of an if, the step of a for) is kept as a NoneType node so that children
+# stay positional. Nodes are numbered in preorder, so a whole tree is a
+# linear scan of the arrays and every subtree is a contiguous range.
+# optimizer.FlatOptimizer folds constants in place, leaving the nodes below
+# a folded one in the arrays; the links no longer reach them, so a scan sees
+# them but walk(), children() and to_tree() do not.
+#
+# The interpreters and the compilers take object trees (to_tree()); the
+# constant folding also runs on a FlatAST directly (FlatOptimizer).
+#
+# Operator tokens are not stored: to_tree() rebuilds them from the operator
+# kind, taking the line of their node (which is where the parser puts them).
+# Neither are the resolver's annotations; rebuilt nodes start unresolved.
+
+NO_OP = 255
+
+# Class name -> (child fields in order, field stored in the literal table).
+# A child field starting with '*' is a list spread over consecutive children.
+SCHEMA = {
+    'NoneType': ((), None),
+    'Identifier': ((), 'name'),
+    'Integer': ((), 'value'),
+    'Float': ((), 'value'),
+    'Bool': ((), 'value'),
+    'String': ((), 'value'),
+    'Grouping': (('value',), None),
+    'UnOp': (('operand',), None),
+    'LogicalOp': (('left', 'right'), None),
+    'BinOp': (('left', 'right'), None),
+    'WhileStmt': (('test', 'body_stmts'), None),
+    'Assignment': (('left', 'right'), None),
+    'Stmts': (('*stmts',), None),
+    'PrintStmt': (('value',), 'end'),
+    'IfStmt': (('test', 'then_stmts', 'else_stmts'), None),
+    'ForStmt': (('ident', 'start', 'end', 'step', 'body_stmts'), None),
+    'FuncDecl': (('*params', 'body_stmts'), 'name'),
+    'Params': ((), 'name'),
+    'FuncCall': (('*args',), 'name'),
+    'FuncCallStmt': (('expr',), None),
+    'RetStmt': (('expr',), None),
+    'LocalStmt': (('expr',), 'ident'),
+}
+NODE_KINDS = list(SCHEMA)
+NODE_KIND = {name: kind for kind, name in enumerate(NODE_KINDS)}
+LEXEMES = {token_type: lexeme for lexeme, token_type in {**keywords, **operators}.items()}
+
+
+def child_fields(children):
+    return tuple((field.lstrip('*'), field[0] == '*') for field in children)
+
+
+# Per class / per kind lookups for from_tree() and to_tree().
+SPECS = {type(None): (0, (), None, False)}
+BUILDERS = [(None, (), None, False)]
+for _name, (_children, _literal) in list(SCHEMA.items())[1:]:
+    _cls = getattr(model, _name)
+    SPECS[_cls] = (NODE_KIND[_name], child_fields(_children), _literal, 'op' in _cls.__slots__)
+    BUILDERS.append((_cls, child_fields(_children), _literal, 'line' in _cls.__slots__))
+
+
+class FlatAST:
+    def __init__(self):
+        self.kinds = array('B')
+        self.first = array('i')
+        self.next = array('i')
+        self.ops = array('B')
+        self.values = array('i')
+        self.lines = array('I')
+        self.literals = []
+        self.literal_ids = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @classmethod
+    def from_tree(cls, node):
+        """Flatten an object tree; the root becomes node 0."""
+        flat = cls()
+        flat.add(node)
+        return flat
+
+    def add(self, node):
+        kinds, first, sibling = self.kinds, self.first, self.next
+        ops, values, lines = self.ops, self.values, self.lines
+        intern = self.intern
+
+        def add(node):
+            i = len(kinds)
+            kind, children, literal, has_op = SPECS[type(node)]
+            kinds.append(kind)
+            first.append(-1)
+            sibling.append(-1)
+            ops.append(KIND[node.op.token_type] if has_op else NO_OP)
+            values.append(-1 if literal is None else intern(getattr(node, literal)))
+            lines.append(getattr(node, 'line', 0))
+            prev = -1
+            for field, many in children:
+                items = getattr(node, field)
+                for item in (items if many else (items,)):
+                    child = add(item)
+                    if prev == -1:
+                        first[i] = child
+                    else:
+                        sibling[prev] = child
+                    prev = child
+            return i
+
+        return add(node)
+
+    def intern(self, value):
+        # The type is part of the key: 1, 1.0 and True are different literals.
+        key = (type(value), value)
+        index = self.literal_ids.get(key)
+        if index is None:
+            index = self.literal_ids[key] = len(self.literals)
+            self.literals.append(value)
+        return index
+
+    def kind(self, i):
+        """Class name of node i."""
+        return NODE_KINDS[self.kinds[i]]
+
+    def children(self, i):
+        """Indices of the children of node i, in SCHEMA order."""
+        child = self.first[i]
+        while child != -1:
+            yield child
+            child = self.next[child]
+
+    def child(self, i, n):
+        """Index of the n-th child of node i."""
+        child = self.first[i]
+        for _ in range(n):
+            child = self.next[child]
+        return child
+
+    def literal(self, i):
+        index = self.values[i]
+        return None if index == -1 else self.literals[index]
+
+    def op(self, i):
+        """Operator token type of node i, or None."""
+        op = self.ops[i]
+        return None if op == NO_OP else TOKEN_KINDS[op]
+
+    def line(self, i):
+        return self.lines[i]
+
+    def field(self, i, name):
+        """
+        Field name of node i, as named in model.py: a child index (None for a
+        missing optional child), a list of child indices, a literal, the
+        operator token type or the line.
+        """
+        children, literal = SCHEMA[self.kind(i)]
+        if name == literal:
+            return self.literal(i)
+        if name == 'op':
+            return self.op(i)
+        if name == 'line':
+            return self.lines[i]
+        nodes = list(self.children(i))
+        fixed = sum(1 for field in children if field[0] != '*')
+        pos = 0
+        for field in children:
+            if field[0] == '*':
+                count = len(nodes) - fixed
+                if field[1:] == name:
+                    return nodes[pos:pos + count]
+                pos += count
+                continue
+            if field == name:
+                child = nodes[pos]
+                return None if self.kinds[child] == 0 else child
+            pos += 1
+        raise AttributeError(f'{self.kind(i)} has no field {name!r}')
+
+    def walk(self, root=0):
+        """Indices of root and all nodes below it, in preorder."""
+        first, sibling = self.first, self.next
+        yield root
+        stack = [first[root]]
+        while stack:
+            i = stack.pop()
+            if i == -1:
+                continue
+            yield i
+            stack.append(sibling[i])
+            stack.append(first[i])
+
+    def to_tree(self, i=0):
+        """Rebuild the object tree rooted at node i."""
+        kinds, first, sibling = self.kinds, self.first, self.next
+        ops, values, lines, literals = self.ops, self.values, self.lines, self.literals
+        new = object.__new__
+
+        def build(i):
+            cls, children, literal, has_line = BUILDERS[kinds[i]]
+            if cls is None:
+                return None
+            node = new(cls)
+            for name in cls.resolved:
+                setattr(node, name, None)
+            if literal is not None:
+                setattr(node, literal, literals[values[i]])
+            if has_line:
+                node.line = lines[i]
+            op = ops[i]
+            if op != NO_OP:
+                token_type = TOKEN_KINDS[op]
+                node.op = Token(token_type, LEXEMES[token_type], lines[i])
+            child = first[i]
+            for field, many in children:
+                if many:
+                    # A list runs up to the fixed fields after it (FuncDecl's body).
+                    items = []
+                    rest = len(children) - 1
+                    while child != -1:
+                        items.append(child)
+                        child = sibling[child]
+                    if rest:
+                        child = items[-rest]
+                        items = items[:-rest]
+                    setattr(node, field, [build(item) for item in items])
+                else:
+                    setattr(node, field, build(child))
+                    child = sibling[child]
+            return node
+
+        # Only allocation happens here; see ASTCache.get().
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return build(i)
+        finally:
+            if enabled:
+                gc.enable()
+
+
+class FlatVisitor:
+    """
+    Walks a FlatAST by node index, calling visit_<ClassName>(i) for each node
+    (generic_visit(i) if there is none).
+    """
+
+    def __init__(self, flat):
+        self.flat = flat
+        self.handlers = [getattr(self, 'visit_' + name, self.generic_visit) for name in NODE_KINDS]
+
+    def visit(self, i=0):
+        return self.handlers[self.flat.kinds[i]](i)
+
+    def generic_visit(self, i):
+        for child in self.flat.children(i):
+            self.visit(child)
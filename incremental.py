@@ -0,0 +1,137 @@
+from bisect import bisect_left, bisect_right
+
+from lexer import Lexer
+from model import *
+from optimizer import ASTOptimizer
+from parser import Parser
+from tokens import *
+from utils import NvError, parse_error
+
+# Incremental front end for the live editor.
+#
+# The program is kept as a list of top-level statements, each remembering the
+# source offset and line of its first token. An edit re-lexes and re-parses
+# from the statement before the damaged one and stops as soon as the parser
+# is between two statements at a position where an old statement used to
+# start (shifted by the edit): from there on text, tokens and parser state are
+# identical, so the old statements are reused. Lexing and parsing work is thus
+# proportional to the edited statement (usually a FuncDecl), plus a cheap
+# shift of the start offset and line kept for each later statement.
+#
+# When an edit adds or removes lines, the nodes of the later statements are
+# not touched: their line delta is added to a pending shift per statement,
+# and the line numbers are only fixed when the AST is next read (.ast), once
+# for any number of edits.
+
+
+class IncrementalFrontend:
+    def __init__(self, source, optimize=False):
+        self.source = source
+        self.optimizer = ASTOptimizer() if optimize else None
+        self.starts = []
+        self.lines = []
+        # Lines each statement's nodes are behind its entry in self.lines.
+        self.shifts = []
+        self.shifted = False
+        self.program = Stmts([], 1)
+        self.reparse(0, 1, 0, 0, 0)
+
+    @property
+    def ast(self):
+        """The program's AST, with the line numbers moved by the edits so far applied."""
+        if self.shifted:
+            for i, shift in enumerate(self.shifts):
+                if shift:
+                    shift_lines(self.program.stmts[i], shift)
+                    self.shifts[i] = 0
+            self.shifted = False
+        return self.program
+
+    def edit(self, offset, removed, inserted):
+        """Replace source[offset:offset + removed] by inserted; the new program is in .ast."""
+        self.source = self.source[:offset] + inserted + self.source[offset + removed:]
+        delta = len(inserted) - removed
+        starts = self.starts
+        # Restart one statement before the damaged one: the edit may extend it.
+        k = bisect_right(starts, offset) - 2
+        if k >= 0:
+            pos, line = starts[k], self.lines[k]
+        else:
+            k, pos, line = 0, 0, 1
+        try:
+            self.reparse(pos, line, k, bisect_left(starts, offset + removed), delta, offset + len(inserted))
+        except NvError:
+            # The statement list no longer matches the text: forget it, so the
+            # next edit parses the whole source again.
+            self.starts, self.lines, self.shifts, self.program = [], [], [], Stmts([], 1)
+            self.shifted = False
+            raise
+
+    def reparse(self, pos, line, first, old, delta, edit_end=0):
+        """
+        Parse top-level statements from source offset pos (at line) and replace
+        the old statements from index first on, until the parser reaches the
+        shifted start of an old statement at or after index old that lies past
+        edit_end.
+        """
+        starts, lines, shifts = self.starts, self.lines, self.shifts
+        lexer = Lexer(self.source)
+        lexer.curr = pos
+        lexer.line = line
+        offsets = []
+
+        def tokens():
+            for token_type, start, end, line in lexer.iter_spans():
+                offsets.append(start)
+                yield Token(token_type, self.source[start:end], line)
+
+        parser = Parser(tokens())
+        new_starts, new_lines, new_stmts = [], [], []
+        resync = len(starts)
+        while not parser.at_end():
+            token = parser.peek()
+            start = offsets[parser.curr]
+            if start >= edit_end:
+                while old < len(starts) and starts[old] + delta < start:
+                    old += 1
+                if old < len(starts) and starts[old] + delta == start:
+                    resync = old
+                    break
+            if token.token_type in (TOK_ELSE, TOK_END):
+                parse_error(f'Unexpected {token.lexeme!r}', token.line)
+            new_starts.append(start)
+            new_lines.append(token.line)
+            stmt = parser.stmt()
+            if self.optimizer is not None:
+                stmt = self.optimizer.optimize(stmt)
+            new_stmts.append(stmt)
+
+        if resync < len(starts):
+            line_delta = parser.peek().line - lines[resync]
+            starts[resync:] = [start + delta for start in starts[resync:]]
+            if line_delta:
+                lines[resync:] = [line + line_delta for line in lines[resync:]]
+                shifts[resync:] = [shift + line_delta for shift in shifts[resync:]]
+                self.shifted = True
+            self.program.line += line_delta
+        elif parser.previous_token() is not None:
+            self.program.line = parser.previous_token().line
+        starts[first:resync] = new_starts
+        lines[first:resync] = new_lines
+        shifts[first:resync] = [0] * len(new_stmts)
+        self.program.stmts[first:resync] = new_stmts
+
+
+def shift_lines(node, delta):
+    """Move every node (and operator token) below node by delta lines."""
+    if isinstance(node, list):
+        for item in node:
+            shift_lines(item, delta)
+    elif isinstance(node, (Node, Token)):
+        if isinstance(getattr(node, 'line', None), int):
+            node.line += delta
+        if isinstance(node, Node):
+            for name in node.__slots__:
+                value = getattr(node, name)
+                if isinstance(value, (Node, Token, list)):
+                    shift_lines(value, delta)
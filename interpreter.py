@@ -1,8 +1,11 @@
+from effects import EffectAnalyzer
+from memo import memo_key
 from model import *
+from output import Output
+from resolver import Resolver
 from state import *
 from tokens import *
 from utils import *
-import codecs
 ################################################################################
 # Constants for different runtime value types
 ################################################################################
@@ -11,203 +14,262 @@ TYPE_STRING = 'TYPE_STRING'  # String managed by the host language
 TYPE_BOOL = 'TYPE_BOOL'  # true | false
 
 
-class Interpreter:
-    def interpret(self, node,env):
-        if isinstance(node, Integer):
-            return (TYPE_NUMBER, float(node.value))
-        elif isinstance(node, Float):
-            return (TYPE_NUMBER, float(node.value))
-        elif isinstance(node, String):
-            return (TYPE_STRING, str(node.value))
-        elif isinstance(node, Bool):
-            return (TYPE_BOOL, node.value)
-        elif isinstance(node, Grouping):
-            return self.interpret(node.value,env)
-        elif isinstance(node, Identifier):
-            value = env.get_var(node.name)
-            if value is None:
-                runtime_error(f'Undefined variable {node.name!r}.', node.line)
-            if value[1] is None:
-                runtime_error(f'Uninitialized variable {node.name!r}.', node.line)
-            return value
-        elif isinstance(node, Assignment):
-            righttype, rightval = self.interpret(node.right,env)
-            env.set_var(node.left.name,(righttype,rightval))
-        elif isinstance(node, BinOp):
-            lefttype, leftval = self.interpret(node.left,env)
-            righttype, rightval = self.interpret(node.right,env)
-            if node.op.token_type == TOK_PLUS:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, leftval + rightval)
-                elif lefttype == TYPE_STRING or righttype == TYPE_STRING:
-                    return (TYPE_STRING, stringify(leftval) + stringify(rightval))
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_MINUS:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, leftval - rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_STAR:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, leftval * rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_SLASH:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, leftval / rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_MOD:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, leftval % rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_CARET:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, leftval ** rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_GT:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER or lefttype == TYPE_STRING and righttype == TYPE_STRING:
-                    return (TYPE_BOOL, leftval > rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_GE:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER or lefttype == TYPE_STRING and righttype == TYPE_STRING:
-                    return (TYPE_BOOL, leftval >= rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_LT:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER or lefttype == TYPE_STRING and righttype == TYPE_STRING:
-                    return (TYPE_BOOL, leftval < rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_LE:
-                if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER or lefttype == TYPE_STRING and righttype == TYPE_STRING:
-                    return (TYPE_BOOL, leftval <= rightval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} between {lefttype} and {righttype}.',
-                                  node.op.line)
-            elif node.op.token_type == TOK_EQEQ:
-                return (TYPE_BOOL, lefttype == righttype and leftval == rightval)
-            elif node.op.token_type == TOK_NE:
-                return (TYPE_BOOL, lefttype != righttype or leftval != rightval)
-
-        elif isinstance(node, UnOp):
-            operandtype, operandval = self.interpret(node.operand,env)
-            if node.op.token_type == TOK_MINUS:
-                if operandtype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, -operandval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} with {operandtype}.', node.op.line)
-            if node.op.token_type == TOK_PLUS:
-                if operandtype == TYPE_NUMBER:
-                    return (TYPE_NUMBER, operandval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} with {operandtype}.', node.op.line)
-            elif node.op.token_type == TOK_NOT:
-                if operandtype == TYPE_BOOL:
-                    return (TYPE_BOOL, not operandval)
-                else:
-                    runtime_error(f'Unsupported operator {node.op.lexeme!r} with {operandtype}.', node.op.line)
-        elif isinstance(node, LogicalOp):
-            if node.op.token_type == TOK_AND:
-                lefttype, leftval = self.interpret(node.left,env)
-                if not leftval:
-                    return (TYPE_BOOL, False)
-                else:
-                    righttype, rightval = self.interpret(node.right,env)
-                    return TYPE_BOOL, bool(rightval)
-            elif node.op.token_type == TOK_OR:
-                lefttype, leftval = self.interpret(node.left,env)
-                if leftval:
-                    return (TYPE_BOOL, True)
-                else:
-                    righttype, rightval = self.interpret(node.right,env)
-                    return TYPE_BOOL, bool(rightval)
-        elif isinstance(node, Stmts):
-            for stmt in node.stmts:
-                self.interpret(stmt,env)
-        elif isinstance(node,PrintStmt):
-            expr_type ,expr_val=self.interpret(node.value,env)
-            val = stringify(expr_val)
-            print(codecs.escape_decode(bytes(val, "utf-8"))[0].decode("utf-8"), end=node.end)
-        elif isinstance(node, IfStmt):
-            testtype,testval = self.interpret(node.test,env)
-            if testtype!=TYPE_BOOL:
-                runtime_error("if condition is not a bool type",node.line)
-            if testval:
-                self.interpret(node.then_stmts,env.new_env())
-            else:
-                self.interpret(node.else_stmts,env.new_env())
-        elif isinstance(node, WhileStmt):
-            new_env = env.new_env()
-            while True:
-                test_type,test_val = self.interpret(node.test,env)
-                if test_type!=TYPE_BOOL:
-                    runtime_error("while condition is not a bool type",node.line)
-                if not test_val:
-                    break
-                self.interpret(node.body_stmts,new_env)
-        elif isinstance(node, ForStmt):
-            new_env = env.new_env()
-            varname = node.ident.name
-            itype,ival = self.interpret(node.start,new_env)
-            endtype,endval = self.interpret(node.end,new_env)
-            if ival<endval:
-                if node.step is None:
-                    stepval = 1
-                    steptype = TYPE_NUMBER
-                else:
-                    steptype,stepval = self.interpret(node.step,new_env)
-                while ival<endval:
-                    newval = (TYPE_NUMBER,ival)
-                    env.set_var(varname,newval)
-                    self.interpret(node.body_stmts,new_env)
-                    ival+=stepval
-        elif isinstance(node, FuncCall):
-            func = env.get_func(node.name)
-            if func is None:
-                runtime_error(f"function {node.name} not found",node.line)
+# Statements return None when they complete normally. A `ret` makes its
+# statement return the value being returned instead, and every
+# enclosing block, if and loop hands that straight back up to the FuncCall.
+# A `ret f(...)` in a function returns a TailCall the same way, and the
+# FuncCall loops to make that call (see state.TailCall).
+
+
+class Interpreter(NodeVisitor):
+    def __init__(self, memo=None, output=None):
+        # A memo.Memoizer to cache the results of pure functions, or None.
+        self.memo = memo
+        self.output = Output() if output is None else output
+        self.write = self.output.write
+
+    def interpret(self, node, env):
+        return self.dispatch[type(node)](self, node, env)
+
+    def visit_Integer(self, node, env):
+        return float(node.value)
+
+    def visit_Float(self, node, env):
+        return float(node.value)
+
+    def visit_String(self, node, env):
+        return str(node.value)
+
+    def visit_Bool(self, node, env):
+        return node.value
+
+    def visit_Grouping(self, node, env):
+        return self.interpret(node.value,env)
+
+    def visit_Identifier(self, node, env):
+        value = frame_get(env, node.scope)
+        if value is None:
+            runtime_error(f'Undefined variable {node.name!r}.', node.line)
+        return value
+
+    def visit_Assignment(self, node, env):
+        frame_set(env, node.scope, self.interpret(node.right,env))
+
+    def visit_BinOp(self, node, env):
+        left = self.interpret(node.left,env)
+        right = self.interpret(node.right,env)
+        numbers = type(left) in NUMBERS and type(right) in NUMBERS
+        if node.op.token_type == TOK_PLUS:
+            if numbers:
+                return left + right
+            elif type(left) is str or type(right) is str:
+                return stringify(left) + stringify(right)
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_MINUS:
+            if numbers:
+                return left - right
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_STAR:
+            if numbers:
+                return left * right
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_SLASH:
+            if numbers:
+                try:
+                    return left / right
+                except (ZeroDivisionError, OverflowError) as error:
+                    self.arithmetic_error(node, error)
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_MOD:
+            if numbers:
+                try:
+                    return left % right
+                except (ZeroDivisionError, OverflowError) as error:
+                    self.arithmetic_error(node, error)
             else:
-                func_decl = func[0]
-                func_env = func[1]
-                if len(func_decl.params)!=len(node.args):
-                    runtime_error(f"function {node.name} expected {len(func_decl.params)} arguments, got {len(node.args)}",node.line)
-                args = []
-                for arg in node.args:
-                    args.append(self.interpret(arg,env))
-                new_env = func_env.new_env()
-                for param,arg in zip(func_decl.params,args):
-                    new_env.set_local(param.name,arg)
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_CARET:
+            if numbers:
                 try:
-                    self.interpret(func_decl.body_stmts,new_env)
-                except ReturnException as e:
-                    return e.args[0]
-                return (TYPE_BOOL, False)
-
-        elif isinstance(node, FuncDecl):
-            env.set_func(node.name,(node,env))
-        elif isinstance(node, FuncCallStmt):
-            self.interpret(node.expr,env)
-        elif isinstance(node, RetStmt):
-            raise ReturnException(self.interpret(node.expr,env))
-        elif isinstance(node, LocalStmt):
-            env.set_local(node.ident,self.interpret(node.expr,env))
+                    return left ** right
+                except (ZeroDivisionError, OverflowError) as error:
+                    self.arithmetic_error(node, error)
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_GT:
+            if numbers or type(left) is str and type(right) is str:
+                return left > right
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_GE:
+            if numbers or type(left) is str and type(right) is str:
+                return left >= right
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_LT:
+            if numbers or type(left) is str and type(right) is str:
+                return left < right
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_LE:
+            if numbers or type(left) is str and type(right) is str:
+                return left <= right
+            else:
+                self.unsupported(node, left, right)
+        elif node.op.token_type == TOK_EQEQ:
+            # Values of different types are never equal (Python has 1.0 == True).
+            return (numbers or type(left) is type(right)) and left == right
+        elif node.op.token_type == TOK_NE:
+            return not (numbers or type(left) is type(right)) or left != right
 
-    def interpret_ast(self,node):
-        env = Environment()
-        self.interpret(node,env)
+    def unsupported(self, node, left, right):
+        runtime_error(f'Unsupported operator {node.op.lexeme!r} between {type_name(left)} and {type_name(right)}.',
+                      node.op.line)
+
+    def arithmetic_error(self, node, error):
+        runtime_error(f'{ARITHMETIC_ERRORS[type(error)]}.', node.op.line)
+
+    def visit_UnOp(self, node, env):
+        operand = self.interpret(node.operand,env)
+        if node.op.token_type == TOK_MINUS:
+            if type(operand) in NUMBERS:
+                return -operand
+            else:
+                runtime_error(f'Unsupported operator {node.op.lexeme!r} with {type_name(operand)}.', node.op.line)
+        if node.op.token_type == TOK_PLUS:
+            if type(operand) in NUMBERS:
+                return operand
+            else:
+                runtime_error(f'Unsupported operator {node.op.lexeme!r} with {type_name(operand)}.', node.op.line)
+        elif node.op.token_type == TOK_NOT:
+            if type(operand) is bool:
+                return not operand
+            else:
+                runtime_error(f'Unsupported operator {node.op.lexeme!r} with {type_name(operand)}.', node.op.line)
+
+    def visit_LogicalOp(self, node, env):
+        if node.op.token_type == TOK_AND:
+            if not self.interpret(node.left,env):
+                return False
+            else:
+                return bool(self.interpret(node.right,env))
+        elif node.op.token_type == TOK_OR:
+            if self.interpret(node.left,env):
+                return True
+            else:
+                return bool(self.interpret(node.right,env))
+
+    def visit_Stmts(self, node, env):
+        for stmt in node.stmts:
+            result = self.interpret(stmt,env)
+            if result is not None:
+                return result
+
+    def visit_PrintStmt(self, node, env):
+        self.write(stringify(self.interpret(node.value,env)) + node.end)
+
+    def visit_IfStmt(self, node, env):
+        testval = self.interpret(node.test,env)
+        if type(testval) is not bool:
+            runtime_error("if condition is not a bool type",node.line)
+        if testval:
+            return self.interpret(node.then_stmts,new_frame(env,node.then_size) if node.then_size else env)
+        elif node.else_stmts is not None:
+            return self.interpret(node.else_stmts,new_frame(env,node.else_size) if node.else_size else env)
 
-class ReturnException(Exception):
-    pass
\ No newline at end of file
+    def visit_WhileStmt(self, node, env):
+        new_env = new_frame(env, node.size) if node.size else env
+        while True:
+            test_val = self.interpret(node.test,env)
+            if type(test_val) is not bool:
+                runtime_error("while condition is not a bool type",node.line)
+            if not test_val:
+                break
+            result = self.interpret(node.body_stmts,new_env)
+            if result is not None:
+                return result
+
+    def visit_ForStmt(self, node, env):
+        new_env = new_frame(env, node.size) if node.size else env
+        varscope = node.ident.scope
+        ival = self.interpret(node.start,new_env)
+        endval = self.interpret(node.end,new_env)
+        if ival<endval:
+            if node.step is None:
+                stepval = 1
+            else:
+                stepval = self.interpret(node.step,new_env)
+            while ival<endval:
+                frame_set(env,varscope,ival)
+                result = self.interpret(node.body_stmts,new_env)
+                if result is not None:
+                    return result
+                ival+=stepval
+
+    def visit_FuncCall(self, node, env):
+        # (cache, key) to store the result under if this is a memoized call.
+        # Functions it tail-calls are looked up but not stored, so that tail
+        # recursion stays in constant space.
+        pending = None
+        while True:
+            func = frame_get(env, node.scope)
+            if func is None:
+                runtime_error(f"function {node.name} not found",node.line)
+            func_decl = func[0]
+            func_env = func[1]
+            if len(func_decl.params)!=len(node.args):
+                runtime_error(f"function {node.name} expected {len(func_decl.params)} arguments, got {len(node.args)}",node.line)
+            args = []
+            for arg in node.args:
+                args.append(self.interpret(arg,env))
+            if self.memo is not None and func_decl.pure:
+                cache = self.memo.cache(func_decl, func_decl.name)
+                key = memo_key(args)
+                result = cache.get(key)
+                if result is not None:
+                    break
+                if pending is None:
+                    pending = (cache, key)
+            new_env = new_frame(func_env,func_decl.size) if func_decl.size else func_env
+            for param,arg in zip(func_decl.params,args):
+                new_env[param.slot] = arg
+            result = self.interpret(func_decl.body_stmts,new_env)
+            if type(result) is not TailCall:
+                if result is None:
+                    result = False
+                break
+            # `ret g(...)`: call g here instead of one level deeper.
+            node, env = result.call, result.env
+        if pending is not None:
+            cache, key = pending
+            cache.put(key, result)
+        return result
+
+    def visit_FuncDecl(self, node, env):
+        env[node.slot] = (node,env)
+
+    def visit_FuncCallStmt(self, node, env):
+        self.interpret(node.expr,env)
+
+    def visit_RetStmt(self, node, env):
+        if node.tail:
+            return TailCall(node.expr,env)
+        return self.interpret(node.expr,env)
+
+    def visit_LocalStmt(self, node, env):
+        env[node.slot] = self.interpret(node.expr,env)
+
+    def interpret_ast(self,node):
+        # A `ret` outside any function ends the program, as it does in the
+        # LLVM backend's main().
+        size = Resolver().resolve_ast(node)
+        if self.memo is not None:
+            EffectAnalyzer().analyze(node)
+        try:
+            self.interpret(node,new_frame(None,size))
+        finally:
+            self.output.flush()
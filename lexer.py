@@ -1,10 +1,44 @@
+import re
+
 from tokens import *
 from utils import lexing_error
 
+# Master pattern of the table-driven engine. Blanks before a token are eaten
+# by the leading [ \t\r]*, so only newlines produce a separate WS match.
+# Group names are the token types, except WS and COMMENT which are dropped;
+# TOK_IDENTIFIER is looked up in TOKEN_TYPES first to pick up the keywords.
+# Only ASCII is matched here, anything else falls back to scan_token.
+TOKEN_PATTERN = re.compile(r'''[ \t\r]*(?:
+    (?P<WS>\n[ \t\r\n]*)
+  | (?P<COMMENT>--[^\n]*)
+  | (?P<TOK_IDENTIFIER>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<TOK_FLOAT>[0-9]+\.[0-9]+)
+  | (?P<TOK_INTEGER>[0-9]+)
+  | (?P<OP>[=~<>:]=?|[-+*/^%;?()\[\]{},.])
+  | (?P<TOK_STRING>"[^"]*"|'[^']*')
+)''', re.VERBOSE)
+
+TOKEN_TYPES = {**keywords, **operators}
+
+# Groups whose extent depends on str.isalnum()/str.isdigit() in the legacy
+# scanner, so a non-ASCII character right after them needs the slow path.
+WORD_GROUPS = ('TOK_IDENTIFIER', 'TOK_INTEGER', 'TOK_FLOAT')
+
+BLANKS = re.compile(r'[ \t\r]*')
+
+# Characters read at a time when lexing from a file.
+CHUNK_SIZE = 1 << 16
+
 
 class Lexer:
-    def __init__(self, source):
+    def __init__(self, source, legacy=False):
+        if isinstance(source, str):
+            self.file = None
+        else:
+            self.file = source
+            source = ''
         self.source = source
+        self.legacy = legacy
         self.start = 0
         self.curr = 0
         self.line = 1
@@ -66,86 +100,223 @@ class Lexer:
         self.tokens.append(Token(token_type, self.source[self.start:self.curr], self.line))
 
     def tokenize(self):
-        while self.curr < len(self.source):
-            self.start = self.curr
-            ch = self.advance()
-            if ch == '\n':
-                self.line = self.line + 1
-            elif ch == ' ':
-                pass
-            elif ch == '\t':
-                pass
-            elif ch == '\r':
-                pass
-            elif ch == '(':
-                self.add_token(TOK_LPAREN)
-            elif ch == ')':
-                self.add_token(TOK_RPAREN)
-            elif ch == '{':
-                self.add_token(TOK_LCURLY)
-            elif ch == '}':
-                self.add_token(TOK_RCURLY)
-            elif ch == '[':
-                self.add_token(TOK_LSQUAR)
-            elif ch == ']':
-                self.add_token(TOK_RSQUAR)
-            elif ch == '.':
-                self.add_token(TOK_DOT)
-            elif ch == ',':
-                self.add_token(TOK_COMMA)
-            elif ch == '+':
-                self.add_token(TOK_PLUS)
-            elif ch == '-':
-                if self.match('-'):
-                    while self.peek() != '\n' and not (self.curr >= len(self.source)):
-                        self.advance()
-                else:
-                    self.add_token(TOK_MINUS)
-            elif ch == '*':
-                self.add_token(TOK_STAR)
-            elif ch == '^':
-                self.add_token(TOK_CARET)
-            elif ch == '/':
-                self.add_token(TOK_SLASH)
-            elif ch == ';':
-                self.add_token(TOK_SEMICOLON)
-            elif ch == '?':
-                self.add_token(TOK_QUESTION)
-            elif ch == '%':
-                self.add_token(TOK_MOD)
-            elif ch == '=':
-                if self.match('='):
-                    self.add_token(TOK_EQEQ)
-                else:
-                    self.add_token(TOK_EQ)
-            elif ch == '~':
-                if self.match('='):
-                    self.add_token(TOK_NE)
-                else:
-                    self.add_token(TOK_NOT)
-            elif ch == '<':
-                if self.match('='):
-                    self.add_token(TOK_LE)
-                else:
-                    self.add_token(TOK_LT)
-            elif ch == '>':
-                if self.match('='):
-                    self.add_token(TOK_GE)
-                else:
-                    self.add_token(TOK_GT)
-            elif ch == ':':
-                if self.match('='):
-                    self.add_token(TOK_ASSIGN)
+        if self.legacy:
+            return self.tokenize_legacy()
+        self.tokens = list(self.iter_tokens())
+        return self.tokens
+
+    def iter_tokens(self, chunk_size=CHUNK_SIZE):
+        """
+        Yield tokens one at a time. A file source is read chunk_size
+        characters at a time, so only the unconsumed tail of the input is
+        kept in memory.
+        """
+        source = self.source
+        read = self.read_file if self.file is not None else None
+        types = TOKEN_TYPES
+        match = TOKEN_PATTERN.match
+        pending = self.tokens = []
+        pos = self.curr
+        line = self.line
+        eof = read is None
+        if not eof:
+            source, pos, eof = self.refill(source, pos, read, chunk_size)
+        size = len(source)
+        checked = not source.isascii()
+        while pos < size or not eof:
+            m = match(source, pos)
+            if m is not None:
+                end = m.end()
+                kind = m.lastgroup
+                if eof or end + 2 <= size:
+                    if not (checked and kind in WORD_GROUPS and not source[end:end + 2].isascii()):
+                        if kind == 'WS':
+                            line += m.group(kind).count('\n')
+                        elif kind != 'COMMENT':
+                            text = m.group(kind)
+                            yield Token(types.get(text, kind), text, line)
+                        pos = end
+                        continue
+                    refill = False
                 else:
-                    self.add_token(TOK_COLON)
-            elif ch.isdigit():
-                self.handle_number()
-            elif ch == "'":
-                self.handle_string("'")
-            elif ch == '"':
-                self.handle_string('"')
-            elif ch.isalpha() or ch == '_':
-                self.handle_identifier()
+                    # The token may continue in the next chunk.
+                    refill = True
             else:
-                lexing_error(f'Unexpected character: {ch}', self.line)
+                # Out of input, or a string whose closing quote is not loaded yet?
+                refill = not eof and (pos + 2 > size or
+                                      source[BLANKS.match(source, pos).end():][:1] in ('"', "'"))
+            if not refill:
+                # Leave characters the pattern does not know, and words
+                # running into non-ASCII text, to the legacy scanner.
+                self.source = source
+                self.start = self.curr = pos
+                self.line = line
+                self.scan_token()
+                refill = not eof and self.curr + 2 > size
+                if not refill:
+                    pos = self.curr
+                    line = self.line
+                    yield from pending
+                del pending[:]
+            if refill:
+                source, pos, eof = self.refill(source, pos, read, chunk_size)
+                size = len(source)
+                checked = checked or not source.isascii()
+        self.source = source
+        self.curr = pos
+        self.line = line
+
+    def refill(self, source, pos, read, chunk_size):
+        data = read(max(chunk_size, len(source) - pos))
+        return source[pos:] + data, 0, not data
+
+    def tokenize_store(self):
+        """
+        Lex the whole (string) source into a TokenStore without creating a
+        Token object per token.
+        """
+        self.read_all()
+        store = TokenStore(self.source)
+        kinds, starts, ends, lines = store.kinds, store.starts, store.ends, store.lines
+        for token_type, start, end, line in self.iter_spans():
+            kinds.append(KIND[token_type])
+            starts.append(start)
+            ends.append(end)
+            lines.append(line)
+        return store
+
+    def iter_spans(self):
+        """
+        Yield (token_type, start, end, line) for every token from self.curr
+        on, where start:end are offsets into the source.
+        """
+        self.read_all()
+        source = self.source
+        types = TOKEN_TYPES
+        size = len(source)
+        match = TOKEN_PATTERN.match
+        checked = not source.isascii()
+        pending = self.tokens = []
+        pos = self.curr
+        line = self.line
+        while pos < size:
+            m = match(source, pos)
+            if m is None or (checked and m.lastgroup in WORD_GROUPS
+                             and not source[m.end():m.end() + 2].isascii()):
+                self.start = self.curr = pos
+                self.line = line
+                self.scan_token()
+                if pending:
+                    yield pending.pop().token_type, self.start, self.curr, line
+                pos = self.curr
+                line = self.line
+                continue
+            kind = m.lastgroup
+            if kind == 'WS':
+                line += m.group(kind).count('\n')
+            elif kind != 'COMMENT':
+                start, end = m.span(kind)
+                yield types.get(source[start:end], kind), start, end, line
+            pos = m.end()
+        self.curr = pos
+        self.line = line
+
+    def read_file(self, size=-1):
+        try:
+            return self.file.read(size)
+        except UnicodeDecodeError as error:
+            lexing_error(f'Source is not valid {error.encoding}: {error.reason}', None)
+
+    def read_all(self):
+        if self.file is not None:
+            self.source += self.read_file()
+            self.file = None
+
+    def tokenize_legacy(self):
+        self.read_all()
+        while self.curr < len(self.source):
+            self.start = self.curr
+            self.scan_token()
         return self.tokens
+
+    def scan_token(self):
+        ch = self.advance()
+        if ch == '\n':
+            self.line = self.line + 1
+        elif ch == ' ':
+            pass
+        elif ch == '\t':
+            pass
+        elif ch == '\r':
+            pass
+        elif ch == '(':
+            self.add_token(TOK_LPAREN)
+        elif ch == ')':
+            self.add_token(TOK_RPAREN)
+        elif ch == '{':
+            self.add_token(TOK_LCURLY)
+        elif ch == '}':
+            self.add_token(TOK_RCURLY)
+        elif ch == '[':
+            self.add_token(TOK_LSQUAR)
+        elif ch == ']':
+            self.add_token(TOK_RSQUAR)
+        elif ch == '.':
+            self.add_token(TOK_DOT)
+        elif ch == ',':
+            self.add_token(TOK_COMMA)
+        elif ch == '+':
+            self.add_token(TOK_PLUS)
+        elif ch == '-':
+            if self.match('-'):
+                while self.peek() != '\n' and not (self.curr >= len(self.source)):
+                    self.advance()
+            else:
+                self.add_token(TOK_MINUS)
+        elif ch == '*':
+            self.add_token(TOK_STAR)
+        elif ch == '^':
+            self.add_token(TOK_CARET)
+        elif ch == '/':
+            self.add_token(TOK_SLASH)
+        elif ch == ';':
+            self.add_token(TOK_SEMICOLON)
+        elif ch == '?':
+            self.add_token(TOK_QUESTION)
+        elif ch == '%':
+            self.add_token(TOK_MOD)
+        elif ch == '=':
+            if self.match('='):
+                self.add_token(TOK_EQEQ)
+            else:
+                self.add_token(TOK_EQ)
+        elif ch == '~':
+            if self.match('='):
+                self.add_token(TOK_NE)
+            else:
+                self.add_token(TOK_NOT)
+        elif ch == '<':
+            if self.match('='):
+                self.add_token(TOK_LE)
+            else:
+                self.add_token(TOK_LT)
+        elif ch == '>':
+            if self.match('='):
+                self.add_token(TOK_GE)
+            else:
+                self.add_token(TOK_GT)
+        elif ch == ':':
+            if self.match('='):
+                self.add_token(TOK_ASSIGN)
+            else:
+                self.add_token(TOK_COLON)
+        elif ch.isdigit():
+            self.handle_number()
+        elif ch == "'":
+            self.handle_string("'")
+        elif ch == '"':
+            self.handle_string('"')
+        elif ch.isalpha() or ch == '_':
+            self.handle_identifier()
+        else:
+            lexing_error(f'Unexpected character: {ch}', self.line)
@@ -1,11 +1,8 @@
 import sys
-import subprocess
 import os
-import platform
-from utils import compile_error
-from parser import Parser
+from utils import CompileError, NvError, compile_error, report_error
 from tokens import *
-from lexer import Lexer
+from cache import load_ast
 from model import *
 from llvmlite import ir
 
@@ -26,6 +23,7 @@ class LLVMModule:
     def __init__(self):
         self.module = ir.Module(name="nv_module")
         
+        import platform
         system = platform.system()
         machine = platform.machine()
         
@@ -94,7 +92,7 @@ class LLVMModule:
         elif type_tag == TYPE_STRING:
             alloca = self.builder.alloca(i8_ptr, name=name)
         else:
-            raise ValueError(f"Unknown type: {type_tag}")
+            raise CompileError(f"[LLVM] Unknown type: {type_tag}")
         
         self.vars[name] = (type_tag, alloca)
         return alloca
@@ -118,7 +116,7 @@ class LLVMModule:
         return (type_tag, self.builder.load(alloca, name=name + ".val"))
 
 
-class LLVMGenerator:
+class LLVMGenerator(NodeVisitor):
     def __init__(self):
         self.module = None
         self.fmt_float = None
@@ -137,90 +135,61 @@ class LLVMGenerator:
         self.fmt_int_nl = self.module.create_string_constant("%d\n")
     
     def generate(self, node):
-        if node is None:
-            return None
-        
-        if isinstance(node, Integer):
-            return (TYPE_NUMBER, ir.Constant(f64, float(node.value)))
-        
-        if isinstance(node, Float):
-            return (TYPE_NUMBER, ir.Constant(f64, node.value))
-        
-        if isinstance(node, Bool):
-            return (TYPE_BOOL, ir.Constant(i1, 1 if node.value else 0))
-        
-        if isinstance(node, String):
-            ptr = self.module.create_string_constant(node.value)
-            return (TYPE_STRING, ptr)
-        
-        if isinstance(node, Grouping):
-            return self.generate(node.value)
-        
-        if isinstance(node, Identifier):
-            result = self.module.load_var(node.name)
-            if result is None:
-                compile_error(f"[LLVM] Undefined variable '{node.name}'", node.line)
-            return result
-        
-        if isinstance(node, Assignment):
-            right_type, right_val = self.generate(node.right)
-            self.module.store_var(node.left.name, right_type, right_val)
-            return (right_type, right_val)
-        
-        if isinstance(node, LocalStmt):
-            right_type, right_val = self.generate(node.expr)
-            self.module.store_var(node.ident, right_type, right_val)
-            return None
-        
-        if isinstance(node, BinOp):
-            return self._generate_binop(node)
-        
-        if isinstance(node, UnOp):
-            return self._generate_unop(node)
-        
-        if isinstance(node, LogicalOp):
-            return self._generate_logical(node)
-        
-        if isinstance(node, PrintStmt):
-            self._generate_print(node)
-            return None
-        
-        if isinstance(node, IfStmt):
-            self._generate_if(node)
-            return None
-        
-        if isinstance(node, WhileStmt):
-            self._generate_while(node)
-            return None
-        
-        if isinstance(node, ForStmt):
-            self._generate_for(node)
-            return None
-        
-        if isinstance(node, Stmts):
-            for stmt in node.stmts:
-                self.generate(stmt)
-            return None
-        
-        if isinstance(node, FuncDecl):
-            self._generate_func_decl(node)
-            return None
-        
-        if isinstance(node, FuncCall):
-            return self._generate_func_call(node)
-        
-        if isinstance(node, FuncCallStmt):
-            self.generate(node.expr)
-            return None
-        
-        if isinstance(node, RetStmt):
-            ret_type, ret_val = self.generate(node.expr)
-            self.module.builder.ret(ret_val)
-            return None
-        
+        return self.dispatch[type(node)](self, node)
+
+    def visit_NoneType(self, node):
+        return None
+
+    def generic_visit(self, node):
         compile_error(f"[LLVM] Unknown node type: {type(node).__name__}", getattr(node, 'line', 0))
+
+    def visit_Integer(self, node):
+        return (TYPE_NUMBER, ir.Constant(f64, float(node.value)))
+
+    def visit_Float(self, node):
+        return (TYPE_NUMBER, ir.Constant(f64, node.value))
+
+    def visit_Bool(self, node):
+        return (TYPE_BOOL, ir.Constant(i1, 1 if node.value else 0))
+
+    def visit_String(self, node):
+        ptr = self.module.create_string_constant(node.value)
+        return (TYPE_STRING, ptr)
+
+    def visit_Grouping(self, node):
+        return self.generate(node.value)
+
+    def visit_Identifier(self, node):
+        result = self.module.load_var(node.name)
+        if result is None:
+            compile_error(f"[LLVM] Undefined variable '{node.name}'", node.line)
+        return result
+
+    def visit_Assignment(self, node):
+        right_type, right_val = self.generate(node.right)
+        self.module.store_var(node.left.name, right_type, right_val)
+        return (right_type, right_val)
+
+    def visit_LocalStmt(self, node):
+        right_type, right_val = self.generate(node.expr)
+        self.module.store_var(node.ident, right_type, right_val)
+        return None
+
+    def visit_Stmts(self, node):
+        for stmt in node.stmts:
+            self.generate(stmt)
+        return None
+
+    def visit_FuncCallStmt(self, node):
+        self.generate(node.expr)
+        return None
+
+    def visit_RetStmt(self, node):
+        ret_type, ret_val = self.generate(node.expr)
+        self.module.builder.ret(ret_val)
+        return None
     
-    def _generate_binop(self, node):
+    def visit_BinOp(self, node):
         left_type, left_val = self.generate(node.left)
         right_type, right_val = self.generate(node.right)
         builder = self.module.builder
@@ -267,7 +236,7 @@ class LLVMGenerator:
         
         compile_error(f"[LLVM] Unsupported operator '{node.op.lexeme}' for types {left_type}, {right_type}", node.line)
     
-    def _generate_unop(self, node):
+    def visit_UnOp(self, node):
         operand_type, operand_val = self.generate(node.operand)
         builder = self.module.builder
         op = node.op.token_type
@@ -285,7 +254,7 @@ class LLVMGenerator:
         
         compile_error(f"[LLVM] Unsupported unary operator '{node.op.lexeme}'", node.line)
     
-    def _generate_logical(self, node):
+    def visit_LogicalOp(self, node):
         builder = self.module.builder
         op = node.op.token_type
         
@@ -332,7 +301,7 @@ class LLVMGenerator:
         
         compile_error(f"[LLVM] Unknown logical operator", node.line)
     
-    def _generate_print(self, node):
+    def visit_PrintStmt(self, node):
         val_type, val = self.generate(node.value)
         builder = self.module.builder
         
@@ -349,7 +318,7 @@ class LLVMGenerator:
             fmt = self.fmt_str_nl if node.end == '\n' else self.fmt_str
             builder.call(self.module.printf, [fmt, str_val])
     
-    def _generate_if(self, node):
+    def visit_IfStmt(self, node):
         builder = self.module.builder
         
         cond_type, cond_val = self.generate(node.test)
@@ -376,7 +345,7 @@ class LLVMGenerator:
         
         builder.position_at_end(merge_block)
     
-    def _generate_while(self, node):
+    def visit_WhileStmt(self, node):
         builder = self.module.builder
         
         cond_block = builder.append_basic_block(name="while.cond")
@@ -396,7 +365,7 @@ class LLVMGenerator:
         
         builder.position_at_end(exit_block)
     
-    def _generate_for(self, node):
+    def visit_ForStmt(self, node):
         builder = self.module.builder
         var_name = node.ident.name
         
@@ -433,7 +402,7 @@ class LLVMGenerator:
         
         builder.position_at_end(exit_block)
     
-    def _generate_func_decl(self, node):
+    def visit_FuncDecl(self, node):
         func = self.module.functions.get(node.name)
         if func is None:
             param_types = [f64] * len(node.params)
@@ -463,7 +432,7 @@ class LLVMGenerator:
         self.module.current_function = old_func
         self.module.vars = old_vars
     
-    def _generate_func_call(self, node):
+    def visit_FuncCall(self, node):
         if node.name not in self.module.functions:
             compile_error(f"[LLVM] Undefined function '{node.name}'", node.line)
         
@@ -501,6 +470,7 @@ class LLVMGenerator:
 
 
 def compile_to_executable(ll_file, output_file):
+    import subprocess
     helper_c = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'helper.c')
     
     cmd = ['clang', ll_file, '-o', output_file, '-lm']
@@ -518,6 +488,68 @@ def compile_to_executable(ll_file, output_file):
     return True
 
 
+def target_machine(**options):
+    from llvmlite import binding
+    binding.initialize_native_target()
+    binding.initialize_native_asmprinter()
+    return binding.Target.from_default_triple().create_target_machine(**options)
+
+
+def parse_module(module):
+    from llvmlite import binding
+    llmod = binding.parse_assembly(str(module.module))
+    llmod.verify()
+    return llmod
+
+
+def flush_output():
+    # Python and the generated code write to the same fd through different
+    # buffers; flush both so the output keeps its order.
+    import ctypes
+    sys.stdout.flush()
+    ctypes.CDLL(None).fflush(None)
+
+
+def run_jit(module):
+    """Compile module in memory with MCJIT and run its main(); returns its exit code."""
+    import ctypes
+    from llvmlite import binding
+    engine = binding.create_mcjit_compiler(parse_module(module), target_machine())
+    engine.finalize_object()
+    main = ctypes.CFUNCTYPE(ctypes.c_int)(engine.get_function_address('main'))
+    flush_output()
+    try:
+        return main()
+    finally:
+        flush_output()
+
+
+def emit_object(module, obj_file):
+    with open(obj_file, 'wb') as f:
+        f.write(target_machine(reloc='pic').emit_object(parse_module(module)))
+
+
+def link_executable(obj_file, output_file):
+    import subprocess
+    cmd = [os.environ.get('CC', 'cc'), obj_file, '-o', output_file, '-lm']
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise CompileError(f"Linking failed:\n{result.stderr}")
+
+
+def run_aot(module):
+    """Compile module to a native executable in a temporary directory and run it."""
+    import subprocess
+    import tempfile
+    with tempfile.TemporaryDirectory(prefix='nv-aot-') as directory:
+        obj_file = os.path.join(directory, 'program.o')
+        exe_file = os.path.join(directory, 'program')
+        emit_object(module, obj_file)
+        link_executable(obj_file, exe_file)
+        sys.stdout.flush()
+        return subprocess.run([exe_file]).returncode
+
+
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         print('Usage: python llvm.py <filename.nv> [--compile]')
@@ -526,14 +558,13 @@ if __name__ == '__main__':
     filename = sys.argv[1]
     do_compile = '--compile' in sys.argv
     
-    with open(filename, encoding='utf-8') as file:
-        source = file.read()
-    
-    tokens = Lexer(source).tokenize()
-    ast = Parser(tokens).parse()
-    
-    generator = LLVMGenerator()
-    module = generator.generate_module(ast)
+    try:
+        ast = load_ast(filename)
+        generator = LLVMGenerator()
+        module = generator.generate_module(ast)
+    except NvError as error:
+        report_error(error)
+        sys.exit(1)
     
     ll_filename = os.path.splitext(filename)[0] + '.ll'
     with open(ll_filename, 'w') as f:
@@ -546,4 +577,5 @@ if __name__ == '__main__':
         exe_filename = os.path.splitext(filename)[0] + '.exe'
         if compile_to_executable(ll_filename, exe_filename):
             print(f"\n*** Running {exe_filename} ***\n")
+            import subprocess
             subprocess.run([exe_filename])
\ No newline at end of file
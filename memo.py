@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+# Memoization of pure functions (see effects.py), shared by Interpreter and VM.
+#
+# Every memoized function gets its own bounded LRU cache from arguments to
+# result. Only calls that return are cached; a call that fails raises again
+# the next time it is made.
+
+DEFAULT_SIZE = 1024
+
+
+def memo_key(args):
+    """The cache key of a list of argument values. 1.0 == True in Python, so the types are part of it."""
+    return (*args, *map(type, args))
+
+
+class MemoCache:
+    """LRU cache of one function's results, with hit and miss counters."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+class Memoizer:
+    """The caches of one run, each holding at most size results."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.caches = {}
+
+    def cache(self, func, name):
+        """The cache of func (a FuncDecl or a function name)."""
+        cache = self.caches.get(func)
+        if cache is None:
+            cache = self.caches[func] = MemoCache(name, self.size)
+        return cache
+
+    def report(self):
+        for cache in self.caches.values():
+            print(f'{cache.name}: {cache.hits} hits, {cache.misses} misses, '
+                  f'{len(cache.entries)}/{cache.size} entries')
@@ -1,80 +1,114 @@
-from pyparsing import rest_of_line
+import os
 
 from tokens import *
 
+# Constructors do no checking; with NV_DEBUG=1 every tree coming out of the
+# front end goes through verify() instead.
+DEBUG = os.environ.get('NV_DEBUG', '') not in ('', '0')
+
 
 class Node:
-    pass
+    __slots__ = ()
+    # Slots filled in by resolver.py; None until the tree is resolved.
+    resolved = ()
+
+    def check(self):
+        pass
 
 
 class Stmt(Node):
-    pass
+    __slots__ = ()
 
 
 class Expr(Node):
     """
     Example: x + ( 3 * y ) >= 6
     """
-    pass
+    __slots__ = ()
 
 class Decl(Stmt):
-    pass
+    __slots__ = ()
 
 class Identifier(Expr):
+    __slots__ = ('name', 'line', 'scope')
+    resolved = ('scope',)
+
     def __init__(self, name, line):
         self.name = name
         self.line = line
+        self.scope = None
 
     def __repr__(self):
         return f'Identifier[{self.name}]'
 
 
 class Integer(Expr):
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, int), value
         self.value = value
         self.line = line
 
+    def check(self):
+        assert isinstance(self.value, int), self.value
+
     def __repr__(self):
         return f'Integer[{self.value}]'
 
 
 class Float(Expr):
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, float), value
         self.value = value
         self.line = line
 
+    def check(self):
+        assert isinstance(self.value, float), self.value
+
     def __repr__(self):
         return f'Float[{self.value}]'
 
 
 class Bool(Expr):
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, bool), value
         self.value = value
         self.line = line
 
+    def check(self):
+        assert isinstance(self.value, bool), self.value
+
     def __repr__(self):
         return f'Bool[{self.value}]'
 
 
 class String(Expr):
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, str), value
         self.value = value
         self.line = line
 
+    def check(self):
+        assert isinstance(self.value, str), self.value
+
     def __repr__(self):
-        return f'String[{self.value}]'
+        # Escaped again, as it was written in the source.
+        return f'String[{repr(self.value)[1:-1]}]'
 
 
 class Grouping(Expr):
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, Expr), value
         self.value = value
         self.line = line
 
+    def check(self):
+        assert isinstance(self.value, Expr), self.value
+
     def __repr__(self):
         return f'Grouping({self.value})'
 
@@ -83,29 +117,35 @@ class UnOp(Expr):
     """
     Example: -x
     """
+    __slots__ = ('line', 'op', 'operand')
 
     def __init__(self, op: Token, operand: Expr, line):
-        assert isinstance(op, Token), op
-        assert isinstance(operand, Expr), operand
         self.line = line
         self.op = op
         self.operand = operand
 
+    def check(self):
+        assert isinstance(self.op, Token), self.op
+        assert isinstance(self.operand, Expr), self.operand
+
     def __repr__(self):
         return f'BinOp({self.op.lexeme!r},{self.operand})'
 
 
 class LogicalOp(Expr):
+    __slots__ = ('op', 'left', 'right', 'line')
 
     def __init__(self, op: Token, left: Expr, right: Expr, line):
-        assert isinstance(op, Token), op
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.op = op
         self.left = left
         self.right = right
         self.line = line
 
+    def check(self):
+        assert isinstance(self.op, Token), self.op
+        assert isinstance(self.left, Expr), self.left
+        assert isinstance(self.right, Expr), self.right
+
     def __repr__(self):
         return f'LogicalOp({self.op.lexeme!r},{self.left},{self.right})'
 
@@ -114,147 +154,279 @@ class BinOp(Expr):
     """
     Example: x + y
     """
+    __slots__ = ('op', 'left', 'right', 'line')
 
     def __init__(self, op: Token, left: Expr, right: Expr, line):
-        assert isinstance(op, Token), op
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.op = op
         self.left = left
         self.right = right
         self.line = line
 
+    def check(self):
+        assert isinstance(self.op, Token), self.op
+        assert isinstance(self.left, Expr), self.left
+        assert isinstance(self.right, Expr), self.right
+
     def __repr__(self):
         return f'BinOp({self.op.lexeme!r},{self.left},{self.right})'
 
 
 class WhileStmt(Stmt):
+    __slots__ = ('test', 'body_stmts', 'line', 'size')
+    resolved = ('size',)
+
     def __init__(self,test,body_stmts,line):
-        assert isinstance(test,Expr),test
-        assert isinstance(body_stmts,Stmts),body_stmts
         self.test = test
         self.body_stmts = body_stmts
         self.line = line
+        self.size = None
+
+    def check(self):
+        assert isinstance(self.test,Expr),self.test
+        assert isinstance(self.body_stmts,Stmts),self.body_stmts
+
     def __repr__(self):
         return f'WhileStmt({self.test},{self.body_stmts})'
 
 
 
 class Assignment(Stmt):
+    __slots__ = ('left', 'right', 'line', 'scope')
+    resolved = ('scope',)
+
     def __init__(self, left, right, line):
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.left = left
         self.right = right
         self.line = line
+        self.scope = None
+
+    def check(self):
+        assert isinstance(self.left, Expr), self.left
+        assert isinstance(self.right, Expr), self.right
 
     def __repr__(self):
         return f'Assignment({self.left}, {self.right})'
 
 
 class Stmts(Node):
+    __slots__ = ('stmts', 'line')
+
     def __init__(self, stmts, line):
-        assert all(isinstance(stmt, Stmt) for stmt in stmts), stmts
         self.stmts = stmts
         self.line = line
 
+    def check(self):
+        assert all(isinstance(stmt, Stmt) for stmt in self.stmts), self.stmts
+
     def __repr__(self):
         return f'Stmts({self.stmts})'
 
 
 
 class PrintStmt(Stmt):
+    __slots__ = ('value', 'line', 'end')
+
     def __init__(self, value, line,end):
-        assert isinstance(value, Expr), value
         self.value = value
         self.line = line
         self.end = end
 
+    def check(self):
+        assert isinstance(self.value, Expr), self.value
+
     def __repr__(self):
         return f'PrintStmt({self.value},end = {self.end!r})'
 
 class IfStmt(Stmt):
+    __slots__ = ('test', 'then_stmts', 'else_stmts', 'line', 'then_size', 'else_size')
+    resolved = ('then_size', 'else_size')
 
     def __init__(self, test, then_stmts, else_stmts, line):
-        assert isinstance(test, Expr), test
-        assert isinstance(then_stmts, Stmts), then_stmts
-        assert else_stmts is None or isinstance(else_stmts, Stmts), else_stmts
         self.test = test
         self.then_stmts = then_stmts
         self.else_stmts = else_stmts
         self.line = line
+        self.then_size = None
+        self.else_size = None
+
+    def check(self):
+        assert isinstance(self.test, Expr), self.test
+        assert isinstance(self.then_stmts, Stmts), self.then_stmts
+        assert self.else_stmts is None or isinstance(self.else_stmts, Stmts), self.else_stmts
 
     def __repr__(self):
         return f'IfStmt(test:{self.test},then_stmts:{self.then_stmts},else_stmts:{self.else_stmts})'
 
 
 class ForStmt(Stmt):
+    __slots__ = ('ident', 'start', 'end', 'step', 'body_stmts', 'line', 'size')
+    resolved = ('size',)
+
     def __init__(self, ident, start, end, step, body_stmts, line):
-        assert isinstance(ident, Identifier), ident
-        assert isinstance(start, Expr), start
-        assert isinstance(end, Expr), end
-        assert step is None or isinstance(step, Expr), step
-        assert isinstance(body_stmts, Stmts), body_stmts
         self.ident = ident
         self.start = start
         self.end = end
         self.step = step
         self.body_stmts = body_stmts
         self.line = line
+        self.size = None
+
+    def check(self):
+        assert isinstance(self.ident, Identifier), self.ident
+        assert isinstance(self.start, Expr), self.start
+        assert isinstance(self.end, Expr), self.end
+        assert self.step is None or isinstance(self.step, Expr), self.step
+        assert isinstance(self.body_stmts, Stmts), self.body_stmts
 
     def __repr__(self):
         return f'ForStmt({self.ident},{self.start},{self.end},{self.step},{self.body_stmts})'
 
 class FuncDecl(Decl):
+    __slots__ = ('name', 'params', 'body_stmts', 'line', 'slot', 'size', 'pure')
+    resolved = ('slot', 'size', 'pure')
+
     def __init__(self,name,params,body_stmts,line):
-        assert isinstance(name,str),name
-        assert all(isinstance(param,Params) for param in params) ,params
         self.name = name
         self.params = params
         self.body_stmts = body_stmts
         self.line = line
+        self.slot = None
+        self.size = None
+        self.pure = None
+
+    def check(self):
+        assert isinstance(self.name,str),self.name
+        assert all(isinstance(param,Params) for param in self.params) ,self.params
+
     def __repr__(self):
         return f'FuncDecl({self.name},{self.params},{self.body_stmts})'
 
 class Params(Decl):
+    __slots__ = ('name', 'line', 'slot')
+    resolved = ('slot',)
+
     def __init__(self,name,line):
-        assert isinstance(name,str),name
         self.name = name
         self.line = line
+        self.slot = None
+
+    def check(self):
+        assert isinstance(self.name,str),self.name
+
     def __repr__(self):
         return f'Params({self.name})'
 
 class FuncCall(Expr):
+    __slots__ = ('name', 'args', 'line', 'scope')
+    resolved = ('scope',)
+
     def __init__(self,name,args,line):
-        assert isinstance(name,str),name
-        assert all(isinstance(arg,Expr) for arg in args),args
         self.name = name
         self.args = args
         self.line = line
+        self.scope = None
+
+    def check(self):
+        assert isinstance(self.name,str),self.name
+        assert all(isinstance(arg,Expr) for arg in self.args),self.args
+
     def __repr__(self):
         return f'FuncCall({self.name},{self.args})'
 
 class FuncCallStmt(Stmt):
+    __slots__ = ('expr',)
+
     def __init__(self,expr):
-        assert isinstance(expr,Expr),expr
         self.expr = expr
+
+    def check(self):
+        assert isinstance(self.expr,Expr),self.expr
+
     def __repr__(self):
         return f'FuncCallStmt({self.expr})'
 
 class RetStmt(Stmt):
+    __slots__ = ('expr', 'line', 'tail')
+    resolved = ('tail',)
+
     def __init__(self,expr,line):
-        assert isinstance(expr,Expr),expr
         self.expr = expr
         self.line = line
+        self.tail = None
+
+    def check(self):
+        assert isinstance(self.expr,Expr),self.expr
+
     def __repr__(self):
         return f'RetStmt({self.expr})'
     
 class LocalStmt(Stmt):
+    __slots__ = ('ident', 'expr', 'line', 'slot')
+    resolved = ('slot',)
+
     def __init__(self,ident,expr,line):
-        assert isinstance(ident,str),ident
-        assert isinstance(expr,Expr),expr
         self.ident = ident
         self.expr = expr
         self.line = line
+        self.slot = None
+
+    def check(self):
+        assert isinstance(self.ident,str),self.ident
+        assert isinstance(self.expr,Expr),self.expr
+
     def __repr__(self):
-        return f'LocalStmt({self.ident},{self.expr})'
\ No newline at end of file
+        return f'LocalStmt({self.ident},{self.expr})'
+
+
+def verify(node):
+    """Run check() on every node below node; raises AssertionError on a malformed tree."""
+    if isinstance(node, list):
+        for item in node:
+            verify(item)
+    elif isinstance(node, Node):
+        node.check()
+        for name in node.__slots__:
+            verify(getattr(node, name))
+
+
+class DispatchTable(dict):
+    """
+    Node class -> visit method of one walker class. A class is resolved on
+    first use: visit_<ClassName> for the class or its nearest base that has
+    one (None resolves through visit_NoneType), else generic_visit.
+    """
+
+    def __init__(self, walker):
+        super().__init__()
+        self.walker = walker
+
+    def __missing__(self, node_class):
+        for cls in node_class.__mro__:
+            method = getattr(self.walker, 'visit_' + cls.__name__, None)
+            if method is not None:
+                break
+        else:
+            method = self.walker.generic_visit
+        self[node_class] = method
+        return method
+
+
+class NodeVisitor:
+    """
+    Base class of the tree walkers. Each subclass gets its own dispatch table,
+    so visiting a node is one dict lookup on its exact class:
+
+        def interpret(self, node, env):
+            return self.dispatch[type(node)](self, node, env)
+    """
+    dispatch = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = DispatchTable(cls)
+
+    def visit(self, node, *args):
+        return self.dispatch[type(node)](self, node, *args)
+
+    def generic_visit(self, node, *args):
+        return None
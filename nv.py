@@ -1,61 +1,219 @@
-from interpreter import *
-from lexer import *
-from parser import *
-from utils import *
-from vm import *
-from compiler import *
-from optimizer import *
+import argparse
+import sys
 
-if __name__ == "__main__":
-    optimize = False
-    args = sys.argv[1:]
-    
-    if '-O' in args:
-        optimize = True
-        args.remove('-O')
-    
-    if len(args) != 1:
-        raise SystemExit("Usage: python nv.py [-O] <filename>")
-    
-    filename = args[0]
-    print(filename)
-    with open(filename, encoding='utf-8') as f:
+from utils import Colors, NvError, report_error
+
+# Only what every run needs is imported here. The engines (and llvmlite /
+# graphviz behind them) are imported by the stage that uses them, so a run
+# only pays for the modules of the modes it asks for.
+
+BACKENDS = ('interp', 'closure', 'vm', 'regvm', 'llvm-jit', 'llvm-aot')
+DUMPS = ('tokens', 'ast', 'effects', 'bytecode', 'regcode', 'ir')
+MEMO_BACKENDS = ('interp', 'vm')
+DEFAULT_MEMO_SIZE = 1024
+OUTPUT_BACKENDS = ('interp', 'closure', 'vm', 'regvm')
+DEFAULT_OUTPUT_BUFFER = 1 << 16
+PROFILE_MODES = ('exact', 'sample')
+PROFILE_FORMATS = ('text', 'json', 'collapsed')
+DEFAULT_PROFILE_INTERVAL = 1.0
+
+
+def banner(title, newline=False):
+    lead = '\n' if newline else ''
+    print(f'{Colors.GREEN}{lead}***************************************{Colors.WHITE}')
+    print(f'{Colors.GREEN}{title}:{Colors.WHITE}')
+    print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
+
+
+def dump_list(text):
+    dumps = set()
+    for name in text.split(','):
+        name = name.strip()
+        if name == 'all':
+            dumps.update(DUMPS)
+        elif name in DUMPS:
+            dumps.add(name)
+        elif name:
+            raise argparse.ArgumentTypeError(f"unknown dump {name!r} (choose from {', '.join(DUMPS)}, all)")
+    return dumps
+
+
+def positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f'expected a positive integer, got {text!r}')
+    return value
+
+
+def positive_float(text):
+    try:
+        value = float(text)
+    except ValueError:
+        value = 0.0
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f'expected a positive number, got {text!r}')
+    return value
+
+
+def write_profile(profile, args):
+    with open(args.filename, encoding='utf-8') as f:
         source = f.read()
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        print(f'{Colors.GREEN}SOURCE:{Colors.WHITE}')
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        print(source)
-
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        print(f'{Colors.GREEN}TOKENS:{Colors.WHITE}')
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        tokens = Lexer(source).tokenize()
+    text = profile.format(args.profile_format, source)
+    if args.profile_output is None:
+        sys.stderr.write(text)
+    else:
+        with open(args.profile_output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def parse_args(argv):
+    ap = argparse.ArgumentParser(prog='nv.py', description='Run an nv program.')
+    ap.add_argument('filename')
+    ap.add_argument('--backend', choices=BACKENDS, default='interp',
+                    help='engine that executes the program (default: interp)')
+    ap.add_argument('--dump', type=dump_list, default=set(), metavar='LIST',
+                    help=f"comma separated stages to print: {','.join(DUMPS)} or all")
+    ap.add_argument('--ast-image', action='store_true', help='render the AST with graphviz')
+    ap.add_argument('-O', dest='optimize', action='store_true', help='fold constants in the AST; optimize the bytecode and use superinstructions')
+    ap.add_argument('--memoize', action='store_true',
+                    help=f'cache the results of pure functions ({" and ".join(MEMO_BACKENDS)} backends)')
+    ap.add_argument('--memo-size', type=positive_int, default=DEFAULT_MEMO_SIZE, metavar='N',
+                    help=f'results kept per memoized function (default {DEFAULT_MEMO_SIZE})')
+    ap.add_argument('--output-buffer', type=positive_int, default=DEFAULT_OUTPUT_BUFFER, metavar='BYTES',
+                    help=f'bytes of program output buffered before it is written ({", ".join(OUTPUT_BACKENDS)} '
+                         f'backends, default {DEFAULT_OUTPUT_BUFFER})')
+    ap.add_argument('--profile', choices=PROFILE_MODES,
+                    help='profile the program by source line and function (interp backend)')
+    ap.add_argument('--profile-format', choices=PROFILE_FORMATS, default='text',
+                    help='text report, JSON, or collapsed stacks for flamegraph tools (default: text)')
+    ap.add_argument('--profile-output', metavar='FILE', help='write the profile to FILE (default: stderr)')
+    ap.add_argument('--profile-interval', type=positive_float, default=DEFAULT_PROFILE_INTERVAL, metavar='MS',
+                    help=f'CPU time between two samples in sample mode (default {DEFAULT_PROFILE_INTERVAL}ms)')
+    args = ap.parse_args(argv)
+    if args.profile and args.backend != 'interp':
+        ap.error('--profile needs the interp backend')
+    if args.memoize and args.backend not in MEMO_BACKENDS:
+        ap.error(f'--memoize needs one of the backends {", ".join(MEMO_BACKENDS)}')
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    dumps = args.dump
+
+    if 'tokens' in dumps:
+        from lexer import Lexer
+        with open(args.filename, encoding='utf-8') as f:
+            tokens = Lexer(f).tokenize()
+        banner('TOKENS')
         for tok in tokens: print(tok)
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        print(f'{Colors.GREEN}AST:{Colors.WHITE}')
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        ast = Parser(tokens).parse()
-        
-        if optimize:
-            optimizer = ASTOptimizer()
-            ast = optimizer.optimize(ast)
-        
+
+    from cache import load_ast
+    ast = load_ast(args.filename, args.optimize)
+    if 'ast' in dumps:
+        from utils import print_tree
+        banner('AST')
         print_tree(ast)
+    if args.ast_image:
+        from utils import generate_ast_image
         generate_ast_image(ast, "ast")
-        
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        print(f'{Colors.GREEN}INTERPRETER:{Colors.WHITE}')
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        interpreter = Interpreter()
-        interpreter.interpret_ast(ast)
-        print(f'{Colors.GREEN}\n***************************************{Colors.WHITE}')
-        print(f'{Colors.GREEN}COMPILER:{Colors.WHITE}')
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        compiler = Compiler()
-        code = compiler.compile_code(ast)
-        print_code(code)
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        print(f'{Colors.GREEN}VM:{Colors.WHITE}')
-        print(f'{Colors.GREEN}***************************************{Colors.WHITE}')
-        vm = VM()
-        vm.run(code)
+    if 'effects' in dumps:
+        from effects import EffectAnalyzer
+        banner('EFFECTS')
+        for func, reason in EffectAnalyzer().analyze(ast).items():
+            print(f'{func.name}: {"pure" if reason is None else "not pure, " + reason}')
+
+    memo = None
+    if args.memoize:
+        from memo import Memoizer
+        memo = Memoizer(args.memo_size)
+
+    code = None
+    if args.backend == 'vm' or 'bytecode' in dumps:
+        from assembler import assemble
+        from compiler import Compiler
+        code = Compiler(memoize=memo is not None).compile_code(ast)
+        if args.optimize:
+            from peephole import Peephole
+            from superinstructions import Fuser
+            code = Fuser().fuse(Peephole().optimize(code))
+        code = assemble(code)
+        if 'bytecode' in dumps:
+            from utils import print_code
+            banner('BYTECODE')
+            print_code(code)
+
+    regcode = None
+    if args.backend == 'regvm' or 'regcode' in dumps:
+        from assembler import assemble
+        from regcompiler import RegCompiler
+        regcode = assemble(RegCompiler().compile_code(ast))
+        if 'regcode' in dumps:
+            from utils import print_regcode
+            banner('REGCODE')
+            print_regcode(regcode)
+
+    module = None
+    if args.backend.startswith('llvm'):
+        from llvm import LLVMGenerator
+        module = LLVMGenerator().generate_module(ast)
+    if 'ir' in dumps:
+        banner('LLVM IR')
+        ir_module = module
+        if ir_module is None:
+            # Only for the dump: a program LLVMGenerator rejects still runs
+            # on the backend that was asked for.
+            from llvm import LLVMGenerator
+            try:
+                ir_module = LLVMGenerator().generate_module(ast)
+            except NvError as error:
+                report_error(error)
+        if ir_module is not None:
+            print(str(ir_module.module))
+
+    if dumps:
+        banner(args.backend.upper())
+    output = None
+    if args.backend in OUTPUT_BACKENDS:
+        from output import Output
+        output = Output(args.output_buffer)
+    if args.backend == 'interp' and args.profile:
+        from profiler import Profile, profile_ast
+        profile = Profile(args.profile)
+        try:
+            profile_ast(ast, profile, args.profile_interval / 1000, memo, output)
+        finally:
+            write_profile(profile, args)
+    elif args.backend == 'interp':
+        from interpreter import Interpreter
+        Interpreter(memo, output).interpret_ast(ast)
+    elif args.backend == 'closure':
+        from closures import ClosureCompiler
+        ClosureCompiler(output).interpret_ast(ast)
+    elif args.backend == 'vm':
+        from vm import VM
+        VM(memo, output).run(code)
+    elif args.backend == 'regvm':
+        from regvm import RegVM
+        RegVM(output).run(regcode)
+    elif args.backend == 'llvm-jit':
+        from llvm import run_jit
+        return run_jit(module)
+    elif args.backend == 'llvm-aot':
+        from llvm import run_aot
+        return run_aot(module)
+    if memo is not None and 'effects' in dumps:
+        banner('MEMO', newline=True)
+        memo.report()
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except NvError as error:
+        report_error(error)
+        sys.exit(1)
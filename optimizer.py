@@ -1,98 +1,148 @@
+from flatast import NODE_KIND, NO_OP, FlatVisitor
 from model import *
 from tokens import *
 
-class ASTOptimizer:
-    def optimize(self, node):
-        if node is None:
+
+def fold_numbers(op, lval, rval):
+    """(literal class, value) of lval op rval for two number literals, or None if it is not folded."""
+    if op == TOK_PLUS:
+        result = lval + rval
+    elif op == TOK_MINUS:
+        result = lval - rval
+    elif op == TOK_STAR:
+        result = lval * rval
+    elif op == TOK_SLASH:
+        if rval == 0:
             return None
-        
-        if isinstance(node, Integer):
-            return node
-        
-        if isinstance(node, Float):
-            return node
-        
-        if isinstance(node, Bool):
-            return node
-        
-        if isinstance(node, String):
-            return node
-        
-        if isinstance(node, Identifier):
-            return node
-        
-        if isinstance(node, Grouping):
-            node.value = self.optimize(node.value)
-            if isinstance(node.value, (Integer, Float)):
-                return node.value
-            return node
-        
-        if isinstance(node, BinOp):
-            node.left = self.optimize(node.left)
-            node.right = self.optimize(node.right)
-            return self.fold_binop(node)
-        
-        if isinstance(node, UnOp):
-            node.operand = self.optimize(node.operand)
-            return self.fold_unop(node)
-        
-        if isinstance(node, LogicalOp):
-            node.left = self.optimize(node.left)
-            node.right = self.optimize(node.right)
-            return self.fold_logical(node)
-        
-        if isinstance(node, Assignment):
-            node.right = self.optimize(node.right)
-            return node
-        
-        if isinstance(node, PrintStmt):
-            node.value = self.optimize(node.value)
-            return node
-        
-        if isinstance(node, IfStmt):
-            node.test = self.optimize(node.test)
-            node.then_stmts = self.optimize(node.then_stmts)
-            if node.else_stmts:
-                node.else_stmts = self.optimize(node.else_stmts)
-            return node
-        
-        if isinstance(node, WhileStmt):
-            node.test = self.optimize(node.test)
-            node.body_stmts = self.optimize(node.body_stmts)
-            return node
-        
-        if isinstance(node, ForStmt):
-            node.start = self.optimize(node.start)
-            node.end = self.optimize(node.end)
-            if node.step:
-                node.step = self.optimize(node.step)
-            node.body_stmts = self.optimize(node.body_stmts)
-            return node
-        
-        if isinstance(node, FuncDecl):
-            node.body_stmts = self.optimize(node.body_stmts)
-            return node
-        
-        if isinstance(node, FuncCall):
-            node.args = [self.optimize(arg) for arg in node.args]
-            return node
-        
-        if isinstance(node, FuncCallStmt):
-            node.expr = self.optimize(node.expr)
-            return node
-        
-        if isinstance(node, RetStmt):
-            node.expr = self.optimize(node.expr)
-            return node
-        
-        if isinstance(node, LocalStmt):
-            node.expr = self.optimize(node.expr)
-            return node
-        
-        if isinstance(node, Stmts):
-            node.stmts = [self.optimize(stmt) for stmt in node.stmts]
-            return node
-        
+        result = lval / rval
+    elif op == TOK_CARET:
+        # 0 ^ -1 and a power too large for a float are left to fail at run time.
+        try:
+            result = lval ** rval
+        except (ZeroDivisionError, OverflowError):
+            return None
+    elif op == TOK_MOD:
+        if rval == 0:
+            return None
+        result = lval % rval
+    elif op == TOK_GT:
+        return Bool, lval > rval
+    elif op == TOK_GE:
+        return Bool, lval >= rval
+    elif op == TOK_LT:
+        return Bool, lval < rval
+    elif op == TOK_LE:
+        return Bool, lval <= rval
+    elif op == TOK_EQEQ:
+        return Bool, lval == rval
+    elif op == TOK_NE:
+        return Bool, lval != rval
+    else:
+        return None
+
+    if isinstance(result, float) and result.is_integer():
+        return Integer, int(result)
+    elif isinstance(result, float):
+        return Float, result
+    else:
+        return Integer, result
+
+
+class ASTOptimizer(NodeVisitor):
+    def optimize(self, node):
+        return self.dispatch[type(node)](self, node)
+
+    def visit_NoneType(self, node):
+        return None
+
+    def generic_visit(self, node):
+        return node
+
+    def visit_Integer(self, node):
+        return node
+
+    def visit_Float(self, node):
+        return node
+
+    def visit_Bool(self, node):
+        return node
+
+    def visit_String(self, node):
+        return node
+
+    def visit_Identifier(self, node):
+        return node
+
+    def visit_Grouping(self, node):
+        node.value = self.optimize(node.value)
+        if isinstance(node.value, (Integer, Float)):
+            return node.value
+        return node
+
+    def visit_BinOp(self, node):
+        node.left = self.optimize(node.left)
+        node.right = self.optimize(node.right)
+        return self.fold_binop(node)
+
+    def visit_UnOp(self, node):
+        node.operand = self.optimize(node.operand)
+        return self.fold_unop(node)
+
+    def visit_LogicalOp(self, node):
+        node.left = self.optimize(node.left)
+        node.right = self.optimize(node.right)
+        return self.fold_logical(node)
+
+    def visit_Assignment(self, node):
+        node.right = self.optimize(node.right)
+        return node
+
+    def visit_PrintStmt(self, node):
+        node.value = self.optimize(node.value)
+        return node
+
+    def visit_IfStmt(self, node):
+        node.test = self.optimize(node.test)
+        node.then_stmts = self.optimize(node.then_stmts)
+        if node.else_stmts:
+            node.else_stmts = self.optimize(node.else_stmts)
+        return node
+
+    def visit_WhileStmt(self, node):
+        node.test = self.optimize(node.test)
+        node.body_stmts = self.optimize(node.body_stmts)
+        return node
+
+    def visit_ForStmt(self, node):
+        node.start = self.optimize(node.start)
+        node.end = self.optimize(node.end)
+        if node.step:
+            node.step = self.optimize(node.step)
+        node.body_stmts = self.optimize(node.body_stmts)
+        return node
+
+    def visit_FuncDecl(self, node):
+        node.body_stmts = self.optimize(node.body_stmts)
+        return node
+
+    def visit_FuncCall(self, node):
+        node.args = [self.optimize(arg) for arg in node.args]
+        return node
+
+    def visit_FuncCallStmt(self, node):
+        node.expr = self.optimize(node.expr)
+        return node
+
+    def visit_RetStmt(self, node):
+        node.expr = self.optimize(node.expr)
+        return node
+
+    def visit_LocalStmt(self, node):
+        node.expr = self.optimize(node.expr)
+        return node
+
+    def visit_Stmts(self, node):
+        node.stmts = [self.optimize(stmt) for stmt in node.stmts]
         return node
     
     def fold_binop(self, node):
@@ -102,49 +152,11 @@ class ASTOptimizer:
         if not isinstance(left, (Integer, Float)) or not isinstance(right, (Integer, Float)):
             return node
         
-        lval = left.value
-        rval = right.value
-        line = node.line
-        
-        op = node.op.token_type
-        
-        if op == TOK_PLUS:
-            result = lval + rval
-        elif op == TOK_MINUS:
-            result = lval - rval
-        elif op == TOK_STAR:
-            result = lval * rval
-        elif op == TOK_SLASH:
-            if rval == 0:
-                return node
-            result = lval / rval
-        elif op == TOK_CARET:
-            result = lval ** rval
-        elif op == TOK_MOD:
-            if rval == 0:
-                return node
-            result = lval % rval
-        elif op == TOK_GT:
-            return Bool(lval > rval, line)
-        elif op == TOK_GE:
-            return Bool(lval >= rval, line)
-        elif op == TOK_LT:
-            return Bool(lval < rval, line)
-        elif op == TOK_LE:
-            return Bool(lval <= rval, line)
-        elif op == TOK_EQEQ:
-            return Bool(lval == rval, line)
-        elif op == TOK_NE:
-            return Bool(lval != rval, line)
-        else:
+        folded = fold_numbers(node.op.token_type, left.value, right.value)
+        if folded is None:
             return node
-        
-        if isinstance(result, float) and result.is_integer():
-            return Integer(int(result), line)
-        elif isinstance(result, float):
-            return Float(result, line)
-        else:
-            return Integer(result, line)
+        cls, value = folded
+        return cls(value, node.line)
     
     def fold_unop(self, node):
         operand = node.operand
@@ -185,3 +197,90 @@ class ASTOptimizer:
             return Bool(left.value or right.value, line)
         
         return node
+
+
+INTEGER = NODE_KIND['Integer']
+FLOAT = NODE_KIND['Float']
+BOOL = NODE_KIND['Bool']
+NUMBERS = (INTEGER, FLOAT)
+FOLDABLE = frozenset(NODE_KIND[name] for name in ('Grouping', 'BinOp', 'UnOp', 'LogicalOp'))
+
+
+class FlatOptimizer(FlatVisitor):
+    """
+    ASTOptimizer over a FlatAST, by node index. Like ASTOptimizer, it
+    rewrites the tree it is given.
+
+    Children come after their parent in preorder, so a scan from the last
+    node to the first folds every operand before its operator; only the
+    kinds that can fold are visited. A folded node becomes a literal leaf in
+    place, and the nodes of its old subtree stay in the arrays, unreachable:
+    walk(), children() and to_tree() no longer see them.
+    """
+
+    def optimize(self):
+        flat = self.flat
+        kinds, handlers = flat.kinds, self.handlers
+        for i in range(len(kinds) - 1, -1, -1):
+            kind = kinds[i]
+            if kind in FOLDABLE:
+                handlers[kind](i)
+        return flat
+
+    def replace(self, i, kind, value, line):
+        """Make node i a literal leaf."""
+        flat = self.flat
+        flat.kinds[i] = kind
+        flat.first[i] = -1
+        flat.ops[i] = NO_OP
+        flat.values[i] = value
+        flat.lines[i] = line
+
+    def replace_by_child(self, i, child):
+        flat = self.flat
+        self.replace(i, flat.kinds[child], flat.values[child], flat.lines[child])
+
+    def fold(self, i, cls, value):
+        flat = self.flat
+        self.replace(i, NODE_KIND[cls.__name__], flat.intern(value), flat.lines[i])
+
+    def value(self, i):
+        flat = self.flat
+        return flat.literals[flat.values[i]]
+
+    def visit_Grouping(self, i):
+        value = self.flat.first[i]
+        if self.flat.kinds[value] in NUMBERS:
+            self.replace_by_child(i, value)
+
+    def visit_BinOp(self, i):
+        flat = self.flat
+        left = flat.first[i]
+        right = flat.next[left]
+        if flat.kinds[left] in NUMBERS and flat.kinds[right] in NUMBERS:
+            folded = fold_numbers(TOKEN_KINDS[flat.ops[i]], self.value(left), self.value(right))
+            if folded is not None:
+                self.fold(i, *folded)
+
+    def visit_UnOp(self, i):
+        flat = self.flat
+        operand = flat.first[i]
+        kind = flat.kinds[operand]
+        op = TOKEN_KINDS[flat.ops[i]]
+        if op == TOK_MINUS and kind in NUMBERS:
+            self.fold(i, Integer if kind == INTEGER else Float, -self.value(operand))
+        elif op == TOK_PLUS and kind in (INTEGER, FLOAT, BOOL):
+            self.replace_by_child(i, operand)
+        elif op == TOK_NOT and kind == BOOL:
+            self.fold(i, Bool, not self.value(operand))
+
+    def visit_LogicalOp(self, i):
+        flat = self.flat
+        left = flat.first[i]
+        right = flat.next[left]
+        if flat.kinds[left] == BOOL and flat.kinds[right] == BOOL:
+            op = TOKEN_KINDS[flat.ops[i]]
+            if op == TOK_AND:
+                self.fold(i, Bool, self.value(left) and self.value(right))
+            elif op == TOK_OR:
+                self.fold(i, Bool, self.value(left) or self.value(right))
@@ -0,0 +1,36 @@
+import io
+import sys
+
+# Output of a running program, shared by the Interpreter, ClosureCompiler and
+# VM backends.
+#
+# print() goes through sys.stdout for every statement (and flushes on each
+# newline on a terminal). Output writes to the same file descriptor through
+# its own buffer of `size` bytes, which only goes out when it is full or on
+# flush(); the backends flush when a program ends, also when it fails, so
+# that their output comes before the error message. A stream without a file
+# descriptor (an io.StringIO in place of sys.stdout) is written directly.
+
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+
+class Output:
+    def __init__(self, size=DEFAULT_BUFFER_SIZE, stream=None):
+        if stream is None:
+            stream = sys.stdout
+        self.stream = stream
+        self.size = size
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.file = stream
+        else:
+            stream.flush()
+            raw = io.FileIO(fd, 'w', closefd=False)
+            self.file = io.TextIOWrapper(io.BufferedWriter(raw, size), encoding=stream.encoding,
+                                         errors=stream.errors)
+        # Bound once: this is what the print statements call.
+        self.write = self.file.write
+
+    def flush(self):
+        self.file.flush()
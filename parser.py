@@ -1,28 +1,71 @@
+import codecs
+
 from model import *
 from tokens import *
 from utils import *
 
+# Binding power of each binary operator, loosest first. ^ is right
+# associative and takes a primary (not a unary) as its right operand, as
+# prefix operators only bind while the minimum precedence is <= PREC_UNARY.
+PREC_OR = 1
+PREC_AND = 2
+PREC_EQUALITY = 3
+PREC_COMPARISON = 4
+PREC_TERM = 5
+PREC_FACTOR = 6
+PREC_MODULO = 7
+PREC_UNARY = 8
+PREC_EXPONENT = 9
+
+BINARY_PREC = {
+    TOK_OR: PREC_OR,
+    TOK_AND: PREC_AND,
+    TOK_EQEQ: PREC_EQUALITY,
+    TOK_NE: PREC_EQUALITY,
+    TOK_GT: PREC_COMPARISON,
+    TOK_GE: PREC_COMPARISON,
+    TOK_LT: PREC_COMPARISON,
+    TOK_LE: PREC_COMPARISON,
+    TOK_PLUS: PREC_TERM,
+    TOK_MINUS: PREC_TERM,
+    TOK_STAR: PREC_FACTOR,
+    TOK_SLASH: PREC_FACTOR,
+    TOK_MOD: PREC_MODULO,
+    TOK_CARET: PREC_EXPONENT,
+}
+
+UNARY_OPS = (TOK_NOT, TOK_MINUS, TOK_PLUS)
+
 
 class Parser:
+    # Tokens are pulled from any iterable (a list, or Lexer.iter_tokens())
+    # as they are needed; only the current and the previous token are kept.
     def __init__(self, tokens):
-        self.tokens = tokens
+        self.tokens = iter(tokens)
         self.curr = 0
+        self.prev = None
+        self.ahead = next(self.tokens, None)
 
     def advance(self):
-        token = self.tokens[self.curr]
+        token = self.ahead
+        self.prev = token
+        self.ahead = next(self.tokens, None)
         self.curr = self.curr + 1
         return token
 
     def peek(self):
-        return self.tokens[self.curr]
+        return self.ahead
+
+    def at_end(self):
+        return self.ahead is None
 
     def is_next(self, expected_type):
-        if self.curr >= len(self.tokens):
+        if self.ahead is None:
             return False
-        return self.peek().token_type == expected_type
+        return self.ahead.token_type == expected_type
 
     def expect(self, expected_type):
-        if self.curr >= len(self.tokens):
+        if self.ahead is None:
             parse_error('Unexpected end of input', self.previous_token().line)
         elif self.peek().token_type == expected_type:
             token = self.advance()
@@ -31,109 +74,76 @@ class Parser:
             parse_error(f'Expected {expected_type!r}, found {self.peek().lexeme!r}', self.peek().line)
 
     def previous_token(self):
-        return self.tokens[self.curr - 1]
+        return self.prev
+
+    def line(self):
+        """Line of the last token consumed; before the first, of the next one (1 in an empty file)."""
+        token = self.prev or self.ahead
+        return token.line if token is not None else 1
 
     def match(self, expected_type):
-        if self.curr >= len(self.tokens):
+        if self.ahead is None:
             return False
-        if self.peek().token_type != expected_type:
+        if self.ahead.token_type != expected_type:
             return False
-        self.curr = self.curr + 1
+        self.advance()
         return True
 
     def primary(self):
-        if self.match(TOK_TRUE): return Bool(True, line=self.previous_token().line)
-        if self.match(TOK_FALSE): return Bool(False, line=self.previous_token().line)
-        if self.match(TOK_STRING): return String(str(self.previous_token().lexeme[1:-1]),
-                                                 line=self.previous_token().line)
-        if self.match(TOK_INTEGER): return Integer(int(self.previous_token().lexeme), line=self.previous_token().line)
-        if self.match(TOK_FLOAT): return Float(float(self.previous_token().lexeme), line=self.previous_token().line)
-        if self.match(TOK_IDENTIFIER):
-            name_token = self.previous_token()
-            if self.match(TOK_LPAREN):
-                args = self.args()
-                self.expect(TOK_RPAREN)
-                return FuncCall(name_token.lexeme, args, name_token.line)
-            else:
-                return Identifier(name_token.lexeme, line=name_token.line)
+        token = self.ahead
+        if token is None:
+            return None
+        handler = PRIMARY_HANDLERS.get(token.token_type)
+        if handler is None:
+            return None
+        self.advance()
+        return handler(self, token)
+
+    def name_expr(self, name_token):
         if self.match(TOK_LPAREN):
-            expr = self.expr()
-            if (not self.match(TOK_RPAREN)):
-                parse_error('")" expected', self.previous_token().line)
-            else:
-                return Grouping(expr, line=self.previous_token().line)
-
-
-    def exponent(self):
-        expr = self.primary()
-        if self.match(TOK_CARET):
-            op = self.previous_token()
-            right = self.exponent()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    def unary(self):
-        if self.match(TOK_NOT) or self.match(TOK_MINUS) or self.match(TOK_PLUS):
-            op = self.previous_token()
-            operand = self.unary()
-            return UnOp(op, operand, line=op.line)
-        return self.exponent()
-
-    def modulo(self):
-        expr = self.unary()
-        while self.match(TOK_MOD):
-            op = self.previous_token()
-            right = self.unary()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    def multiplication(self):
-        expr = self.modulo()
-        while self.match(TOK_STAR) or self.match(TOK_SLASH):
-            op = self.previous_token()
-            right = self.modulo()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    def addition(self):
-        expr = self.multiplication()
-        while self.match(TOK_PLUS) or self.match(TOK_MINUS):
-            op = self.previous_token()
-            right = self.multiplication()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    def comparison(self):
-        expr = self.addition()
-        while self.match(TOK_GT) or self.match(TOK_GE) or self.match(TOK_LT) or self.match(TOK_LE):
-            op = self.previous_token()
-            right = self.addition()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    def equality(self):
-        expr = self.comparison()
-        while self.match(TOK_EQEQ) or self.match(TOK_NE):
-            op = self.previous_token()
-            right = self.comparison()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    def logical_and(self):
-        expr = self.equality()
-        while self.match(TOK_AND):
-            op = self.previous_token()
-            right = self.equality()
-            expr = LogicalOp(op, expr, right, line=op.line)
-        return expr
+            args = self.args()
+            self.expect(TOK_RPAREN)
+            return FuncCall(name_token.lexeme, args, name_token.line)
+        else:
+            return Identifier(name_token.lexeme, line=name_token.line)
 
-    def logical_or(self):
-        expr = self.logical_and()
-        while self.match(TOK_OR):
-            op = self.previous_token()
-            right = self.logical_and()
-            expr = LogicalOp(op, expr, right, line=op.line)
-        return expr
+    def grouping(self, lparen):
+        expr = self.expr()
+        if (not self.match(TOK_RPAREN)):
+            parse_error('")" expected', self.previous_token().line)
+        else:
+            return Grouping(expr, line=self.previous_token().line)
+
+    def expr(self, min_prec=PREC_OR):
+        """
+        Precedence climbing: parse a prefix operand, then fold in every binary
+        operator that binds at least as tight as min_prec.
+        """
+        token = self.ahead
+        if token is not None and token.token_type in UNARY_OPS and min_prec <= PREC_UNARY:
+            self.advance()
+            operand = self.expr(PREC_UNARY)
+            left = UnOp(token, operand, line=token.line)
+        else:
+            left = self.primary()
+            if left is None:
+                # The node constructors used to assert this; they no longer check.
+                if token is None:
+                    parse_error('Unexpected end of input', self.previous_token().line)
+                parse_error(f'Expected expression, found {token.lexeme!r}', token.line)
+        while True:
+            op = self.ahead
+            if op is None:
+                return left
+            prec = BINARY_PREC.get(op.token_type)
+            if prec is None or prec < min_prec:
+                return left
+            self.advance()
+            right = self.expr(prec if op.token_type == TOK_CARET else prec + 1)
+            if prec <= PREC_AND:
+                left = LogicalOp(op, left, right, line=op.line)
+            else:
+                left = BinOp(op, left, right, line=op.line)
 
     def assignment(self):
         left = self.expr()
@@ -146,9 +156,6 @@ class Parser:
                 parse_error(f"Invalid assignment target {left}", op.line)
         return left
 
-    def expr(self):
-        return self.logical_or()
-
     def if_stmt(self):
         self.expect(TOK_IF)
         test = self.expr()
@@ -165,7 +172,8 @@ class Parser:
 
     def for_stmt(self):
         self.expect(TOK_FOR)
-        identifier = self.primary()
+        name = self.expect(TOK_IDENTIFIER)
+        identifier = Identifier(name.lexeme, line=name.line)
         self.expect(TOK_ASSIGN)
         start = self.expr()
         self.expect(TOK_COMMA)
@@ -239,22 +247,9 @@ class Parser:
         return LocalStmt(name.lexeme,val,self.previous_token().line)
 
     def stmt(self):
-        if self.peek().token_type == TOK_PRINT:
-            return self.print_stmt(end = '')
-        if self.peek().token_type == TOK_PRINTLN:
-            return self.print_stmt(end = '\n')
-        if self.peek().token_type == TOK_IF:
-            return self.if_stmt()
-        if self.peek().token_type == TOK_WHILE:
-            return self.while_stmt()
-        if self.peek().token_type == TOK_FOR:
-            return self.for_stmt()
-        if self.peek().token_type == TOK_FUNC:
-            return self.func_decl()
-        if self.peek().token_type == TOK_RET:
-            return self.ret_stmt()
-        if self.peek().token_type == TOK_LOCAL:
-            return self.local_stmt()
+        handler = STMT_HANDLERS.get(self.ahead.token_type)
+        if handler is not None:
+            return handler(self)
         expr = self.expr()
         if self.match(TOK_ASSIGN):
             op = self.previous_token()
@@ -267,17 +262,65 @@ class Parser:
 
     def stmts(self):
         stmts = []
-        while self.curr < len(self.tokens):
+        while not self.at_end():
             if self.peek().token_type in (TOK_ELSE, TOK_END):
                 break
             stmt = self.stmt()
             stmts.append(stmt)
-        return Stmts(stmts, self.previous_token().line)
+        return Stmts(stmts, self.line())
 
     def program(self):
         stmts = self.stmts()
+        # stmts() stops at an `else` or `end` with no statement to close; this
+        # also makes sure the token stream (and so the lexer) ran to the end.
+        if not self.at_end():
+            token = self.peek()
+            parse_error(f'Unexpected {token.lexeme!r}', token.line)
         return stmts
 
     def parse(self):
         ast = self.program()
+        if DEBUG:
+            verify(ast)
         return ast
+
+
+def string_literal(parser, token):
+    # Escape sequences are decoded here, once, as Python decodes them in a
+    # bytes literal; the engines (LLVM included) print string values as they
+    # are. A backslash at the very end escapes nothing and is kept, as "\"
+    # always parsed to a backslash.
+    text = token.lexeme[1:-1]
+    if '\\' in text:
+        trailing = ''
+        if (len(text) - len(text.rstrip('\\'))) % 2 == 1:
+            text, trailing = text[:-1], '\\'
+        try:
+            text = codecs.escape_decode(text.encode('utf-8'))[0].decode('utf-8') + trailing
+        except (ValueError, UnicodeDecodeError):
+            parse_error(f'Invalid escape sequence in string {token.lexeme}', token.line)
+    return String(text, line=token.line)
+
+
+# First token of a primary expression -> handler(parser, token) building it.
+PRIMARY_HANDLERS = {
+    TOK_TRUE: lambda parser, token: Bool(True, line=token.line),
+    TOK_FALSE: lambda parser, token: Bool(False, line=token.line),
+    TOK_STRING: string_literal,
+    TOK_INTEGER: lambda parser, token: Integer(int(token.lexeme), line=token.line),
+    TOK_FLOAT: lambda parser, token: Float(float(token.lexeme), line=token.line),
+    TOK_IDENTIFIER: Parser.name_expr,
+    TOK_LPAREN: Parser.grouping,
+}
+
+# Statement keyword -> Parser method parsing that statement.
+STMT_HANDLERS = {
+    TOK_PRINT: lambda parser: parser.print_stmt(end=''),
+    TOK_PRINTLN: lambda parser: parser.print_stmt(end='\n'),
+    TOK_IF: Parser.if_stmt,
+    TOK_WHILE: Parser.while_stmt,
+    TOK_FOR: Parser.for_stmt,
+    TOK_FUNC: Parser.func_decl,
+    TOK_RET: Parser.ret_stmt,
+    TOK_LOCAL: Parser.local_stmt,
+}
@@ -0,0 +1,172 @@
+# Peephole optimizer for the Compiler's instruction list (before assembly,
+# so jumps still name their labels). Run with -O.
+#
+# Each rule rewrites a short window of instructions; optimize() applies them
+# all until none fires and counts the hits of each rule, and the instructions
+# it removed (labels are not instructions: the assembler drops them). A rule
+# may never make the code larger: a pass of a rule that would is thrown away.
+#
+#     jump-threading     a jump to a label followed by `JMP M` jumps to M
+#     dead-jump          `JMP L` right before label L is dropped, `JMPZ L`
+#                        right before it becomes POP
+#     dead-code          instructions after JMP, RET, TAILCALL or HALT up
+#                        to the next label are never run
+#     unused-label       labels no jump or call names are dropped, which
+#                        lets the two rules above see further
+#     not                `PUSH True, XOR` becomes NOT
+#     store-load         `STORE_GLOBAL x, LOAD_GLOBAL x` becomes
+#                        `DUP, STORE_GLOBAL x`
+#     pop-run            a run of n > 1 POPs becomes `POPN n`
+#
+# jump-threading, store-load, unused-label and dead-jump on a JMPZ keep the
+# size: they save jumps or a global lookup at run time, or let the other
+# rules fire. The others remove instructions.
+# Only globals get the store-load rule: STORE_LOCAL grows the stack up to
+# its slot when the slot is past the top, so DUP before it is not the same.
+
+JUMPS = ('JMP', 'JMPZ')
+CALLS = ('CALL', 'CALL_PURE', 'TAILCALL')
+# Instructions after which the next one only runs if it is jumped to.
+NO_FALLTHROUGH = ('JMP', 'RET', 'TAILCALL', 'HALT')
+
+RULES = ('jump-threading', 'dead-jump', 'dead-code', 'unused-label', 'not', 'store-load', 'pop-run')
+
+
+def size(code):
+    """Number of instructions in code, not counting its labels."""
+    return sum(op[0] != 'LABEL' for op in code)
+
+
+class Peephole:
+    def __init__(self):
+        self.hits = {rule: 0 for rule in RULES}
+        # Instructions removed by each rule.
+        self.removed = {rule: 0 for rule in RULES}
+
+    def optimize(self, code):
+        """The optimized copy of an instruction list."""
+        code = list(code)
+        passes = (('jump-threading', self.thread_jumps), ('dead-jump', self.dead_jumps),
+                  ('dead-code', self.dead_code), ('unused-label', self.unused_labels),
+                  ('not', self.fuse_not), ('store-load', self.store_load))
+        changed = True
+        while changed:
+            changed = False
+            for rule, apply in passes:
+                code, hits = self.apply(rule, apply, code)
+                changed = changed or hits > 0
+        code, _ = self.apply('pop-run', self.pop_runs, code)
+        return code
+
+    def apply(self, rule, apply, code):
+        """Run one pass of a rule on code; the pass is dropped if it makes the code larger."""
+        result, hits = apply(list(code))
+        if hits == 0:
+            return code, 0
+        removed = size(code) - size(result)
+        if removed < 0:
+            return code, 0
+        self.hits[rule] += hits
+        self.removed[rule] += removed
+        return result, hits
+
+    def label_positions(self, code):
+        return {op[1]: i for i, op in enumerate(code) if op[0] == 'LABEL'}
+
+    def target(self, code, labels, name):
+        """Index of the first instruction run after jumping to label name."""
+        i = labels[name]
+        while i < len(code) and code[i][0] == 'LABEL':
+            i += 1
+        return i
+
+    def thread_jumps(self, code):
+        labels = self.label_positions(code)
+        hits = 0
+        for i, op in enumerate(code):
+            if op[0] not in JUMPS:
+                continue
+            name = op[1]
+            seen = {name}
+            while True:
+                j = self.target(code, labels, name)
+                if j == len(code) or code[j][0] != 'JMP' or code[j][1] in seen:
+                    break
+                name = code[j][1]
+                seen.add(name)
+            if name != op[1]:
+                code[i] = (op[0], name)
+                hits += 1
+        return code, hits
+
+    def dead_jumps(self, code):
+        result = []
+        hits = 0
+        for i, op in enumerate(code):
+            if op[0] in JUMPS:
+                j = i + 1
+                while j < len(code) and code[j][0] == 'LABEL' and code[j][1] != op[1]:
+                    j += 1
+                if j < len(code) and code[j] == ('LABEL', op[1]):
+                    hits += 1
+                    if op[0] == 'JMPZ':
+                        result.append(('POP',))
+                    continue
+            result.append(op)
+        return result, hits
+
+    def dead_code(self, code):
+        result = []
+        hits = 0
+        reachable = True
+        for op in code:
+            if op[0] == 'LABEL':
+                reachable = True
+            elif not reachable:
+                hits += 1
+                continue
+            result.append(op)
+            if op[0] in NO_FALLTHROUGH:
+                reachable = False
+        return result, hits
+
+    def unused_labels(self, code):
+        used = {op[1] for op in code if op[0] in JUMPS or op[0] in CALLS}
+        result = [op for op in code if op[0] != 'LABEL' or op[1] in used]
+        hits = len(code) - len(result)
+        return result, hits
+
+    def fuse_not(self, code):
+        result = []
+        hits = 0
+        for op in code:
+            if op == ('XOR',) and result and result[-1] == ('PUSH', True) and type(result[-1][1]) is bool:
+                result[-1] = ('NOT',)
+                hits += 1
+            else:
+                result.append(op)
+        return result, hits
+
+    def store_load(self, code):
+        result = []
+        hits = 0
+        for op in code:
+            if op[0] == 'LOAD_GLOBAL' and result and result[-1] == ('STORE_GLOBAL', op[1]):
+                result[-1] = ('DUP',)
+                result.append(('STORE_GLOBAL', op[1]))
+                hits += 1
+            else:
+                result.append(op)
+        return result, hits
+
+    def pop_runs(self, code):
+        result = []
+        hits = 0
+        for op in code:
+            if op == ('POP',) and result and result[-1][0] in ('POP', 'POPN'):
+                count = result[-1][1] if result[-1][0] == 'POPN' else 1
+                result[-1] = ('POPN', count + 1)
+                hits += 1
+            else:
+                result.append(op)
+        return result, hits
@@ -0,0 +1,230 @@
+import json
+import signal
+import time
+from collections import defaultdict
+
+from interpreter import Interpreter
+from model import *
+
+# Line profiler for Interpreter.
+#
+# Time is attributed to source lines (the line of the node being evaluated,
+# not counting the nodes below it that are on other lines) and to stacks of
+# nv function names, in one of two modes:
+#
+#     exact   ProfilingInterpreter reads the clock every time it enters and
+#             leaves a node, and counts the statements run on every line.
+#             Precise, but the program runs a few times slower.
+#     sample  A SIGPROF timer interrupts the plain Interpreter every interval
+#             seconds of CPU time (or every clock tick of the kernel, when
+#             that is longer); the handler finds the node being evaluated in
+#             the interrupted Python frames and charges the CPU time since
+#             the previous sample to its line. Counts are samples.
+#
+# A Profile can be written as a text report, as JSON, or as collapsed stacks
+# ("main;f;g 1234", in microseconds) for flamegraph tools.
+
+MODES = ('exact', 'sample')
+FORMATS = ('text', 'json', 'collapsed')
+DEFAULT_INTERVAL = 0.001
+
+# Name of the outermost frame in collapsed stacks.
+MAIN = 'main'
+
+# Block statements carry the line of their `end`; they are profiled on the
+# line that opens them. A call statement has no line of its own, its call
+# has.
+HEAD_LINES = {
+    IfStmt: lambda node: node.test.line,
+    WhileStmt: lambda node: node.test.line,
+    ForStmt: lambda node: node.ident.line,
+    FuncCallStmt: lambda node: node.expr.line,
+}
+
+
+def node_line(node):
+    head = HEAD_LINES.get(type(node))
+    return node.line if head is None else head(node)
+
+
+class Profile:
+    def __init__(self, mode):
+        self.mode = mode
+        # line -> [statements run (exact) or samples, ns]; line 0 is time
+        # outside any node's own line.
+        self.lines = defaultdict(lambda: [0, 0])
+        # (function names, outermost first) -> ns
+        self.stacks = defaultdict(int)
+        # function name -> calls (exact mode only)
+        self.calls = defaultdict(int)
+        self.elapsed = 0.0
+
+    def total(self):
+        return sum(ns for _, ns in self.lines.values())
+
+    def functions(self):
+        """{name: (calls, self ns, total ns)}; total counts a recursive function once per stack."""
+        result = {}
+        for stack, ns in self.stacks.items():
+            for name in set(stack):
+                calls, own, total = result.get(name, (self.calls.get(name, 0), 0, 0))
+                result[name] = (calls, own + ns if stack[-1] == name else own, total + ns)
+        return result
+
+    def report(self, source=None, limit=None):
+        """The text report, lines and functions sorted by time; source is the program text."""
+        total = self.total() or 1
+        source_lines = source.splitlines() if source is not None else []
+        count_name = 'count' if self.mode == 'exact' else 'samples'
+        out = [f'{self.mode} profile, {self.total() / 1e9:.3f}s profiled, {self.elapsed:.3f}s elapsed',
+               '',
+               f'{"line":>6} {count_name:>10} {"time":>10} {"%":>6}  source']
+        lines = sorted(self.lines.items(), key=lambda item: -item[1][1])
+        for line, (count, ns) in lines[:limit]:
+            text = source_lines[line - 1].strip() if 0 < line <= len(source_lines) else ''
+            label = line if line else '-'
+            out.append(f'{label:>6} {count:>10} {ns / 1e9:>9.4f}s {100 * ns / total:>5.1f}%  {text}')
+        functions = sorted(self.functions().items(), key=lambda item: -item[1][2])
+        if functions:
+            out += ['', f'{"function":<20} {"calls":>10} {"self":>10} {"total":>10}']
+            for name, (calls, own, cumulative) in functions[:limit]:
+                calls = calls if self.mode == 'exact' else '-'
+                out.append(f'{name:<20} {calls:>10} {own / 1e9:>9.4f}s {cumulative / 1e9:>9.4f}s')
+        return '\n'.join(out) + '\n'
+
+    def to_json(self):
+        return json.dumps({
+            'mode': self.mode,
+            'elapsed': self.elapsed,
+            'total': self.total() / 1e9,
+            'lines': [{'line': line, 'count': count, 'time': ns / 1e9}
+                      for line, (count, ns) in sorted(self.lines.items())],
+            'functions': [{'name': name, 'calls': calls if self.mode == 'exact' else None,
+                           'self': own / 1e9, 'total': total / 1e9}
+                          for name, (calls, own, total) in sorted(self.functions().items())],
+            'stacks': [{'stack': [MAIN, *stack], 'time': ns / 1e9} for stack, ns in sorted(self.stacks.items())],
+        }, indent=2) + '\n'
+
+    def collapsed(self):
+        """One 'main;f;g <microseconds>' line per stack."""
+        return ''.join(f'{";".join((MAIN, *stack))} {ns // 1000}\n'
+                       for stack, ns in sorted(self.stacks.items()) if ns >= 1000)
+
+    def format(self, kind, source=None):
+        if kind == 'json':
+            return self.to_json()
+        if kind == 'collapsed':
+            return self.collapsed()
+        return self.report(source)
+
+
+class ProfilingInterpreter(Interpreter):
+    """Interpreter charging the time between two node entries or exits to the line being run."""
+
+    def __init__(self, profile, memo=None, output=None):
+        super().__init__(memo, output)
+        self.profile = profile
+        self.lines = profile.lines
+        self.stacks = profile.stacks
+        # Body of each declared function -> its name.
+        self.bodies = {}
+        self.line = 0
+        self.stack = ()
+        self.last = time.perf_counter_ns()
+
+    def interpret(self, node, env):
+        now = time.perf_counter_ns()
+        elapsed = now - self.last
+        self.lines[self.line][1] += elapsed
+        self.stacks[self.stack] += elapsed
+        line, stack = self.line, self.stack
+        if type(node) is Stmts:
+            name = self.bodies.get(node)
+            if name is not None:
+                self.stack = stack + (name,)
+                self.profile.calls[name] += 1
+        else:
+            self.line = node_line(node)
+            if isinstance(node, Stmt):
+                self.lines[self.line][0] += 1
+        self.last = now
+        try:
+            return self.dispatch[type(node)](self, node, env)
+        finally:
+            now = time.perf_counter_ns()
+            elapsed = now - self.last
+            self.lines[self.line][1] += elapsed
+            self.stacks[self.stack] += elapsed
+            self.line, self.stack = line, stack
+            self.last = now
+
+    def visit_FuncDecl(self, node, env):
+        self.bodies[node.body_stmts] = node.name
+        return super().visit_FuncDecl(node, env)
+
+
+INTERPRET = Interpreter.interpret.__code__
+FUNC_CALL = Interpreter.visit_FuncCall.__code__
+
+
+class Sampler:
+    """Samples the line and function stack of a running Interpreter on a CPU-time timer."""
+
+    def __init__(self, profile, interval=DEFAULT_INTERVAL):
+        self.profile = profile
+        self.interval = interval
+        self.handler = None
+        self.last = 0
+
+    def start(self):
+        self.last = time.process_time_ns()
+        self.handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.handler)
+
+    def sample(self, signum, frame):
+        # Walk out from the interrupted frame. The innermost node with a line
+        # of its own is the one being evaluated; a body run by visit_FuncCall
+        # is the function named by its FuncDecl.
+        line = 0
+        names = []
+        node = None
+        while frame is not None:
+            code = frame.f_code
+            if code is INTERPRET:
+                node = frame.f_locals['node']
+                if line == 0 and type(node) is not Stmts:
+                    line = node_line(node)
+            elif code is FUNC_CALL:
+                func_decl = frame.f_locals.get('func_decl')
+                if func_decl is not None and node is func_decl.body_stmts:
+                    names.append(func_decl.name)
+            frame = frame.f_back
+        now = time.process_time_ns()
+        elapsed = now - self.last
+        self.last = now
+        profile = self.profile
+        stat = profile.lines[line]
+        stat[0] += 1
+        stat[1] += elapsed
+        profile.stacks[tuple(reversed(names))] += elapsed
+
+
+def profile_ast(node, profile, interval=DEFAULT_INTERVAL, memo=None, output=None):
+    """Run node with Interpreter, recording into profile (also when the program fails)."""
+    start = time.perf_counter()
+    try:
+        if profile.mode == 'exact':
+            ProfilingInterpreter(profile, memo, output).interpret_ast(node)
+        else:
+            sampler = Sampler(profile, interval)
+            sampler.start()
+            try:
+                Interpreter(memo, output).interpret_ast(node)
+            finally:
+                sampler.stop()
+    finally:
+        profile.elapsed = time.perf_counter() - start
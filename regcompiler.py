@@ -0,0 +1,335 @@
+from compiler import Compiler, Symbol, SYM_VAR
+from model import *
+from tokens import *
+from utils import *
+
+# Compiler for RegVM (regvm.py): the same programs as Compiler, with the same
+# symbols and errors, but the instructions name the registers they read and
+# write instead of working on a stack.
+#
+# Registers are the slots of a function's frame. The locals keep the slot
+# numbers Compiler gives them (parameters first); the temporaries of a
+# statement are allocated above them and freed at its end. Constants live at
+# the end of the frame and are addressed from there, with negative numbers:
+# k1 is register -1. A register operand is therefore a local, a temporary or
+# a constant, and `x := x + 1` is one instruction:
+#
+#     ('BINARY', 'ADD', 0, 0, -1)
+#
+# The instructions, in symbolic form (assembler.py resolves the labels):
+#
+#     ('ENTER', nregs, constants)          # Frame layout of the code after it
+#     ('MOVE', dst, src)
+#     ('LOAD_GLOBAL', dst, name)
+#     ('STORE_GLOBAL', name, src)
+#     ('BINARY', op, dst, a, b)            # op is one of ADD to NE
+#     ('NEG', dst, a), ('POS', dst, a)
+#     ('AND', dst, a, b), ('OR', dst, a, b), ('XOR', dst, a, b)
+#     ('JMP', label)
+#     ('JMPZ', label, a)                   # Jump if a is false
+#     ('CMP_JMPZ', label, cmp, a, b)       # Jump if a <cmp> b is false
+#     ('CALL', name, n, base, dst)         # Arguments in base .. base + n - 1
+#     ('TAILCALL', name, n, base)
+#     ('RET', src)
+#     ('PRINT', a), ('PRINTLN', a)
+#     ('HALT',)
+#
+# ENTER starts the program and every function; it is not executed, RegVM
+# reads the frame size and constants from it.
+
+BINARY_OPS = {
+    TOK_PLUS: 'ADD', TOK_MINUS: 'SUB', TOK_STAR: 'MUL', TOK_SLASH: 'DIV', TOK_CARET: 'EXP', TOK_MOD: 'MOD',
+    TOK_EQEQ: 'EQ', TOK_NE: 'NE', TOK_GT: 'GT', TOK_GE: 'GE', TOK_LT: 'LT', TOK_LE: 'LE',
+}
+COMPARISONS = ('EQ', 'NE', 'GT', 'GE', 'LT', 'LE')
+
+
+class RegCompiler(Compiler):
+    def __init__(self):
+        super().__init__()
+        # Frame of the code being compiled: constant -> register, the
+        # constants in register order, the next free temporary and the
+        # number of registers used so far.
+        self.constants = {}
+        self.constant_values = []
+        self.top = 0
+        self.nregs = 0
+
+    def compile(self, node, dst=None):
+        """
+        Compile node; an expression's value goes to register dst, or to any
+        register if dst is None. Returns the register.
+        """
+        return self.dispatch[type(node)](self, node, dst)
+
+    def end_block(self):
+        # The slots of the block's locals are simply reused.
+        self.scope_depth -= 1
+        while len(self.locals) > 0 and self.locals[-1].depth > self.scope_depth:
+            self.locals.pop()
+
+    def temp(self):
+        reg = self.top
+        self.top += 1
+        self.nregs = max(self.nregs, self.top)
+        return reg
+
+    def declare_local(self, symbol):
+        self.locals.append(symbol)
+        self.nregs = max(self.nregs, len(self.locals))
+
+    def constant(self, value, dst):
+        key = (type(value), value)
+        reg = self.constants.get(key)
+        if reg is None:
+            self.constant_values.append(value)
+            reg = self.constants[key] = -len(self.constant_values)
+        return self.move(dst, reg)
+
+    def move(self, dst, src):
+        if dst is None or dst == src:
+            return src
+        self.emit(('MOVE', dst, src))
+        return dst
+
+    def target(self, dst, saved):
+        """The register for the result of an instruction, after its operands' temporaries are freed."""
+        self.top = saved
+        return self.temp() if dst is None else dst
+
+    def begin_frame(self):
+        frame = (self.constants, self.constant_values, self.top, self.nregs, len(self.code))
+        self.constants = {}
+        self.constant_values = []
+        self.top = 0
+        self.nregs = len(self.locals)
+        self.emit(None)
+        return frame
+
+    def end_frame(self, frame):
+        constants, values, top, nregs, enter = frame
+        self.code[enter] = ('ENTER', self.nregs, tuple(self.constant_values))
+        self.constants, self.constant_values, self.top, self.nregs = constants, values, top, nregs
+
+    def visit_Integer(self, node, dst):
+        return self.constant(float(node.value), dst)
+
+    def visit_Float(self, node, dst):
+        return self.constant(float(node.value), dst)
+
+    def visit_Bool(self, node, dst):
+        return self.constant(True if node.value == 'true' or node.value == True else False, dst)
+
+    def visit_String(self, node, dst):
+        return self.constant(stringify(node.value), dst)
+
+    def visit_BinOp(self, node, dst):
+        saved = self.top
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        reg = self.target(dst, saved)
+        self.emit(('BINARY', BINARY_OPS[node.op.token_type], reg, left, right))
+        return reg
+
+    def visit_UnOp(self, node, dst):
+        saved = self.top
+        operand = self.compile(node.operand)
+        if node.op.token_type == TOK_NOT:
+            true = self.constant(True, None)
+            reg = self.target(dst, saved)
+            self.emit(('XOR', reg, operand, true))
+            return reg
+        reg = self.target(dst, saved)
+        if node.op.token_type == TOK_PLUS:
+            self.emit(('POS', reg, operand))
+        elif node.op.token_type == TOK_MINUS:
+            self.emit(('NEG', reg, operand))
+        return reg
+
+    def visit_LogicalOp(self, node, dst):
+        saved = self.top
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        reg = self.target(dst, saved)
+        if node.op.token_type == TOK_AND:
+            self.emit(('AND', reg, left, right))
+        elif node.op.token_type == TOK_OR:
+            self.emit(('OR', reg, left, right))
+        return reg
+
+    def visit_Grouping(self, node, dst):
+        return self.compile(node.value, dst)
+
+    def visit_Identifier(self, node, dst):
+        symbol = self.get_var_symbol(node.name)
+        if not symbol:
+            compile_error(f"Undefined variable {node.name}", node.line)
+        sym, slot = symbol
+        if sym.depth == 0:
+            reg = self.temp() if dst is None else dst
+            self.emit(('LOAD_GLOBAL', reg, sym.name))
+            return reg
+        return self.move(dst, slot)
+
+    def visit_Stmts(self, node, dst):
+        saved = self.shadow_functions(node)
+        for stmt in node.stmts:
+            self.top = len(self.locals)
+            self.compile(stmt)
+        del self.shadowed[saved:]
+
+    def visit_PrintStmt(self, node, dst):
+        value = self.compile(node.value)
+        self.emit(('PRINT' if node.end == '' else 'PRINTLN', value))
+
+    def branch_false(self, test, label):
+        """Jump to label if test is false."""
+        while type(test) is Grouping:
+            test = test.value
+        saved = self.top
+        if type(test) is BinOp and BINARY_OPS.get(test.op.token_type) in COMPARISONS:
+            left = self.compile(test.left)
+            right = self.compile(test.right)
+            self.emit(('CMP_JMPZ', label, BINARY_OPS[test.op.token_type], left, right))
+        else:
+            self.emit(('JMPZ', label, self.compile(test)))
+        self.top = saved
+
+    def visit_IfStmt(self, node, dst):
+        else_label = self.make_label()
+        exit_label = self.make_label()
+        self.branch_false(node.test, else_label)
+        self.begin_block()
+        self.compile(node.then_stmts)
+        self.end_block()
+        self.emit(('JMP', exit_label))
+        self.emit(('LABEL', else_label))
+        if node.else_stmts:
+            self.begin_block()
+            self.compile(node.else_stmts)
+            self.end_block()
+        self.emit(('LABEL', exit_label))
+
+    def visit_WhileStmt(self, node, dst):
+        test_label = self.make_label()
+        exit_label = self.make_label()
+        self.emit(('LABEL', test_label))
+        self.branch_false(node.test, exit_label)
+        self.begin_block()
+        self.compile(node.body_stmts)
+        self.end_block()
+        self.emit(('JMP', test_label))
+        self.emit(('LABEL', exit_label))
+
+    def visit_ForStmt(self, node, dst):
+        # Like Compiler, the loop variable is a global.
+        test_label = self.make_label()
+        exit_label = self.make_label()
+        varname = node.ident.name
+        new_symbol = Symbol(varname, SYM_VAR, self.scope_depth)
+        if self.scope_depth == 0:
+            self.globals.append(new_symbol)
+
+        saved = self.top
+        self.emit(('STORE_GLOBAL', varname, self.compile(node.start)))
+        self.emit(('LABEL', test_label))
+        counter = self.temp()
+        self.emit(('LOAD_GLOBAL', counter, varname))
+        self.emit(('CMP_JMPZ', exit_label, 'LT', counter, self.compile(node.end)))
+        self.top = saved
+
+        self.begin_block()
+        self.compile(node.body_stmts)
+        self.end_block()
+
+        self.top = len(self.locals)
+        counter = self.temp()
+        self.emit(('LOAD_GLOBAL', counter, varname))
+        step = self.compile(node.step) if node.step else self.constant(1.0, None)
+        self.emit(('BINARY', 'ADD', counter, counter, step))
+        self.emit(('STORE_GLOBAL', varname, counter))
+        self.emit(('JMP', test_label))
+        self.emit(('LABEL', exit_label))
+
+    def visit_Assignment(self, node, dst):
+        symbol = self.get_var_symbol(node.left.name)
+        if not symbol:
+            new_symbol = Symbol(node.left.name, SYM_VAR, self.scope_depth)
+            if self.scope_depth == 0:
+                value = self.compile(node.right)
+                self.globals.append(new_symbol)
+                self.emit(('STORE_GLOBAL', new_symbol.name, value))
+                self.numglobals += 1
+            else:
+                self.compile(node.right, len(self.locals))
+                self.declare_local(new_symbol)
+        else:
+            sym, slot = symbol
+            if sym.depth == 0:
+                self.emit(('STORE_GLOBAL', sym.name, self.compile(node.right)))
+            else:
+                self.compile(node.right, slot)
+
+    def visit_LocalStmt(self, node, dst):
+        self.compile(node.expr, len(self.locals))
+        self.declare_local(Symbol(node.ident, SYM_VAR, self.scope_depth))
+
+    def visit_FuncDecl(self, node, dst):
+        func = self.function_symbol(node)
+        if func:
+            end_label = self.make_label()
+            self.emit(('JMP', end_label))
+            self.emit(('LABEL', func.name))
+            frame = self.begin_frame()
+            self.begin_block()
+            for param in node.params:
+                self.declare_local(Symbol(param.name, SYM_VAR, self.scope_depth))
+            function, self.function = self.function, func
+            self.compile(node.body_stmts)
+            self.function = function
+            self.end_block()
+            self.emit(('RET', self.constant(False, None)))
+            self.end_frame(frame)
+            self.emit(('LABEL', end_label))
+
+    def compile_args(self, node):
+        """Check a call and put its arguments in consecutive registers; returns the first."""
+        func = self.get_func_symbol(node.name)
+        if not func:
+            compile_error(f"Undefined function {node.name}", node.line)
+        if func.arity != len(node.args):
+            compile_error(f"Function {node.name} expected {func.arity} arguments, got {len(node.args)}", node.line)
+        self.check_shadowed(node)
+        base = self.top
+        for _ in node.args:
+            self.temp()
+        for i, arg in enumerate(node.args):
+            self.compile(arg, base + i)
+        return base
+
+    def visit_FuncCall(self, node, dst):
+        saved = self.top
+        base = self.compile_args(node)
+        reg = self.target(dst, saved)
+        self.emit(('CALL', node.name, len(node.args), base, reg))
+        return reg
+
+    def visit_FuncCallStmt(self, node, dst):
+        self.compile(node.expr)
+
+    def visit_RetStmt(self, node, dst):
+        if self.function is not None and isinstance(node.expr, FuncCall):
+            base = self.compile_args(node.expr)
+            self.emit(('TAILCALL', node.expr.name, len(node.expr.args), base))
+        elif node.expr:
+            self.emit(('RET', self.compile(node.expr)))
+        else:
+            self.emit(('RET', self.constant(False, None)))
+
+    def compile_code(self, node):
+        self.collect_symbols(node)
+        frame = self.begin_frame()
+        self.compile(node)
+        self.emit(('HALT',))
+        self.end_frame(frame)
+        return self.code
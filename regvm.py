@@ -0,0 +1,195 @@
+# Register VM: runs the code of RegCompiler (regcompiler.py), assembled by
+# assembler.py.
+#
+# Each call gets a frame, a Python list of registers: the locals and
+# temporaries of the function, then its constants. An instruction reads its
+# operands from registers and writes its result to one, so `x := x + 1` is a
+# single BINARY instead of LOAD, PUSH, ADD and STORE on a stack.
+#
+# load() turns the instructions into (opcode, operand) pairs like vm.load().
+# The ENTER at the start of the program and of each function becomes the
+# frame template, [None] * nregs + constants (the last constant first, so
+# that constant k is template[-k]): CALL copies the arguments and the rest of
+# the callee's template into a new frame and jumps past its ENTER. The
+# binary operators are VM's (BINARY, binary_op from vm.py), with the same errors.
+
+from assembler import CodeObject, assemble
+from output import Output
+from utils import *
+from vm import BINARY, OPCODE as VM_OPCODE, binary_op
+
+OPCODES = (
+    # Executed by the run loop itself, in the order it tests for them.
+    'BINARY', 'CMP_JMPZ', 'MOVE', 'LOAD_GLOBAL', 'STORE_GLOBAL', 'JMPZ', 'JMP', 'CALL', 'RET', 'TAILCALL',
+    'HALT',
+    # Executed by RegVM.handlers.
+    'PRINT', 'PRINTLN', 'AND', 'OR', 'XOR', 'NEG', 'POS', 'ENTER',
+)
+(OP_BINARY, OP_CMP_JMPZ, OP_MOVE, OP_LOAD_GLOBAL, OP_STORE_GLOBAL, OP_JMPZ, OP_JMP, OP_CALL, OP_RET,
+ OP_TAILCALL, OP_HALT,
+ OP_PRINT, OP_PRINTLN, OP_AND, OP_OR, OP_XOR, OP_NEG, OP_POS, OP_ENTER) = range(len(OPCODES))
+OPCODE = {name: op for op, name in enumerate(OPCODES)}
+
+
+def template(enter):
+    _, nregs, constants = enter
+    return [None] * nregs + list(reversed(constants))
+
+
+def load(program):
+    """The (opcode, operand) form of an assembled RegCompiler program, which RegVM.run executes."""
+    code = []
+    for i, (name, *args) in enumerate(program.code):
+        opcode = OPCODE.get(name)
+        if opcode is None:
+            vm_error(f"Unknown instruction {name}", i)
+        if opcode == OP_BINARY:
+            operand = (VM_OPCODE[args[0]], *args[1:])
+        elif opcode == OP_CMP_JMPZ:
+            operand = (args[0], VM_OPCODE[args[1]], *args[2:])
+        elif opcode == OP_CALL or opcode == OP_TAILCALL:
+            # (address after the callee's ENTER, n, base, [dst,] rest of its template)
+            address, arg_count = args[0], args[1]
+            operand = (address + 1, *args[1:], template(program.code[address])[arg_count:])
+        elif opcode == OP_ENTER:
+            operand = template(program.code[i])
+        elif len(args) == 1:
+            operand = args[0]
+        else:
+            operand = tuple(args)
+        code.append((opcode, operand))
+    return code
+
+
+class RegVM:
+    def __init__(self, output=None):
+        self.output = Output() if output is None else output
+        self.write = self.output.write
+        self.globals = {}
+        # (registers, return pc, destination register) of the callers.
+        self.frames = []
+        self.regs = None
+        self.pc = 0
+        self.program = None
+        self.handlers = [getattr(self, name, None) for name in OPCODES]
+
+    def run(self, program):
+        """Run an assembled program (or RegCompiler's instruction list, which is assembled first)."""
+        if not isinstance(program, CodeObject):
+            program = assemble(program)
+        self.program = program
+        code = load(program)
+        regs = list(code[0][1])
+        globals_ = self.globals
+        frames = self.frames
+        handlers = self.handlers
+        binary = BINARY
+        numbers = NUMBERS
+        pc = 1
+        try:
+            while True:
+                op, arg = code[pc]
+                pc += 1
+                if op == OP_BINARY:
+                    binop, dst, a, b = arg
+                    left = regs[a]
+                    right = regs[b]
+                    if type(left) in numbers and type(right) in numbers:
+                        regs[dst] = binary[binop](left, right)
+                    else:
+                        regs[dst] = binary_op(binop, left, right, pc-1)
+                elif op == OP_CMP_JMPZ:
+                    target, cmp, a, b = arg
+                    left = regs[a]
+                    right = regs[b]
+                    if type(left) in numbers and type(right) in numbers:
+                        if binary[cmp](left, right) is False:
+                            pc = target
+                    elif binary_op(cmp, left, right, pc-1) is False:
+                        pc = target
+                elif op == OP_MOVE:
+                    regs[arg[0]] = regs[arg[1]]
+                elif op == OP_LOAD_GLOBAL:
+                    regs[arg[0]] = globals_[arg[1]]
+                elif op == OP_STORE_GLOBAL:
+                    globals_[arg[0]] = regs[arg[1]]
+                elif op == OP_JMPZ:
+                    if regs[arg[1]] is False:
+                        pc = arg[0]
+                elif op == OP_JMP:
+                    pc = arg
+                elif op == OP_CALL:
+                    target, arg_count, base, dst, rest = arg
+                    frames.append((regs, pc, dst))
+                    regs = regs[base:base + arg_count] + rest
+                    pc = target
+                elif op == OP_RET:
+                    value = regs[arg]
+                    regs, pc, dst = frames.pop()
+                    regs[dst] = value
+                elif op == OP_TAILCALL:
+                    # The callee's frame replaces ours; it returns to our caller.
+                    target, arg_count, base, rest = arg
+                    regs = regs[base:base + arg_count] + rest
+                    pc = target
+                elif op == OP_HALT:
+                    break
+                else:
+                    self.pc = pc
+                    self.regs = regs
+                    handlers[op](arg)
+        except (ZeroDivisionError, OverflowError) as error:
+            # Only the binary operators raise these; pc is past the instruction.
+            vm_error(ARITHMETIC_ERRORS[type(error)], pc-1)
+        finally:
+            self.pc = pc
+            self.regs = regs
+            self.output.flush()
+
+    def ENTER(self, arg):
+        vm_error("ENTER is not executed", self.pc-1)
+
+    def PRINT(self, arg):
+        self.write(stringify(self.regs[arg]))
+
+    def PRINTLN(self, arg):
+        self.write(stringify(self.regs[arg]) + "\n")
+
+    def AND(self, arg):
+        dst, a, b = arg
+        left, right = self.regs[a], self.regs[b]
+        if type(left) is bool and type(right) is bool:
+            self.regs[dst] = left and right
+        else:
+            vm_error("Invalid types for AND", self.pc-1)
+
+    def OR(self, arg):
+        dst, a, b = arg
+        left, right = self.regs[a], self.regs[b]
+        if type(left) is bool and type(right) is bool:
+            self.regs[dst] = left or right
+        else:
+            vm_error("Invalid types for OR", self.pc-1)
+
+    def XOR(self, arg):
+        dst, a, b = arg
+        left, right = self.regs[a], self.regs[b]
+        if type(left) is bool and type(right) is bool:
+            self.regs[dst] = left ^ right
+        else:
+            vm_error("Invalid types for XOR", self.pc-1)
+
+    def NEG(self, arg):
+        dst, a = arg
+        value = self.regs[a]
+        if type(value) in NUMBERS:
+            self.regs[dst] = -value
+        else:
+            vm_error("Invalid types for NEG", self.pc-1)
+
+    def POS(self, arg):
+        dst, a = arg
+        value = self.regs[a]
+        if type(value) not in NUMBERS:
+            vm_error("Invalid types for POS", self.pc-1)
+        self.regs[dst] = value
@@ -0,0 +1,163 @@
+from model import *
+
+# Static scope resolution for the slot frames of state.py.
+#
+# A scope is the program, a function, a then / else branch, a while body or
+# a for loop (which also evaluates its bounds). At run time a name can only
+# be created in a scope by the statements directly in it: an assignment to a
+# name not yet set further out, a local, a function declaration, or a for
+# loop over a name (which sets it in the scope around the loop). Resolver
+# collects those names first, gives each a slot, and then annotates:
+#
+#     Identifier.scope, Assignment.scope, FuncCall.scope, ForStmt.ident.scope
+#         (depth, slot) of the name in every enclosing scope that may hold it
+#     LocalStmt.slot, FuncDecl.slot, Params.slot
+#         slot in the current scope
+#     IfStmt.then_size / else_size, WhileStmt.size, ForStmt.size, FuncDecl.size
+#         number of slots of the scope the statement opens
+#     RetStmt.tail
+#         whether it is `ret f(...)` inside a function, a call that can
+#         replace the function making it
+#
+# Variables and functions are separate namespaces sharing one slot range. A
+# scope without slots gets no frame at run time; depths skip it.
+
+
+class Scope:
+    def __init__(self, parent, function=False):
+        self.parent = parent
+        self.vars = {}
+        self.funcs = {}
+        self.size = 0
+        # Whether the scope is in a function body.
+        self.function = function or (parent is not None and parent.function)
+
+    def add(self, table, name):
+        slot = table.get(name)
+        if slot is None:
+            # Slot 0 of a frame is its parent.
+            self.size += 1
+            slot = table[name] = self.size
+        return slot
+
+
+class Resolver(NodeVisitor):
+    def resolve(self, node, scope):
+        return self.dispatch[type(node)](self, node, scope)
+
+    def resolve_ast(self, node):
+        """Annotate the program node; returns the size of its frame."""
+        scope = Scope(None)
+        self.declare(scope, node)
+        self.resolve(node, scope)
+        return scope.size
+
+    def new_scope(self, parent, stmts):
+        scope = Scope(parent)
+        self.declare(scope, stmts)
+        return scope
+
+    def declare(self, scope, stmts):
+        for stmt in stmts.stmts:
+            kind = type(stmt)
+            if kind is Assignment:
+                scope.add(scope.vars, stmt.left.name)
+            elif kind is LocalStmt:
+                scope.add(scope.vars, stmt.ident)
+            elif kind is ForStmt:
+                scope.add(scope.vars, stmt.ident.name)
+            elif kind is FuncDecl:
+                scope.add(scope.funcs, stmt.name)
+            elif kind is Stmts:
+                self.declare(scope, stmt)
+
+    def lookup(self, scope, namespace, name):
+        refs = []
+        depth = 0
+        while scope is not None:
+            slot = getattr(scope, namespace).get(name)
+            if slot is not None:
+                refs.append((depth, slot))
+            if scope.size:
+                depth += 1
+            scope = scope.parent
+        return tuple(refs)
+
+    def visit_Identifier(self, node, scope):
+        node.scope = self.lookup(scope, 'vars', node.name)
+
+    def visit_Grouping(self, node, scope):
+        self.resolve(node.value, scope)
+
+    def visit_UnOp(self, node, scope):
+        self.resolve(node.operand, scope)
+
+    def visit_BinOp(self, node, scope):
+        self.resolve(node.left, scope)
+        self.resolve(node.right, scope)
+
+    def visit_LogicalOp(self, node, scope):
+        self.resolve(node.left, scope)
+        self.resolve(node.right, scope)
+
+    def visit_Assignment(self, node, scope):
+        self.resolve(node.right, scope)
+        node.scope = self.lookup(scope, 'vars', node.left.name)
+
+    def visit_LocalStmt(self, node, scope):
+        self.resolve(node.expr, scope)
+        node.slot = scope.vars[node.ident]
+
+    def visit_Stmts(self, node, scope):
+        for stmt in node.stmts:
+            self.resolve(stmt, scope)
+
+    def visit_PrintStmt(self, node, scope):
+        self.resolve(node.value, scope)
+
+    def visit_IfStmt(self, node, scope):
+        self.resolve(node.test, scope)
+        then_scope = self.new_scope(scope, node.then_stmts)
+        self.resolve(node.then_stmts, then_scope)
+        node.then_size = then_scope.size
+        node.else_size = 0
+        if node.else_stmts is not None:
+            else_scope = self.new_scope(scope, node.else_stmts)
+            self.resolve(node.else_stmts, else_scope)
+            node.else_size = else_scope.size
+
+    def visit_WhileStmt(self, node, scope):
+        self.resolve(node.test, scope)
+        body_scope = self.new_scope(scope, node.body_stmts)
+        self.resolve(node.body_stmts, body_scope)
+        node.size = body_scope.size
+
+    def visit_ForStmt(self, node, scope):
+        node.ident.scope = self.lookup(scope, 'vars', node.ident.name)
+        loop_scope = self.new_scope(scope, node.body_stmts)
+        self.resolve(node.start, loop_scope)
+        self.resolve(node.end, loop_scope)
+        self.resolve(node.step, loop_scope)
+        self.resolve(node.body_stmts, loop_scope)
+        node.size = loop_scope.size
+
+    def visit_FuncDecl(self, node, scope):
+        node.slot = scope.funcs[node.name]
+        body_scope = Scope(scope, function=True)
+        for param in node.params:
+            param.slot = body_scope.add(body_scope.vars, param.name)
+        self.declare(body_scope, node.body_stmts)
+        self.resolve(node.body_stmts, body_scope)
+        node.size = body_scope.size
+
+    def visit_FuncCall(self, node, scope):
+        for arg in node.args:
+            self.resolve(arg, scope)
+        node.scope = self.lookup(scope, 'funcs', node.name)
+
+    def visit_FuncCallStmt(self, node, scope):
+        self.resolve(node.expr, scope)
+
+    def visit_RetStmt(self, node, scope):
+        self.resolve(node.expr, scope)
+        node.tail = scope.function and type(node.expr) is FuncCall
@@ -45,3 +45,56 @@ class Environment:
         self.var[name] = value
 
 
+
+
+# Slot frames, used with the annotations of resolver.py. A frame is a list:
+# the parent frame at index 0, then one slot per name the resolver gave its
+# scope. A scope reference is a tuple of (depth, slot) pairs, innermost
+# first, one for every enclosing scope that may hold the name; like get_var
+# and set_var, the first slot that is set wins.
+
+def new_frame(parent, size):
+    frame = [None] * (size + 1)
+    frame[0] = parent
+    return frame
+
+
+def frame_get(frame, scope):
+    for depth, slot in scope:
+        f = frame
+        while depth:
+            f = f[0]
+            depth -= 1
+        value = f[slot]
+        if value is not None:
+            return value
+    return None
+
+
+def frame_set(frame, scope, value):
+    for depth, slot in scope:
+        f = frame
+        while depth:
+            f = f[0]
+            depth -= 1
+        if f[slot] is not None:
+            f[slot] = value
+            return value
+    # Not set anywhere yet: create it in the current scope, which is always
+    # the first reference of an assignment.
+    frame[scope[0][1]] = value
+    return value
+
+
+class TailCall:
+    """
+    What a `ret f(...)` in tail position returns instead of calling f: the
+    call and the frame (or Environment) to evaluate its arguments in. The
+    FuncCall running the current function makes the call itself, in place of
+    the frame it is leaving, so tail recursion runs in constant Python stack.
+    """
+    __slots__ = ('call', 'env')
+
+    def __init__(self, call, env):
+        self.call = call
+        self.env = env
@@ -0,0 +1,101 @@
+# Superinstructions: fused opcodes for the short sequences the VM dispatches
+# most, chosen from the instruction pairs `bench.py superinstructions` counts
+# on the bench workloads. Fuser replaces them in the Compiler's instruction list
+# (after the peephole pass, before assembly). Run with -O.
+#
+#     LOAD_GLOBAL x, PUSH c, ADD, STORE_GLOBAL x        ('INC_GLOBAL', x, c)
+#     LOAD_GLOBAL x, PUSH c, ADD, DUP, STORE_GLOBAL x   ('INC_GLOBAL_DUP', x, c)
+#     LOAD_LOCAL k, PUSH c, ADD, STORE_LOCAL k          ('INC_LOCAL', k, c)
+#     PUSH c, <cmp>, JMPZ L                             ('CMP_CONST_JMPZ', L, cmp, c)
+#     <cmp>, JMPZ L                                     ('CMP_JMPZ', L, cmp)
+#     PUSH c, <op>                                      ('BINARY_CONST', op, c)
+#     LOAD_LOCAL a, LOAD_LOCAL b                        ('LOAD_LOCAL2', a, b)
+#
+# where c is a constant number for the INCs and any constant otherwise, cmp
+# is one of LT to NE and op one of ADD to NE. INC_GLOBAL_DUP is `x := x + c`
+# followed by a read of x, after the peephole pass's store-load rule. A
+# sequence is only fused when no label falls inside it, so nothing can jump
+# into the middle of a superinstruction.
+
+COMPARISONS = ('LT', 'GT', 'LE', 'GE', 'EQ', 'NE')
+BINARY = ('ADD', 'SUB', 'MUL', 'DIV', 'MOD', 'EXP') + COMPARISONS
+
+
+def is_number(value):
+    return type(value) in (int, float)
+
+
+def fuse_inc_global_dup(code, i):
+    if (code[i][0] == 'LOAD_GLOBAL' and code[i + 1][0] == 'PUSH' and is_number(code[i + 1][1])
+            and code[i + 2] == ('ADD',) and code[i + 3] == ('DUP',) and code[i + 4] == ('STORE_GLOBAL', code[i][1])):
+        return ('INC_GLOBAL_DUP', code[i][1], code[i + 1][1])
+
+
+def fuse_inc_global(code, i):
+    if (code[i][0] == 'LOAD_GLOBAL' and code[i + 1][0] == 'PUSH' and is_number(code[i + 1][1])
+            and code[i + 2] == ('ADD',) and code[i + 3] == ('STORE_GLOBAL', code[i][1])):
+        return ('INC_GLOBAL', code[i][1], code[i + 1][1])
+
+
+def fuse_inc_local(code, i):
+    if (code[i][0] == 'LOAD_LOCAL' and code[i + 1][0] == 'PUSH' and is_number(code[i + 1][1])
+            and code[i + 2] == ('ADD',) and code[i + 3] == ('STORE_LOCAL', code[i][1])):
+        return ('INC_LOCAL', code[i][1], code[i + 1][1])
+
+
+def fuse_cmp_const_jmpz(code, i):
+    if code[i][0] == 'PUSH' and code[i + 1][0] in COMPARISONS and code[i + 2][0] == 'JMPZ':
+        return ('CMP_CONST_JMPZ', code[i + 2][1], code[i + 1][0], code[i][1])
+
+
+def fuse_cmp_jmpz(code, i):
+    if code[i][0] in COMPARISONS and code[i + 1][0] == 'JMPZ':
+        return ('CMP_JMPZ', code[i + 1][1], code[i][0])
+
+
+def fuse_binary_const(code, i):
+    if code[i][0] == 'PUSH' and code[i + 1][0] in BINARY:
+        return ('BINARY_CONST', code[i + 1][0], code[i][1])
+
+
+def fuse_load_local2(code, i):
+    if code[i][0] == 'LOAD_LOCAL' and code[i + 1][0] == 'LOAD_LOCAL':
+        return ('LOAD_LOCAL2', code[i][1], code[i + 1][1])
+
+
+# (superinstruction, pattern length, matcher), longest patterns first: at
+# each position the first one that matches is taken.
+FUSIONS = (
+    ('INC_GLOBAL_DUP', 5, fuse_inc_global_dup),
+    ('INC_GLOBAL', 4, fuse_inc_global),
+    ('INC_LOCAL', 4, fuse_inc_local),
+    ('CMP_CONST_JMPZ', 3, fuse_cmp_const_jmpz),
+    ('CMP_JMPZ', 2, fuse_cmp_jmpz),
+    ('BINARY_CONST', 2, fuse_binary_const),
+    ('LOAD_LOCAL2', 2, fuse_load_local2),
+)
+
+
+class Fuser:
+    def __init__(self):
+        self.hits = {name: 0 for name, _, _ in FUSIONS}
+
+    def fuse(self, code):
+        """A copy of an instruction list with its superinstruction patterns fused."""
+        result = []
+        i = 0
+        while i < len(code):
+            for name, length, matcher in FUSIONS:
+                window = code[i:i + length]
+                if len(window) < length or any(op[0] == 'LABEL' for op in window):
+                    continue
+                fused = matcher(code, i)
+                if fused is not None:
+                    result.append(fused)
+                    self.hits[name] += 1
+                    i += length
+                    break
+            else:
+                result.append(code[i])
+                i += 1
+        return result
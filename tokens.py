@@ -1,3 +1,6 @@
+from array import array
+import sys
+
 TOK_LPAREN = 'TOK_LPAREN'  # (
 TOK_RPAREN = 'TOK_RPAREN'  # )
 TOK_LCURLY = 'TOK_LCURLY'  # {
@@ -51,6 +54,21 @@ TOK_PRINT = 'TOK_PRINT'
 TOK_PRINTLN = 'TOK_PRINTLN'
 TOK_RET = 'TOK_RET'
 
+# Every token type in a fixed order; the position is the compact integer kind.
+TOKEN_KINDS = [
+    TOK_LPAREN, TOK_RPAREN, TOK_LCURLY, TOK_RCURLY, TOK_LSQUAR, TOK_RSQUAR,
+    TOK_COMMA, TOK_DOT, TOK_PLUS, TOK_MINUS, TOK_STAR, TOK_SLASH, TOK_CARET,
+    TOK_MOD, TOK_COLON, TOK_SEMICOLON, TOK_QUESTION, TOK_NOT, TOK_GT, TOK_LT,
+    TOK_EQ, TOK_GE, TOK_LE, TOK_NE, TOK_EQEQ, TOK_ASSIGN, TOK_GTGT, TOK_LTLT,
+    TOK_IDENTIFIER, TOK_STRING, TOK_INTEGER, TOK_FLOAT, TOK_LOCAL, TOK_IF,
+    TOK_THEN, TOK_ELSE, TOK_TRUE, TOK_FALSE, TOK_AND, TOK_OR, TOK_WHILE,
+    TOK_DO, TOK_FOR, TOK_FUNC, TOK_NULL, TOK_END, TOK_PRINT, TOK_PRINTLN,
+    TOK_RET,
+]
+
+# Token type -> small integer kind, as stored by TokenStore.
+KIND = {token_type: kind for kind, token_type in enumerate(TOKEN_KINDS)}
+
 keywords = {
     'local': TOK_LOCAL,
     'if': TOK_IF,
@@ -71,8 +89,39 @@ keywords = {
     'ret': TOK_RET,
 }
 
+operators = {
+    '(': TOK_LPAREN,
+    ')': TOK_RPAREN,
+    '{': TOK_LCURLY,
+    '}': TOK_RCURLY,
+    '[': TOK_LSQUAR,
+    ']': TOK_RSQUAR,
+    ',': TOK_COMMA,
+    '.': TOK_DOT,
+    '+': TOK_PLUS,
+    '-': TOK_MINUS,
+    '*': TOK_STAR,
+    '/': TOK_SLASH,
+    '^': TOK_CARET,
+    '%': TOK_MOD,
+    ':': TOK_COLON,
+    ';': TOK_SEMICOLON,
+    '?': TOK_QUESTION,
+    '~': TOK_NOT,
+    '>': TOK_GT,
+    '<': TOK_LT,
+    '=': TOK_EQ,
+    '>=': TOK_GE,
+    '<=': TOK_LE,
+    '~=': TOK_NE,
+    '==': TOK_EQEQ,
+    ':=': TOK_ASSIGN,
+}
+
 
 class Token:
+    __slots__ = ('token_type', 'lexeme', 'line')
+
     def __init__(self, token_type, lexeme, line):
         self.token_type = token_type
         self.lexeme = lexeme
@@ -80,3 +129,66 @@ class Token:
 
     def __repr__(self):
         return f'({self.token_type}, {self.lexeme!r}, {self.line})'
+
+
+# Identifier and keyword lexemes are interned, so repeated names share one string.
+INTERNED_KINDS = frozenset([KIND[TOK_IDENTIFIER]] + [KIND[t] for t in keywords.values()])
+
+
+class TokenStore:
+    """
+    Struct-of-arrays token stream: kinds, source offsets and lines live in
+    typed arrays and lexemes are sliced out of the source only when asked
+    for. Iterating yields ordinary Token objects one at a time, so the
+    Parser can run directly on a store.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.lines = array('I')
+
+    def append(self, token_type, start, end, line):
+        self.kinds.append(KIND[token_type])
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def token_type(self, i):
+        return TOKEN_KINDS[self.kinds[i]]
+
+    def lexeme(self, i):
+        text = self.source[self.starts[i]:self.ends[i]]
+        if self.kinds[i] in INTERNED_KINDS:
+            text = sys.intern(text)
+        return text
+
+    def token(self, i):
+        return Token(TOKEN_KINDS[self.kinds[i]], self.lexeme(i), self.lines[i])
+
+    def __getitem__(self, i):
+        return self.token(i)
+
+    def __iter__(self):
+        return self.iter_tokens()
+
+    def iter_tokens(self, start=0, stop=None):
+        source = self.source
+        kinds, starts, ends, lines = self.kinds, self.starts, self.ends, self.lines
+        intern = sys.intern
+        interned = INTERNED_KINDS
+        for i in range(start, len(kinds) if stop is None else stop):
+            kind = kinds[i]
+            text = source[starts[i]:ends[i]]
+            if kind in interned:
+                text = intern(text)
+            yield Token(TOKEN_KINDS[kind], text, lines[i])
+
+    def __repr__(self):
+        return f'TokenStore({len(self)} tokens)'
+
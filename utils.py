@@ -1,5 +1,7 @@
 import sys
 
+from model import NodeVisitor
+
 
 class Colors:
     WHITE = '\033[0m'
@@ -10,27 +12,67 @@ class Colors:
     RED = '\033[91m'
 
 
+class NvError(Exception):
+    """
+    Base class of the diagnostics raised by every phase of the toolchain.
+    line is the source line (None if unknown) and pc the VM instruction index.
+    """
+    phase = 'error'
+
+    def __init__(self, message, line=None, pc=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+        self.pc = pc
+
+    def __str__(self):
+        if self.pc is not None:
+            return f'[PC {self.pc}]: {self.message}'
+        if self.line is not None:
+            return f'[Line {self.line}]: {self.message}'
+        return self.message
+
+
+class LexingError(NvError):
+    phase = 'lexing'
+
+
+class ParseError(NvError):
+    phase = 'parse'
+
+
+class NvRuntimeError(NvError):
+    phase = 'runtime'
+
+
+class VMError(NvError):
+    phase = 'vm'
+
+
+class CompileError(NvError):
+    phase = 'compile'
+
+
+def report_error(error):
+    print(f'{Colors.RED}{error}{Colors.WHITE}')
+
+
 def lexing_error(message, lineno):
-    print(f'{Colors.RED}[Line {lineno}]: {message}{Colors.WHITE}')
-    sys.exit(1)
+    raise LexingError(message, line=lineno)
 
 
 def parse_error(message, lineno):
-    print(f'{Colors.RED}[Line {lineno}]: {message}{Colors.WHITE}')
-    sys.exit(1)
+    raise ParseError(message, line=lineno)
 
 
 def runtime_error(message, lineno):
-    print(f'{Colors.RED}[Line {lineno}]: {message}{Colors.WHITE}')
-    sys.exit(1)
+    raise NvRuntimeError(message, line=lineno)
 
 def vm_error(message,pc):
-    print(f'{Colors.RED}[PC {pc}]: {message}{Colors.WHITE}')
-    sys.exit(1)
+    raise VMError(message, pc=pc)
 
 def compile_error(message, lineno):
-    print(f'{Colors.RED}[Line {lineno}]: {message}{Colors.WHITE}')
-    sys.exit(1)
+    raise CompileError(message, line=lineno)
 
 
 def print_pretty_ast(ast_text):
@@ -57,141 +99,183 @@ def print_pretty_ast(ast_text):
 
 
 def print_tree(node, prefix="", is_last=True, label=""):
-    from model import Integer, Float, String, Bool, Grouping, UnOp, BinOp, Identifier, Assignment, LogicalOp, Stmts, PrintStmt, IfStmt, WhileStmt, ForStmt, FuncDecl, FuncCall, Params, FuncCallStmt, RetStmt
+    TreePrinter().visit(node, prefix, is_last, label)
 
-    connector = "└── " if is_last else "├── "
-    label_str = f"{label}: " if label else ""
 
+class TreePrinter(NodeVisitor):
+    def line(self, text, prefix, is_last, label):
+        """Print the line of one node and return the prefix of its children."""
+        connector = "└── " if is_last else "├── "
+        label_str = f"{label}: " if label else ""
+        print(f"{prefix}{connector}{label_str}{text}")
+        return prefix + ("    " if is_last else "│   ")
 
-    if node is None:
-        print(f"{prefix}{connector}{label_str}None")
-        return
+    def visit_NoneType(self, node, prefix, is_last, label):
+        self.line("None", prefix, is_last, label)
+
+    def generic_visit(self, node, prefix, is_last, label):
+        self.line(f"{node}", prefix, is_last, label)
+
+    def visit_Integer(self, node, prefix, is_last, label):
+        self.line(f"Integer({node.value})", prefix, is_last, label)
 
-    if isinstance(node, Integer):
-        print(f"{prefix}{connector}{label_str}Integer({node.value})")
-    elif isinstance(node, Float):
-        print(f"{prefix}{connector}{label_str}Float({node.value})")
-    elif isinstance(node, String):
-        print(f"{prefix}{connector}{label_str}String({node.value!r})")
-    elif isinstance(node, Bool):
-        print(f"{prefix}{connector}{label_str}Bool({node.value})")
-    elif isinstance(node, Identifier):
-        print(f"{prefix}{connector}{label_str}Identifier({node.name})")
-    elif isinstance(node, Assignment):
-        print(f"{prefix}{connector}{label_str}Assignment")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.left, new_prefix, False, "left")
-        print_tree(node.right, new_prefix, True, "right")
-    elif isinstance(node, Grouping):
-        print(f"{prefix}{connector}{label_str}Grouping")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.value, new_prefix, True)
-    elif isinstance(node, UnOp):
-        print(f"{prefix}{connector}{label_str}UnOp({node.op.lexeme!r})")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.operand, new_prefix, True)
-    elif isinstance(node, LogicalOp):
-        print(f"{prefix}{connector}{label_str}LogicalOp({node.op.lexeme!r})")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.left, new_prefix, False, "left")
-        print_tree(node.right, new_prefix, True, "right")
-    elif isinstance(node, BinOp):
-        print(f"{prefix}{connector}{label_str}BinOp({node.op.lexeme!r})")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.left, new_prefix, False, "left")
-        print_tree(node.right, new_prefix, True, "right")
-    elif isinstance(node, IfStmt):
-        print(f"{prefix}{connector}{label_str}IfStmt")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.test, new_prefix, False, "test")
+    def visit_Float(self, node, prefix, is_last, label):
+        self.line(f"Float({node.value})", prefix, is_last, label)
+
+    def visit_String(self, node, prefix, is_last, label):
+        self.line(f"String({node.value!r})", prefix, is_last, label)
+
+    def visit_Bool(self, node, prefix, is_last, label):
+        self.line(f"Bool({node.value})", prefix, is_last, label)
+
+    def visit_Identifier(self, node, prefix, is_last, label):
+        self.line(f"Identifier({node.name})", prefix, is_last, label)
+
+    def visit_Assignment(self, node, prefix, is_last, label):
+        new_prefix = self.line("Assignment", prefix, is_last, label)
+        self.visit(node.left, new_prefix, False, "left")
+        self.visit(node.right, new_prefix, True, "right")
+
+    def visit_Grouping(self, node, prefix, is_last, label):
+        new_prefix = self.line("Grouping", prefix, is_last, label)
+        self.visit(node.value, new_prefix, True, "")
+
+    def visit_UnOp(self, node, prefix, is_last, label):
+        new_prefix = self.line(f"UnOp({node.op.lexeme!r})", prefix, is_last, label)
+        self.visit(node.operand, new_prefix, True, "")
+
+    def visit_LogicalOp(self, node, prefix, is_last, label):
+        new_prefix = self.line(f"LogicalOp({node.op.lexeme!r})", prefix, is_last, label)
+        self.visit(node.left, new_prefix, False, "left")
+        self.visit(node.right, new_prefix, True, "right")
+
+    def visit_BinOp(self, node, prefix, is_last, label):
+        new_prefix = self.line(f"BinOp({node.op.lexeme!r})", prefix, is_last, label)
+        self.visit(node.left, new_prefix, False, "left")
+        self.visit(node.right, new_prefix, True, "right")
+
+    def visit_IfStmt(self, node, prefix, is_last, label):
+        new_prefix = self.line("IfStmt", prefix, is_last, label)
+        self.visit(node.test, new_prefix, False, "test")
         if node.else_stmts is not None:
-            print_tree(node.then_stmts, new_prefix, False, "then")
-            print_tree(node.else_stmts, new_prefix, True, "else")
+            self.visit(node.then_stmts, new_prefix, False, "then")
+            self.visit(node.else_stmts, new_prefix, True, "else")
         else:
-            print_tree(node.then_stmts, new_prefix, True, "then")
-    elif isinstance(node, WhileStmt):
-        print(f"{prefix}{connector}{label_str}WhileStmt")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.test, new_prefix, False, "test")
-        print_tree(node.body_stmts, new_prefix, True, "body")
-    elif isinstance(node, ForStmt):
-        print(f"{prefix}{connector}{label_str}ForStmt")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.ident, new_prefix, False, "ident")
-        print_tree(node.start, new_prefix, False, "start")
-        print_tree(node.end, new_prefix, False, "end")
+            self.visit(node.then_stmts, new_prefix, True, "then")
+
+    def visit_WhileStmt(self, node, prefix, is_last, label):
+        new_prefix = self.line("WhileStmt", prefix, is_last, label)
+        self.visit(node.test, new_prefix, False, "test")
+        self.visit(node.body_stmts, new_prefix, True, "body")
+
+    def visit_ForStmt(self, node, prefix, is_last, label):
+        new_prefix = self.line("ForStmt", prefix, is_last, label)
+        self.visit(node.ident, new_prefix, False, "ident")
+        self.visit(node.start, new_prefix, False, "start")
+        self.visit(node.end, new_prefix, False, "end")
         if node.step is not None:
-            print_tree(node.step, new_prefix, False, "step")
-        print_tree(node.body_stmts, new_prefix, True, "body")
-    elif isinstance(node, Stmts):
-        print(f"{prefix}{connector}{label_str}Stmts")
-        new_prefix = prefix + ("    " if is_last else "│   ")
+            self.visit(node.step, new_prefix, False, "step")
+        self.visit(node.body_stmts, new_prefix, True, "body")
+
+    def visit_Stmts(self, node, prefix, is_last, label):
+        new_prefix = self.line("Stmts", prefix, is_last, label)
         for i, stmt in enumerate(node.stmts):
             is_last_stmt = (i == len(node.stmts) - 1)
-            print_tree(stmt, new_prefix, is_last_stmt, f"[{i}]")
-    elif isinstance(node, PrintStmt):
-        print(f"{prefix}{connector}{label_str}PrintStmt")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.value, new_prefix, True, "value")
-    elif isinstance(node, FuncDecl):
-        print(f"{prefix}{connector}{label_str}FuncDecl({node.name})")
-        new_prefix = prefix + ("    " if is_last else "│   ")
+            self.visit(stmt, new_prefix, is_last_stmt, f"[{i}]")
+
+    def visit_PrintStmt(self, node, prefix, is_last, label):
+        new_prefix = self.line("PrintStmt", prefix, is_last, label)
+        self.visit(node.value, new_prefix, True, "value")
+
+    def visit_FuncDecl(self, node, prefix, is_last, label):
+        new_prefix = self.line(f"FuncDecl({node.name})", prefix, is_last, label)
         for i, param in enumerate(node.params):
             is_last_param = (i == len(node.params) - 1) and node.body_stmts is None
-            print_tree(param, new_prefix, is_last_param, f"param[{i}]")
-        print_tree(node.body_stmts, new_prefix, True, "body")
-    elif isinstance(node, FuncCall):
-        print(f"{prefix}{connector}{label_str}FuncCall({node.name})")
-        new_prefix = prefix + ("    " if is_last else "│   ")
+            self.visit(param, new_prefix, is_last_param, f"param[{i}]")
+        self.visit(node.body_stmts, new_prefix, True, "body")
+
+    def visit_FuncCall(self, node, prefix, is_last, label):
+        new_prefix = self.line(f"FuncCall({node.name})", prefix, is_last, label)
         for i, arg in enumerate(node.args):
             is_last_arg = (i == len(node.args) - 1)
-            print_tree(arg, new_prefix, is_last_arg, f"arg[{i}]")
-    elif isinstance(node, Params):
-        print(f"{prefix}{connector}{label_str}Param({node.name})")
-    elif isinstance(node, FuncCallStmt):
-        print(f"{prefix}{connector}{label_str}FuncCallStmt")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.expr, new_prefix, True, "expr")
-    elif isinstance(node, RetStmt):
-        print(f"{prefix}{connector}{label_str}RetStmt")
-        new_prefix = prefix + ("    " if is_last else "│   ")
-        print_tree(node.expr, new_prefix, True, "expr")
-    else:
-        print(f"{prefix}{connector}{label_str}{node}")
+            self.visit(arg, new_prefix, is_last_arg, f"arg[{i}]")
+
+    def visit_Params(self, node, prefix, is_last, label):
+        self.line(f"Param({node.name})", prefix, is_last, label)
+
+    def visit_FuncCallStmt(self, node, prefix, is_last, label):
+        new_prefix = self.line("FuncCallStmt", prefix, is_last, label)
+        self.visit(node.expr, new_prefix, True, "expr")
+
+    def visit_RetStmt(self, node, prefix, is_last, label):
+        new_prefix = self.line("RetStmt", prefix, is_last, label)
+        self.visit(node.expr, new_prefix, True, "expr")
+
+# Runtime values are plain Python objects: a number is a float, a string a
+# str and a bool a bool, so the engines test type(val) instead of unpacking a
+# (TYPE, value) tag. bool is not a number here even though Python makes it
+# an int. int and complex only come out of odd arithmetic (a for loop over
+# bools, a fractional power of a negative number) and count as numbers.
+NUMBERS = {float, int, complex}
+TYPE_NAMES = {float: 'TYPE_NUMBER', int: 'TYPE_NUMBER', complex: 'TYPE_NUMBER',
+              str: 'TYPE_STRING', bool: 'TYPE_BOOL'}
+
+
+# Python errors of arithmetic on numbers -> the message the engines raise
+# them as: x / 0, x % 0 and 0 ^ -1 divide by zero, a float power can
+# overflow.
+ARITHMETIC_ERRORS = {ZeroDivisionError: 'Division by zero', OverflowError: 'Number out of range'}
+
+
+def type_name(val):
+    """The TYPE_* name of a runtime value, as shown in error messages."""
+    return TYPE_NAMES[type(val)]
+
 
 def stringify(val):
-    if isinstance(val,bool) and val == True:
-        return 'true'
-    elif isinstance(val,bool) and val == False:
-        return 'false'
-    elif isinstance(val,float) and val.is_integer():
-        return str(int(val))
-    else:
-        return str(val)
+    # Checked in the order print statements see them most.
+    kind = type(val)
+    if kind is str:
+        return val
+    if kind is float:
+        if val.is_integer():
+            return '%d' % val
+        return repr(val)
+    if kind is bool:
+        return 'true' if val else 'false'
+    return str(val)
 
 
 def print_code(code):
     """打印 VM 指令，格式化输出类似汇编风格"""
+    # 汇编后的代码（assembler.CodeObject）没有 LABEL 指令，
+    # 标签和跳转目标的名字来自它的符号表
+    names = code.names() if hasattr(code, 'names') else {}
     for i, op in enumerate(code):
         opcode = op[0]
         idx = f"{i:08d}"
+        for name in names.get(i, ()):
+            print(f"{'':8} {name}:")
         if opcode in ('START', 'HALT'):
             # 标签式指令，顶格加冒号
             print(f"{idx} {opcode}:")
         elif opcode == 'LABEL':
             # 标签定义，顶格显示
             print(f"{idx} {op[1]}:")
-        elif opcode in ('JMP', 'JMPZ', 'JSR'):
-            # 跳转指令，参数是标签名字符串
-            print(f"{idx}     {opcode}  {op[1]}")
+        elif opcode in ('JMP', 'JMPZ', 'JSR', 'CMP_JMPZ', 'CMP_CONST_JMPZ'):
+            # 跳转指令，参数是标签名字符串，或汇编后的地址；
+            # 比较跳转的超级指令后面还有比较运算和常量
+            target = f"{op[1]:08d} ({names[op[1]][0]})" if op[1] in names else op[1]
+            print(f"{idx}     {opcode}  {target}" + ''.join(f"  {stringify(arg)}" for arg in op[2:]))
         elif opcode in ('LOAD_GLOBAL', 'STORE_GLOBAL'):
             # 全局变量指令，参数是变量名字符串
             print(f"{idx}     {opcode}  {op[1]}")
         elif opcode in ('LOAD_LOCAL', 'STORE_LOCAL'):
             print(f"{idx}     {opcode}  {op[1]}")
-        elif opcode == 'CALL':
+        elif opcode in ('CALL', 'CALL_PURE', 'TAILCALL'):
             arg_count = op[2] if len(op) > 2 else 0
-            print(f"{idx}     {opcode}  {op[1]}({arg_count})")
+            target = f"{names[op[1]][0]}({arg_count}) @{op[1]:08d}" if op[1] in names else f"{op[1]}({arg_count})"
+            print(f"{idx}     {opcode}  {target}")
         elif opcode == 'RET':
             print(f"{idx}     {opcode}")
         elif len(op) == 1:
@@ -199,14 +283,47 @@ def print_code(code):
             print(f"{idx}     {opcode}")
         else:
             # 有参数指令（如 PUSH）
-            # op[1] 是 (TYPE, value) 元组
-            _, value = op[1]
-            print(f"{idx}     {opcode}  {stringify(value)}")
+            # op[1] 是常量值本身（float / str / bool）；超级指令有多个参数
+            print(f"{idx}     {opcode}  " + '  '.join(stringify(arg) for arg in op[1:]))
+
+# 寄存器虚拟机（regvm.py）每条指令中是寄存器的参数位置
+REG_OPERANDS = {
+    'MOVE': (1, 2), 'LOAD_GLOBAL': (1,), 'STORE_GLOBAL': (2,), 'BINARY': (2, 3, 4),
+    'NEG': (1, 2), 'POS': (1, 2), 'AND': (1, 2, 3), 'OR': (1, 2, 3), 'XOR': (1, 2, 3),
+    'JMPZ': (2,), 'CMP_JMPZ': (3, 4), 'CALL': (3, 4), 'TAILCALL': (3,), 'RET': (1,),
+    'PRINT': (1,), 'PRINTLN': (1,),
+}
+
+def print_regcode(code):
+    """打印寄存器虚拟机的指令：rN 是寄存器，kN 是常量（寄存器 -N）"""
+    names = code.names() if hasattr(code, 'names') else {}
+    reg = lambda r: f"r{r}" if r >= 0 else f"k{-r}"
+    for i, op in enumerate(code):
+        opcode = op[0]
+        idx = f"{i:08d}"
+        for name in names.get(i, ()):
+            print(f"{'':8} {name}:")
+        if opcode == 'LABEL':
+            print(f"{idx} {op[1]}:")
+        elif opcode == 'ENTER':
+            # 帧的布局：寄存器个数和常量
+            constants = ''.join(f"  k{k}={stringify(value)}" for k, value in enumerate(op[2], 1))
+            print(f"{idx} {opcode}  {op[1]} regs{constants}")
+        elif opcode == 'HALT':
+            print(f"{idx} {opcode}:")
+        else:
+            args = [reg(arg) if j in REG_OPERANDS.get(opcode, ()) else stringify(arg)
+                    for j, arg in enumerate(op[1:], 1)]
+            if opcode in ('JMP', 'JMPZ', 'CMP_JMPZ') and op[1] in names:
+                args[0] = f"{op[1]:08d} ({names[op[1]][0]})"
+            elif opcode in ('CALL', 'TAILCALL'):
+                target = f"{names[op[1]][0]}({op[2]}) @{op[1]:08d}" if op[1] in names else f"{op[1]}({op[2]})"
+                args[:2] = [target]
+            print(f"{idx}     {opcode}  " + '  '.join(args))
 
 def generate_ast_image(node, filename="ast"):
     try:
         from graphviz import Digraph
-        from model import Integer, Float, String, Bool, Grouping, UnOp, BinOp, Identifier, Assignment, LogicalOp, Stmts, PrintStmt, IfStmt, WhileStmt, ForStmt, FuncDecl, FuncCall, Params, FuncCallStmt, RetStmt
     except ImportError:
         print("plz install graphviz: pip install graphviz")
         return
@@ -214,95 +331,138 @@ def generate_ast_image(node, filename="ast"):
     dot = Digraph(comment='AST')
     dot.attr(rankdir='TB', fontname='Consolas')
     dot.attr('node', fontname='Consolas')
+    ASTImage(dot).visit(node)
+    dot.render(filename, format="png", cleanup=True)
+    print(f"AST img generated: {filename}.png")
 
-    def add_node(n, parent_id=None, edge_label=""):
 
-        if n is None:
-            node_id = str(id(n)) + "_none_" + str(parent_id)
-            dot.node(node_id, "None", shape="ellipse", style="filled", fillcolor="lightgray")
-            if parent_id:
-                dot.edge(parent_id, node_id, label=edge_label)
-            return
+class ASTImage(NodeVisitor):
+    """
+    Adds one graphviz node per AST node to dot. The visit_ methods add the
+    node and its subtree and return its id; visit() then links it to the parent.
+    """
 
+    def __init__(self, dot):
+        self.dot = dot
+
+    def visit(self, n, parent_id=None, edge_label=""):
+        node_id = self.dispatch[type(n)](self, n, parent_id)
+        if parent_id:
+            self.dot.edge(parent_id, node_id, label=edge_label)
+
+    def add(self, n, text, shape, fillcolor):
         node_id = str(id(n))
+        self.dot.node(node_id, text, shape=shape, style="filled", fillcolor=fillcolor)
+        return node_id
 
-        if isinstance(n, Integer):
-            dot.node(node_id, f"Integer\n{n.value}", shape="ellipse", style="filled", fillcolor="lightblue")
-        elif isinstance(n, Float):
-            dot.node(node_id, f"Float\n{n.value}", shape="ellipse", style="filled", fillcolor="lightblue")
-        elif isinstance(n, String):
-            dot.node(node_id, f"String\n{n.value!r}", shape="ellipse", style="filled", fillcolor="lightyellow")
-        elif isinstance(n, Bool):
-            dot.node(node_id, f"Bool\n{n.value}", shape="ellipse", style="filled", fillcolor="lightgreen")
-        elif isinstance(n, Identifier):
-            dot.node(node_id, f"Identifier\n{n.name}", shape="ellipse", style="filled", fillcolor="lightcyan")
-        elif isinstance(n, Assignment):
-            dot.node(node_id, "Assignment", shape="box", style="filled", fillcolor="plum")
-            add_node(n.left, node_id, "left")
-            add_node(n.right, node_id, "right")
-        elif isinstance(n, Grouping):
-            dot.node(node_id, "()", shape="box", style="filled", fillcolor="lightgray")
-            add_node(n.value, node_id)
-        elif isinstance(n, UnOp):
-            dot.node(node_id, f"UnOp\n{n.op.lexeme!r}", shape="circle", style="filled", fillcolor="lightsalmon")
-            add_node(n.operand, node_id)
-        elif isinstance(n, LogicalOp):
-            dot.node(node_id, f"LogicalOp\n{n.op.lexeme!r}", shape="diamond", style="filled", fillcolor="lightpink")
-            add_node(n.left, node_id, "L")
-            add_node(n.right, node_id, "R")
-        elif isinstance(n, BinOp):
-            dot.node(node_id, f"BinOp\n{n.op.lexeme!r}", shape="circle", style="filled", fillcolor="lightsalmon")
-            add_node(n.left, node_id, "L")
-            add_node(n.right, node_id, "R")
-        elif isinstance(n, IfStmt):
-            dot.node(node_id, "IfStmt", shape="box", style="filled", fillcolor="lightskyblue")
-            add_node(n.test, node_id, "test")
-            add_node(n.then_stmts, node_id, "then")
-            if n.else_stmts is not None:
-                add_node(n.else_stmts, node_id, "else")
-        elif isinstance(n, WhileStmt):
-            dot.node(node_id, "WhileStmt", shape="box", style="filled", fillcolor="lightskyblue")
-            add_node(n.test, node_id, "test")
-            add_node(n.body_stmts, node_id, "body")
-        elif isinstance(n, ForStmt):
-            dot.node(node_id, "ForStmt", shape="box", style="filled", fillcolor="lightcoral")
-            add_node(n.ident, node_id, "ident")
-            add_node(n.start, node_id, "start")
-            add_node(n.end, node_id, "end")
-            if n.step is not None:
-                add_node(n.step, node_id, "step")
-            add_node(n.body_stmts, node_id, "body")
-        elif isinstance(n, Stmts):
-            dot.node(node_id, "Stmts", shape="box", style="filled", fillcolor="lavender")
-            for i, stmt in enumerate(n.stmts):
-                add_node(stmt, node_id, f"[{i}]")
-        elif isinstance(n, PrintStmt):
-            dot.node(node_id, "PrintStmt", shape="box", style="filled", fillcolor="palegreen")
-            add_node(n.value, node_id, "value")
-        elif isinstance(n, FuncDecl):
-            dot.node(node_id, f"FuncDecl\n{n.name}", shape="box", style="filled", fillcolor="orchid")
-            for i, param in enumerate(n.params):
-                add_node(param, node_id, f"param[{i}]")
-            add_node(n.body_stmts, node_id, "body")
-        elif isinstance(n, FuncCall):
-            dot.node(node_id, f"FuncCall\n{n.name}", shape="box", style="filled", fillcolor="gold")
-            for i, arg in enumerate(n.args):
-                add_node(arg, node_id, f"arg[{i}]")
-        elif isinstance(n, Params):
-            dot.node(node_id, f"Param\n{n.name}", shape="ellipse", style="filled", fillcolor="lightcyan")
-        elif isinstance(n, FuncCallStmt):
-            dot.node(node_id, "FuncCallStmt", shape="box", style="filled", fillcolor="gold")
-            add_node(n.expr, node_id, "expr")
-        elif isinstance(n, RetStmt):
-            dot.node(node_id, "RetStmt", shape="box", style="filled", fillcolor="salmon")
-            add_node(n.expr, node_id, "expr")
-        else:
+    def visit_NoneType(self, n, parent_id):
+        node_id = str(id(n)) + "_none_" + str(parent_id)
+        self.dot.node(node_id, "None", shape="ellipse", style="filled", fillcolor="lightgray")
+        return node_id
 
-            dot.node(node_id, str(type(n).__name__), shape="box", style="filled", fillcolor="white")
+    def generic_visit(self, n, parent_id):
+        return self.add(n, str(type(n).__name__), shape="box", fillcolor="white")
 
-        if parent_id:
-            dot.edge(parent_id, node_id, label=edge_label)
+    def visit_Integer(self, n, parent_id):
+        return self.add(n, f"Integer\n{n.value}", shape="ellipse", fillcolor="lightblue")
 
-    add_node(node)
-    dot.render(filename, format="png", cleanup=True)
-    print(f"AST img generated: {filename}.png")
+    def visit_Float(self, n, parent_id):
+        return self.add(n, f"Float\n{n.value}", shape="ellipse", fillcolor="lightblue")
+
+    def visit_String(self, n, parent_id):
+        return self.add(n, f"String\n{n.value!r}", shape="ellipse", fillcolor="lightyellow")
+
+    def visit_Bool(self, n, parent_id):
+        return self.add(n, f"Bool\n{n.value}", shape="ellipse", fillcolor="lightgreen")
+
+    def visit_Identifier(self, n, parent_id):
+        return self.add(n, f"Identifier\n{n.name}", shape="ellipse", fillcolor="lightcyan")
+
+    def visit_Assignment(self, n, parent_id):
+        node_id = self.add(n, "Assignment", shape="box", fillcolor="plum")
+        self.visit(n.left, node_id, "left")
+        self.visit(n.right, node_id, "right")
+        return node_id
+
+    def visit_Grouping(self, n, parent_id):
+        node_id = self.add(n, "()", shape="box", fillcolor="lightgray")
+        self.visit(n.value, node_id, "")
+        return node_id
+
+    def visit_UnOp(self, n, parent_id):
+        node_id = self.add(n, f"UnOp\n{n.op.lexeme!r}", shape="circle", fillcolor="lightsalmon")
+        self.visit(n.operand, node_id, "")
+        return node_id
+
+    def visit_LogicalOp(self, n, parent_id):
+        node_id = self.add(n, f"LogicalOp\n{n.op.lexeme!r}", shape="diamond", fillcolor="lightpink")
+        self.visit(n.left, node_id, "L")
+        self.visit(n.right, node_id, "R")
+        return node_id
+
+    def visit_BinOp(self, n, parent_id):
+        node_id = self.add(n, f"BinOp\n{n.op.lexeme!r}", shape="circle", fillcolor="lightsalmon")
+        self.visit(n.left, node_id, "L")
+        self.visit(n.right, node_id, "R")
+        return node_id
+
+    def visit_IfStmt(self, n, parent_id):
+        node_id = self.add(n, "IfStmt", shape="box", fillcolor="lightskyblue")
+        self.visit(n.test, node_id, "test")
+        self.visit(n.then_stmts, node_id, "then")
+        if n.else_stmts is not None:
+            self.visit(n.else_stmts, node_id, "else")
+        return node_id
+
+    def visit_WhileStmt(self, n, parent_id):
+        node_id = self.add(n, "WhileStmt", shape="box", fillcolor="lightskyblue")
+        self.visit(n.test, node_id, "test")
+        self.visit(n.body_stmts, node_id, "body")
+        return node_id
+
+    def visit_ForStmt(self, n, parent_id):
+        node_id = self.add(n, "ForStmt", shape="box", fillcolor="lightcoral")
+        self.visit(n.ident, node_id, "ident")
+        self.visit(n.start, node_id, "start")
+        self.visit(n.end, node_id, "end")
+        if n.step is not None:
+            self.visit(n.step, node_id, "step")
+        self.visit(n.body_stmts, node_id, "body")
+        return node_id
+
+    def visit_Stmts(self, n, parent_id):
+        node_id = self.add(n, "Stmts", shape="box", fillcolor="lavender")
+        for i, stmt in enumerate(n.stmts):
+            self.visit(stmt, node_id, f"[{i}]")
+        return node_id
+
+    def visit_PrintStmt(self, n, parent_id):
+        node_id = self.add(n, "PrintStmt", shape="box", fillcolor="palegreen")
+        self.visit(n.value, node_id, "value")
+        return node_id
+
+    def visit_FuncDecl(self, n, parent_id):
+        node_id = self.add(n, f"FuncDecl\n{n.name}", shape="box", fillcolor="orchid")
+        for i, param in enumerate(n.params):
+            self.visit(param, node_id, f"param[{i}]")
+        self.visit(n.body_stmts, node_id, "body")
+        return node_id
+
+    def visit_FuncCall(self, n, parent_id):
+        node_id = self.add(n, f"FuncCall\n{n.name}", shape="box", fillcolor="gold")
+        for i, arg in enumerate(n.args):
+            self.visit(arg, node_id, f"arg[{i}]")
+        return node_id
+
+    def visit_Params(self, n, parent_id):
+        return self.add(n, f"Param\n{n.name}", shape="ellipse", fillcolor="lightcyan")
+
+    def visit_FuncCallStmt(self, n, parent_id):
+        node_id = self.add(n, "FuncCallStmt", shape="box", fillcolor="gold")
+        self.visit(n.expr, node_id, "expr")
+        return node_id
+
+    def visit_RetStmt(self, n, parent_id):
+        node_id = self.add(n, "RetStmt", shape="box", fillcolor="salmon")
+        self.visit(n.expr, node_id, "expr")
+        return node_id
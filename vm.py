@@ -4,14 +4,19 @@
 #
 #      ('PUSH', value)       # Push a value to the stack
 #      ('POP',)              # Pop a value from the stack
+#      ('POPN', n)           # Pop n values from the stack
+#      ('DUP',)              # Push the value on top of the stack again
 #
-# Stack values are tagged with their type using a tuple:
+# Stack values are the Python values themselves, without a type tag:
 #
-#      (TYPE_NUMBER, 4.0)
-#      (TYPE_NUMBER, 15.6)
-#      (TYPE_NUMBER, -3.141592)
-#      (TYPE_STRING, 'This is a string')
-#      (TYPE_BOOL, true)
+#      4.0
+#      15.6
+#      -3.141592
+#      'This is a string'
+#      True
+#
+# An instruction that needs the type of a value tests type(value) (see
+# NUMBERS in utils).
 #
 # Instructions to add, subtract, multiply, divide, and compare values from the top of the stack
 #
@@ -23,6 +28,7 @@
 #      ('AND',)              # Bitwise AND
 #      ('XOR',)              # Bitwise XOR
 #      ('NEG',)              # Negate
+#      ('NOT',)              # Logical not (PUSH True, XOR)
 #      ('EXP',)              # Exponent
 #      ('MOD',)              # Modulo
 #      ('EQ',)               # Compare ==
@@ -34,9 +40,9 @@
 #
 # An example of the instruction stream for computing 7 + 2 * 3
 #
-#      ('PUSH', (TYPE_NUMBER, 7))
-#      ('PUSH', (TYPE_NUMBER, 2))
-#      ('PUSH', (TYPE_NUMBER, 3))
+#      ('PUSH', 7.0)
+#      ('PUSH', 2.0)
+#      ('PUSH', 3.0)
 #      ('MUL',)
 #      ('ADD',)
 #
@@ -54,259 +60,342 @@
 #      ('JMPZ', name)        # Jump to label name if top of stack is zero (or false)
 #      ('JSR', name)         # Jump to subroutine/function and keep track of the returning PC
 #      ('RTS',)              # Return from subroutine/function
+#      ('TAILCALL', name, n) # Replace the current function by name, with the n values on top as arguments
+#      ('CALL_PURE', name, n) # CALL of a pure function, answered from the VM's memo cache if it can be
+#
+# Superinstructions, which -O puts in place of common sequences (see
+# superinstructions.py):
+#
+#      ('CMP_JMPZ', name, cmp)           # Compare the two values on top, jump if false
+#      ('CMP_CONST_JMPZ', name, cmp, c)  # Compare the top with constant c, jump if false
+#      ('BINARY_CONST', op, c)           # Replace the top by top <op> c
+#      ('LOAD_LOCAL2', a, b)             # Push locals a and b
+#      ('INC_LOCAL', k, c)               # Add c to local k
+#      ('INC_GLOBAL', name, c)           # Add c to global name
+#      ('INC_GLOBAL_DUP', name, c)       # Add c to global name and push the result
 
-import codecs
+#
+# The VM runs assembled code (see assembler.py): the LABELs are gone and
+# jumps and calls hold the address of their target instead of its name,
+#
+#      ('JMP', address), ('JMPZ', address)
+#      ('CALL', address, n), ('CALL_PURE', address, n), ('TAILCALL', address, n)
+#
+# and load() turns those tuples into (opcode, operand) pairs, at the same
+# indices: the opcode is an int (OPCODES) and a call's operand is (address,
+# n); an instruction with more operands has them as a tuple, with operator
+# names (in the superinstructions) turned into opcodes. The run loop keeps pc, bp and the stack in locals and executes the
+# common instructions itself; the others go through VM.handlers, a table of
+# methods indexed by opcode, which see the VM's state in self.pc, self.bp and
+# self.stack.
+# The stack is a Python list; sp is always len(stack) - 1.
+
+import operator
+
+from assembler import CodeObject, assemble
+from memo import memo_key
+from output import Output
 from utils import *
 
-TYPE_NUMBER = 'TYPE_NUMBER'  # Default to 64-bit float
-TYPE_STRING = 'TYPE_STRING'  # String managed by the host language
-TYPE_BOOL = 'TYPE_BOOL'  # true | false
+OPCODES = (
+    # Executed by the run loop itself, in the order it tests for them: it
+    # first tells LOAD_LOCAL..JMP (loads, stores, jumps and the
+    # superinstructions, see superinstructions.py), ADD..NE and the rest
+    # apart, so that no opcode waits behind a long chain of tests.
+    'LOAD_LOCAL', 'LOAD_GLOBAL', 'BINARY_CONST', 'CMP_CONST_JMPZ', 'PUSH', 'STORE_LOCAL', 'STORE_GLOBAL',
+    'CMP_JMPZ', 'LOAD_LOCAL2', 'INC_LOCAL', 'INC_GLOBAL', 'INC_GLOBAL_DUP', 'JMPZ', 'JMP',
+    'ADD', 'SUB', 'MUL', 'DIV', 'MOD', 'EXP', 'LT', 'GT', 'LE', 'GE', 'EQ', 'NE',
+    'CALL', 'RET', 'TAILCALL', 'POP', 'DUP', 'POPN', 'HALT',
+    # Executed by VM.handlers.
+    'CALL_PURE', 'PRINT', 'PRINTLN', 'AND', 'OR', 'XOR', 'NOT', 'NEG', 'POS', 'START',
+)
+(OP_LOAD_LOCAL, OP_LOAD_GLOBAL, OP_BINARY_CONST, OP_CMP_CONST_JMPZ, OP_PUSH, OP_STORE_LOCAL, OP_STORE_GLOBAL,
+ OP_CMP_JMPZ, OP_LOAD_LOCAL2, OP_INC_LOCAL, OP_INC_GLOBAL, OP_INC_GLOBAL_DUP, OP_JMPZ, OP_JMP,
+ OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MOD, OP_EXP, OP_LT, OP_GT, OP_LE, OP_GE, OP_EQ, OP_NE,
+ OP_CALL, OP_RET, OP_TAILCALL, OP_POP, OP_DUP, OP_POPN, OP_HALT,
+ OP_CALL_PURE, OP_PRINT, OP_PRINTLN, OP_AND, OP_OR, OP_XOR, OP_NOT, OP_NEG, OP_POS,
+ OP_START) = range(len(OPCODES))
+OPCODE = {name: op for op, name in enumerate(OPCODES)}
+
+CALLS = (OP_CALL, OP_CALL_PURE, OP_TAILCALL)
+# Superinstruction -> index of its operand naming a binary operator.
+OPERATOR_OPERANDS = {OP_BINARY_CONST: 0, OP_CMP_CONST_JMPZ: 1, OP_CMP_JMPZ: 1}
+
+# The binary operators ADD to NE, indexed by opcode. All of them take two
+# numbers; ADD also joins strings (stringifying the other operand), LT to NE
+# also compare two strings and EQ / NE also two bools.
+BINARY = [None] * len(OPCODES)
+BINARY[OP_ADD:OP_NE + 1] = (operator.add, operator.sub, operator.mul, operator.truediv, operator.mod,
+                            operator.pow, operator.lt, operator.gt, operator.le, operator.ge,
+                            operator.eq, operator.ne)
+
+
+def binary_op(op, left, right, pc):
+    """left <op> right for binary opcode op, or a VMError at pc for the wrong operand types."""
+    lefttype = type(left)
+    righttype = type(right)
+    if lefttype in NUMBERS and righttype in NUMBERS:
+        return BINARY[op](left, right)
+    if op == OP_ADD and (lefttype is str or righttype is str):
+        return stringify(left) + stringify(right)
+    if op >= OP_LT and (lefttype is str and righttype is str or
+                        op >= OP_EQ and lefttype is bool and righttype is bool):
+        return BINARY[op](left, right)
+    vm_error(f"Invalid types for {OPCODES[op]}", pc)
+
+
+def load(program):
+    """The (opcode, operand) form of a CodeObject, which VM.run executes."""
+    code = []
+    for i, (name, *args) in enumerate(program.code):
+        opcode = OPCODE.get(name)
+        if opcode is None:
+            vm_error(f"Unknown instruction {name}", i)
+        if opcode in CALLS:
+            operand = (args[0], args[1] if len(args) > 1 else 0)
+        elif len(args) > 1:
+            operand = list(args)
+            index = OPERATOR_OPERANDS.get(opcode)
+            if index is not None:
+                operand[index] = OPCODE[operand[index]]
+            operand = tuple(operand)
+        else:
+            operand = args[0] if args else None
+        code.append((opcode, operand))
+    return code
+
 
 class Frame:
-    def __init__(self,name,ret_pc,frame_pointer):
-        self.name = name
+    def __init__(self,func,ret_pc,frame_pointer):
+        # Address of the function running in the frame.
+        self.func = func
         self.ret_pc = ret_pc
         self.frame_pointer = frame_pointer
+        # (cache, key) to store the result under on return, if memoized.
+        self.memo = None
 
 class VM:
-    def __init__(self):
+    def __init__(self, memo=None, output=None):
+        # A memo.Memoizer for CALL_PURE, or None to make it a plain CALL.
+        self.memo = memo
+        self.output = Output() if output is None else output
+        self.write = self.output.write
         self.stack = []
         self.pc = 0
-        self.sp = -1
-        self.bp = 0  
-        self.labels = {}
+        self.bp = 0
         self.globals = {}
         self.frames = []
-        self.is_running = True
-
-    def create_label_table(self,instructions):
-        self.labels = {}
-        for i,op in enumerate(instructions):
-            if op[0] == 'LABEL':
-                self.labels[op[1]] = i
-
-
-    def run(self,instructions):
-        self.create_label_table(instructions)  # 先建立标签表
-        self.is_running = True
-        while self.is_running:
-            opcode,*args = instructions[self.pc]
-            self.pc += 1
-            getattr(self, opcode)(*args)
-
-    def START(self,*args):
-        self.is_running = True
-
-    def HALT(self,*args):
-        self.is_running = False
-
-    def LABEL(self,*args):
+        self.program = None
+        self.handlers = [getattr(self, name, None) for name in OPCODES]
+
+    @property
+    def sp(self):
+        return len(self.stack) - 1
+
+    def run(self,program):
+        """Run a CodeObject (or the Compiler's instruction list, which is assembled first)."""
+        if not isinstance(program, CodeObject):
+            program = assemble(program)
+        self.program = program
+        code = load(program)
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        globals_ = self.globals
+        frames = self.frames
+        handlers = self.handlers
+        binary = BINARY
+        numbers = NUMBERS
+        pc = self.pc
+        bp = self.bp
+        try:
+            while True:
+                op, arg = code[pc]
+                pc += 1
+                if op <= OP_JMP:
+                    if op == OP_LOAD_LOCAL:
+                        push(stack[bp + arg])
+                    elif op == OP_LOAD_GLOBAL:
+                        push(globals_[arg])
+                    elif op == OP_BINARY_CONST:
+                        binop, right = arg
+                        left = pop()
+                        if type(left) in numbers and type(right) in numbers:
+                            push(binary[binop](left, right))
+                        else:
+                            push(binary_op(binop, left, right, pc-1))
+                    elif op == OP_CMP_CONST_JMPZ:
+                        target, cmp, right = arg
+                        left = pop()
+                        if type(left) in numbers and type(right) in numbers:
+                            if binary[cmp](left, right) is False:
+                                pc = target
+                        elif binary_op(cmp, left, right, pc-1) is False:
+                            pc = target
+                    elif op == OP_PUSH:
+                        push(arg)
+                    elif op == OP_STORE_LOCAL:
+                        value = pop()
+                        target = bp + arg
+                        while len(stack) <= target:
+                            push(None)
+                        stack[target] = value
+                    elif op == OP_STORE_GLOBAL:
+                        globals_[arg] = pop()
+                    elif op == OP_CMP_JMPZ:
+                        target, cmp = arg
+                        right = pop()
+                        left = pop()
+                        if type(left) in numbers and type(right) in numbers:
+                            if binary[cmp](left, right) is False:
+                                pc = target
+                        elif binary_op(cmp, left, right, pc-1) is False:
+                            pc = target
+                    elif op == OP_LOAD_LOCAL2:
+                        push(stack[bp + arg[0]])
+                        push(stack[bp + arg[1]])
+                    elif op == OP_INC_LOCAL:
+                        slot, right = arg
+                        target = bp + slot
+                        left = stack[target]
+                        if type(left) in numbers:
+                            stack[target] = left + right
+                        else:
+                            stack[target] = binary_op(OP_ADD, left, right, pc-1)
+                    elif op == OP_INC_GLOBAL or op == OP_INC_GLOBAL_DUP:
+                        name, right = arg
+                        left = globals_[name]
+                        if type(left) in numbers:
+                            value = left + right
+                        else:
+                            value = binary_op(OP_ADD, left, right, pc-1)
+                        globals_[name] = value
+                        if op == OP_INC_GLOBAL_DUP:
+                            push(value)
+                    elif op == OP_JMPZ:
+                        if pop() is False:
+                            pc = arg
+                    elif op == OP_JMP:
+                        pc = arg
+                elif op <= OP_NE:
+                    right = pop()
+                    left = pop()
+                    if type(left) in numbers and type(right) in numbers:
+                        push(binary[op](left, right))
+                    else:
+                        push(binary_op(op, left, right, pc-1))
+                elif op == OP_CALL:
+                    target, arg_count = arg
+                    frames.append(Frame(target, pc, bp))
+                    bp = len(stack) - arg_count
+                    pc = target
+                elif op == OP_RET:
+                    return_value = pop()
+                    frame = frames.pop()
+                    if frame.memo is not None:
+                        cache, key = frame.memo
+                        cache.put(key, return_value)
+                    del stack[bp:]
+                    bp = frame.frame_pointer
+                    pc = frame.ret_pc
+                    push(return_value)
+                elif op == OP_TAILCALL:
+                    # The arguments take the place of the current frame's
+                    # slots; the return address and caller's bp stay, so the
+                    # callee returns to our caller.
+                    target, arg_count = arg
+                    frames[-1].func = target
+                    stack[bp:] = stack[len(stack) - arg_count:]
+                    pc = target
+                elif op == OP_POP:
+                    pop()
+                elif op == OP_DUP:
+                    push(stack[-1])
+                elif op == OP_POPN:
+                    del stack[len(stack) - arg:]
+                elif op == OP_HALT:
+                    break
+                else:
+                    self.pc = pc
+                    self.bp = bp
+                    handlers[op](arg)
+                    pc = self.pc
+                    bp = self.bp
+        except (ZeroDivisionError, OverflowError) as error:
+            # Only the binary operators raise these; pc is past the instruction.
+            vm_error(ARITHMETIC_ERRORS[type(error)], pc-1)
+        finally:
+            self.pc = pc
+            self.bp = bp
+            self.output.flush()
+
+    def START(self, arg):
         pass
 
-    def PUSH(self,*args):
-        self.stack.append(args[0])
-        self.sp += 1
-
-    def POP(self,*args):
-        self.sp -= 1
-        return self.stack.pop()
-
-    def ADD(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, leftvalue + rightvalue))
-        elif lefttype == TYPE_STRING or righttype == TYPE_STRING:
-            self.PUSH((TYPE_STRING, stringify(leftvalue) + stringify(rightvalue)))
-        else:
-            vm_error("Invalid types for ADD", self.pc-1)
-
-    def SUB(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, leftvalue - rightvalue))
-        else:
-            vm_error("Invalid types for SUB", self.pc-1)
-
-    def MUL(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, leftvalue * rightvalue))
-        else:
-            vm_error("Invalid types for MUL", self.pc-1)
-
-    def DIV(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, leftvalue / rightvalue))
-        else:
-            vm_error("Invalid types for DIV", self.pc-1)
-
-    def EXP(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, leftvalue ** rightvalue))
-        else:
-            vm_error("Invalid types for EXP", self.pc-1)
-
-    def MOD(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, leftvalue % rightvalue))
-        else:
-            vm_error("Invalid types for MOD", self.pc-1)
+    def PRINT(self, arg):
+        self.write(stringify(self.stack.pop()))
 
-    def PRINT(self,*args):
-        vatype, val = self.POP()
-        print(codecs.escape_decode(bytes(stringify(val),"utf-8"))[0].decode("utf-8"), end="")
+    def PRINTLN(self, arg):
+        self.write(stringify(self.stack.pop()) + "\n")
 
-    def PRINTLN(self,*args):
-        vatype, val = self.POP()
-        print(codecs.escape_decode(bytes(stringify(val),"utf-8"))[0].decode("utf-8"), end="\n")
-
-    def AND(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_BOOL and righttype == TYPE_BOOL:
-            self.PUSH((TYPE_BOOL, leftvalue and rightvalue))
+    def AND(self, arg):
+        rightvalue = self.stack.pop()
+        leftvalue = self.stack.pop()
+        if type(leftvalue) is bool and type(rightvalue) is bool:
+            self.stack.append(leftvalue and rightvalue)
         else:
             vm_error("Invalid types for AND", self.pc-1)
-    
-    def OR(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_BOOL and righttype == TYPE_BOOL:
-            self.PUSH((TYPE_BOOL, leftvalue or rightvalue))
+
+    def OR(self, arg):
+        rightvalue = self.stack.pop()
+        leftvalue = self.stack.pop()
+        if type(leftvalue) is bool and type(rightvalue) is bool:
+            self.stack.append(leftvalue or rightvalue)
         else:
             vm_error("Invalid types for OR", self.pc-1)
 
-    def XOR(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_BOOL and righttype == TYPE_BOOL:
-            self.PUSH((TYPE_BOOL, leftvalue ^ rightvalue))
+    def XOR(self, arg):
+        rightvalue = self.stack.pop()
+        leftvalue = self.stack.pop()
+        if type(leftvalue) is bool and type(rightvalue) is bool:
+            self.stack.append(leftvalue ^ rightvalue)
         else:
             vm_error("Invalid types for XOR", self.pc-1)
 
-    def NEG(self,*args):
-        valtype, value = self.POP()
-        if valtype == TYPE_NUMBER:
-            self.PUSH((TYPE_NUMBER, -value))
-        else:
-            vm_error("Invalid types for NEG", self.pc-1)
-
-    def LT(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_BOOL, leftvalue < rightvalue))
-        elif lefttype == TYPE_STRING and righttype == TYPE_STRING:
-            self.PUSH((TYPE_BOOL, leftvalue < rightvalue))
-        else:
-            vm_error("Invalid types for LT", self.pc-1)
-
-    def GT(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_BOOL, leftvalue > rightvalue))
-        elif lefttype == TYPE_STRING and righttype == TYPE_STRING:
-            self.PUSH((TYPE_BOOL, leftvalue > rightvalue))
-        else:
-            vm_error("Invalid types for GT", self.pc-1)
-
-    def LE(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_BOOL, leftvalue <= rightvalue))
-        elif lefttype == TYPE_STRING and righttype == TYPE_STRING:
-            self.PUSH((TYPE_BOOL, leftvalue <= rightvalue))
+    def NOT(self, arg):
+        value = self.stack[-1]
+        if type(value) is bool:
+            self.stack[-1] = not value
         else:
-            vm_error("Invalid types for LE", self.pc-1)
-
-    def GE(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_BOOL, leftvalue >= rightvalue))
-        elif lefttype == TYPE_STRING and righttype == TYPE_STRING:
-            self.PUSH((TYPE_BOOL, leftvalue >= rightvalue))
-        else:
-            vm_error("Invalid types for GE", self.pc-1)
-
-    def EQ(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_BOOL, leftvalue == rightvalue))
-        elif lefttype == TYPE_STRING and righttype == TYPE_STRING:
-            self.PUSH((TYPE_BOOL, leftvalue == rightvalue))
-        elif lefttype == TYPE_BOOL and righttype == TYPE_BOOL:
-            self.PUSH((TYPE_BOOL, leftvalue == rightvalue))
-        else:
-            vm_error("Invalid types for EQ", self.pc-1)
+            # NOT only comes from the peephole pass; it fails like the XOR it replaces.
+            vm_error("Invalid types for XOR", self.pc-1)
 
-    def NE(self,*args):
-        righttype, rightvalue = self.POP()
-        lefttype, leftvalue = self.POP()
-        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
-            self.PUSH((TYPE_BOOL, leftvalue != rightvalue))
-        elif lefttype == TYPE_STRING and righttype == TYPE_STRING:
-            self.PUSH((TYPE_BOOL, leftvalue != rightvalue))
-        elif lefttype == TYPE_BOOL and righttype == TYPE_BOOL:
-            self.PUSH((TYPE_BOOL, leftvalue != rightvalue))
+    def NEG(self, arg):
+        value = self.stack.pop()
+        if type(value) in NUMBERS:
+            self.stack.append(-value)
         else:
-            vm_error("Invalid types for NE", self.pc-1)
-
-    def JMP(self,*args):
-        self.pc = self.labels[args[0]]
-
-    def CALL(self,*args):
-        func_name = args[0]
-        arg_count = args[1] if len(args) > 1 else 0
-        new_frame = Frame(func_name, self.pc, self.bp)
-        self.frames.append(new_frame)
-        self.bp = self.sp - arg_count + 1
-        self.pc = self.labels[func_name]
-
-    def RET(self,*args):
-        return_value = self.POP()
-        frame = self.frames.pop()
-        while self.sp >= self.bp:
-            self.POP()
-        self.bp = frame.frame_pointer
-        self.pc = frame.ret_pc
-        self.PUSH(return_value)
- 
-    def JMPZ(self,*args):
-        vatype, val = self.POP()    
-        if vatype == TYPE_BOOL and val == False:
-            self.pc = self.labels[args[0]]
-
-    def LOAD_GLOBAL(self,*args):
-        self.PUSH((self.globals[args[0]]))
-
-    def STORE_GLOBAL(self,*args):
-        self.globals[args[0]] = self.POP()
-
-    def LOAD_LOCAL(self,*args):
-        # Load local variable from stack at bp + slot
-        slot = args[0]
-        self.PUSH(self.stack[self.bp + slot])
+            vm_error("Invalid types for NEG", self.pc-1)
 
-    def STORE_LOCAL(self,*args):
-        # Store value to stack at bp + slot
-        slot = args[0]
-        value = self.POP()
-        # Extend stack if necessary
-        target_index = self.bp + slot
-        while len(self.stack) <= target_index:
-            self.stack.append(None)
-            self.sp += 1
-        self.stack[target_index] = value
\ No newline at end of file
+    def POS(self, arg):
+        value = self.stack[-1]
+        if type(value) not in NUMBERS:
+            vm_error("Invalid types for POS", self.pc-1)
+
+    def CALL_PURE(self, arg):
+        target, arg_count = arg
+        stack = self.stack
+        if self.memo is not None:
+            cache = self.memo.cache(target, self.program.functions[target])
+            key = memo_key(stack[len(stack) - arg_count:])
+            result = cache.get(key)
+            if result is not None:
+                del stack[len(stack) - arg_count:]
+                stack.append(result)
+                return
+        frame = Frame(target, self.pc, self.bp)
+        if self.memo is not None:
+            frame.memo = (cache, key)
+        self.frames.append(frame)
+        self.bp = len(stack) - arg_count
+        self.pc = target